@@ -3,7 +3,7 @@ CREATE DATABASE wishbone;
 
 CREATE TABLE game (
     game_id INT GENERATED ALWAYS AS identity (MINVALUE 1 START WITH 1 INCREMENT BY 1),
-    game_name TEXT NOT NULL,
+    game_name TEXT UNIQUE NOT NULL,
     retail_price INT NOT NULL,
     PRIMARY KEY(game_id)
 );
@@ -16,9 +16,18 @@ CREATE TABLE tracking (
     FOREIGN KEY (game_id) REFERENCES game(game_id)
 );
 
+CREATE INDEX tracking_game_id_idx ON tracking (game_id);
+
+CREATE TABLE watchlist(
+    game_id INT NOT NULL,
+    added TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(game_id),
+    FOREIGN KEY (game_id) REFERENCES game(game_id)
+);
+
 CREATE TABLE platform(
     platform_id INT GENERATED ALWAYS AS identity (MINVALUE 1 START WITH 1 INCREMENT BY 1),
-    platform_name TEXT NOT NULL,
+    platform_name TEXT UNIQUE NOT NULL,
     PRIMARY KEY(platform_id)
 );
 
@@ -35,6 +44,33 @@ CREATE TABLE listing(
     FOREIGN KEY (platform_id) REFERENCES platform(platform_id)
 );
 
+CREATE TABLE latest_price(
+    game_id INT NOT NULL,
+    platform_id INT NOT NULL,
+    price INT NOT NULL,
+    discount_percent INT NOT NULL,
+    recording_date DATE NOT NULL,
+    PRIMARY KEY(game_id, platform_id),
+    FOREIGN KEY (game_id) REFERENCES game(game_id),
+    FOREIGN KEY (platform_id) REFERENCES platform(platform_id)
+);
+
+CREATE TABLE store_product(
+    game_id INT NOT NULL,
+    platform_id INT NOT NULL,
+    store_product_id BIGINT NOT NULL,
+    store_title TEXT NOT NULL,
+    PRIMARY KEY(game_id, platform_id),
+    FOREIGN KEY (game_id) REFERENCES game(game_id),
+    FOREIGN KEY (platform_id) REFERENCES platform(platform_id)
+);
+
+CREATE TABLE export_watermark(
+    table_name TEXT NOT NULL,
+    last_id BIGINT NOT NULL,
+    exported_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY(table_name)
+);
 
 CREATE TABLE user(
     user_id INT GENERATED ALWAYS AS identity (MINVALUE 1 START WITH 1 INCREMENT BY 1),
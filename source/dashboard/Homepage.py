@@ -5,43 +5,22 @@ from dotenv import load_dotenv
 import pandas as pd
 import awswrangler as wr
 from backend import get_boto3_session
+from queries import max_price_query
 
 
 S3_BUCKET_NAME = environ["BUCKET_NAME"]
 
 LOGO_IMG_PATH = "https://raw.githubusercontent.com/DevMjee/wishbone/refs/heads/main/assets/logo.png"
 NUM_PER_PAGE = 10
+# days of listings the max (normal) price of a game is taken over
+HISTORY_DAYS = int(environ.get("HOMEPAGE_HISTORY_DAYS", 90))
 
 
 @st.cache_data()
 def create_max_price_column() -> pd.DataFrame:
     """queries the Glue DB via Athena to return the games where the current price is less than
-    the normal price, by creating a column for max price for each game"""
-    query = """
-        WITH 
-            price_cte AS 
-            (SELECT game_id, price, recording_date, platform_id, max(price) over (partition by game_id) AS max_price
-        FROM 
-            listing)
-        SELECT 
-            g.game_name, price_cte.recording_date, price_cte.price, p.platform_name, price_cte.max_price
-        FROM 
-            price_cte
-        JOIN 
-            game g 
-        ON 
-            price_cte.game_id = g.game_id
-        JOIN 
-            platform p 
-        ON 
-            price_cte.platform_id = p.platform_id
-        WHERE 
-            price_cte.price < price_cte.max_price
-        ORDER BY 
-            price_cte.recording_date 
-        DESC;
-        
-"""
+    the normal price, by creating a column for max price for each game over the last HISTORY_DAYS"""
+    query = max_price_query(HISTORY_DAYS)
     game_id_df = wr.athena.read_sql_query(
         query, database="wishbone-glue-db", boto3_session=session)
 
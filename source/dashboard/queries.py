@@ -0,0 +1,79 @@
+"Athena queries behind the homepage, apart from streamlit and AWS so they can be tested"
+from datetime import date, datetime, timedelta, timezone
+from os import environ
+
+# the pipeline writes an unchanged price again after this many days, so every listed game
+# and platform has a listing in any run of this many days. Must not be less than the pipeline's
+HEARTBEAT_DAYS = max(int(environ.get("HEARTBEAT_DAYS", "7")), 1)
+
+
+def days_before(day: date, count: int) -> list[date]:
+    """the count days up to and including day, oldest first"""
+    return [day - timedelta(days=offset) for offset in range(count - 1, -1, -1)]
+
+
+def day_partitions(days: list[date]) -> str:
+    """Athena condition matching the year/month/day partitions of the days,
+    so other listings are not read"""
+    months = {}
+    for day in days:
+        months.setdefault((day.year, day.month), []).append(str(day.day))
+    return " OR ".join(f"(year = {year} AND month = {month} AND day IN ({', '.join(month_days)}))"
+                       for (year, month), month_days in months.items())
+
+
+def recent_partitions(days: int) -> str:
+    """Athena condition matching the year/month/day partitions of the most recent days,
+    so older listings are not read"""
+    return day_partitions(days_before(datetime.now(timezone.utc).date(), days))
+
+
+def max_price_query(days: int) -> str:
+    """Query for the latest listings cheaper than the highest price of their game over the
+    last days. Listings are only written when the price changes or the heartbeat is due, so
+    the last listing of each game and platform from the HEARTBEAT_DAYS before them is read too,
+    as the price they started at"""
+    first_day = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    lookback = days_before(first_day - timedelta(days=1), HEARTBEAT_DAYS)
+    return f"""
+        WITH
+            listings AS
+            (SELECT game_id, price, recording_date, platform_id
+        FROM
+            listing
+        WHERE
+            {recent_partitions(days)}
+        UNION ALL
+        SELECT game_id, price, recording_date, platform_id
+        FROM
+            (SELECT game_id, price, recording_date, platform_id,
+                row_number() over (partition by game_id, platform_id order by recording_date DESC) AS recency
+            FROM
+                listing
+            WHERE
+                {day_partitions(lookback)}) earlier
+        WHERE
+            recency = 1),
+            price_cte AS
+            (SELECT game_id, price, recording_date, platform_id, max(price) over (partition by game_id) AS max_price
+        FROM
+            listings)
+        SELECT
+            g.game_name, price_cte.recording_date, price_cte.price, p.platform_name, price_cte.max_price
+        FROM
+            price_cte
+        JOIN
+            game g
+        ON
+            price_cte.game_id = g.game_id
+        JOIN
+            platform p
+        ON
+            price_cte.platform_id = p.platform_id
+        WHERE
+            price_cte.price < price_cte.max_price
+        ORDER BY
+            price_cte.recording_date
+        DESC;
+
+"""
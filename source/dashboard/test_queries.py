@@ -0,0 +1,102 @@
+"""Tests for the Athena queries behind the homepage"""
+
+from datetime import date, datetime, timezone
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from queries import days_before, day_partitions, recent_partitions, max_price_query
+
+TODAY = datetime(2026, 1, 2, 9, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def athena():
+    """In memory stand-in for the listing, game and platform tables Athena reads"""
+    db = sqlite3.connect(":memory:")
+    db.execute("""CREATE TABLE listing (game_id INT, platform_id INT, recording_date TEXT, price INT,
+                  year INT, month INT, day INT)""")
+    db.execute("CREATE TABLE game (game_id INT, game_name TEXT)")
+    db.execute("CREATE TABLE platform (platform_id INT, platform_name TEXT)")
+    db.executemany("INSERT INTO game VALUES (?, ?)", [(1, "Hades"), (2, "Celeste")])
+    db.executemany("INSERT INTO platform VALUES (?, ?)", [(1, "steam"), (2, "gog")])
+    yield db
+    db.close()
+
+
+def add_listing(db, game_id: int, platform_id: int, day: date, price: int) -> None:
+    db.execute("INSERT INTO listing VALUES (?, ?, ?, ?, ?, ?, ?)",
+               (game_id, platform_id, day.isoformat(), price, day.year, day.month, day.day))
+
+
+def test_days_before_across_year():
+    assert days_before(date(2026, 1, 1), 3) == [date(2025, 12, 30), date(2025, 12, 31), date(2026, 1, 1)]
+
+
+def test_day_partitions_one_month():
+    assert day_partitions([date(2025, 3, 4), date(2025, 3, 5)]) == "(year = 2025 AND month = 3 AND day IN (4, 5))"
+
+
+@patch("queries.datetime")
+def test_recent_partitions_across_month_and_year(mock_datetime):
+    mock_datetime.now.return_value = TODAY
+
+    assert recent_partitions(4) == ("(year = 2025 AND month = 12 AND day IN (30, 31)) "
+                                    "OR (year = 2026 AND month = 1 AND day IN (1, 2))")
+
+
+@patch("queries.HEARTBEAT_DAYS", 3)
+@patch("queries.datetime")
+def test_max_price_query_looks_back_one_heartbeat(mock_datetime):
+    mock_datetime.now.return_value = TODAY
+
+    query = max_price_query(2)
+
+    # the days before the window, and nothing older
+    assert "(year = 2025 AND month = 12 AND day IN (29, 30, 31))" in query
+    assert "year <" not in query
+
+
+@patch("queries.datetime")
+def test_max_price_query_discount_after_unchanged_price(mock_datetime, athena):
+    mock_datetime.now.return_value = TODAY
+    # the last heartbeat of the normal price, before the days
+    add_listing(athena, 1, 1, date(2025, 12, 24), 2000)
+    add_listing(athena, 1, 1, date(2026, 1, 2), 1500)
+
+    rows = athena.execute(max_price_query(7)).fetchall()
+
+    assert rows == [("Hades", "2026-01-02", 1500, "steam", 2000)]
+
+
+@patch("queries.datetime")
+def test_max_price_query_unchanged_discount(mock_datetime, athena):
+    mock_datetime.now.return_value = TODAY
+    # normal price on gog within the days, steam discounted before them
+    add_listing(athena, 1, 1, date(2025, 12, 25), 1000)
+    add_listing(athena, 1, 2, date(2025, 12, 30), 2000)
+
+    rows = athena.execute(max_price_query(7)).fetchall()
+
+    assert rows == [("Hades", "2025-12-25", 1000, "steam", 2000)]
+
+
+@patch("queries.datetime")
+def test_max_price_query_only_last_listing_before_days(mock_datetime, athena):
+    mock_datetime.now.return_value = TODAY
+    add_listing(athena, 2, 1, date(2025, 12, 20), 3000)
+    add_listing(athena, 2, 1, date(2025, 12, 24), 1000)
+    add_listing(athena, 2, 1, date(2026, 1, 1), 1000)
+
+    assert athena.execute(max_price_query(7)).fetchall() == []
+
+
+@patch("queries.datetime")
+def test_max_price_query_skips_listings_older_than_heartbeat(mock_datetime, athena):
+    mock_datetime.now.return_value = TODAY
+    # past the heartbeat before the days, the pipeline has written a newer listing since
+    add_listing(athena, 2, 1, date(2025, 6, 1), 3000)
+    add_listing(athena, 2, 1, date(2026, 1, 1), 1000)
+
+    assert athena.execute(max_price_query(7)).fetchall() == []
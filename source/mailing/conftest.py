@@ -0,0 +1,6 @@
+"""Puts source/pipeline on the path for metrics.py, the images copy it in at build time"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline'))
@@ -1,59 +1,178 @@
 """Lambda function checking for extracting the latest discounts from the S3"""
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone
 from os import environ
+from typing import TYPE_CHECKING
 from psycopg2.extensions import connection
-from psycopg2 import connect
+from psycopg2 import connect, Error
 from dotenv import load_dotenv
-import pandas as pd
-import awswrangler
-import boto3
 from html_email import create_html_email
+import metrics
 
-load_dotenv()
+# awswrangler (and the pandas it brings) and boto3 are slow to import,
+# so they are imported where they are used
+if TYPE_CHECKING:
+    import pandas as pd
 
+load_dotenv()
 
-def get_games_price_dropped() -> pd.DataFrame:
-    """gets the ids and name of the games that have dropped in price"""
-    athena_query = """WITH price_cte AS (
-            SELECT game_id, recording_date, price, 
-            LAG(price) OVER (PARTITION BY game_id ORDER BY recording_date) as prev_price
+# created once per container and reused by warm invocations
+CLIENTS = {}
+
+# days of listings compared for price drops, today's and the day before's by default
+PRICE_DROP_DAYS = int(environ.get("PRICE_DROP_DAYS", 2))
+# must match GAME_BUCKETS of the historical pipeline, listings are stored by game_id % GAME_BUCKETS
+GAME_BUCKETS = int(environ.get("GAME_BUCKETS", 8))
+# the pipeline writes an unchanged price again after this many days, so the price before
+# the days compared is in the HEARTBEAT_DAYS before them. Must not be less than the pipeline's
+HEARTBEAT_DAYS = max(int(environ.get("HEARTBEAT_DAYS", 7)), 1)
+
+
+def days_before(day: date, count: int) -> list[date]:
+    """the count days up to and including day, oldest first"""
+    return [day - timedelta(days=offset) for offset in range(count - 1, -1, -1)]
+
+
+def recent_days(count: int) -> list[date]:
+    """the last count days up to today (UTC), oldest first"""
+    return days_before(datetime.now(timezone.utc).date(), count)
+
+
+def game_filter(game_ids: list[int]) -> str:
+    """Athena condition on the game bucket folders and the games in them"""
+    buckets = sorted({game_id % GAME_BUCKETS for game_id in game_ids})
+    return (f"game_bucket IN ({', '.join(map(str, buckets))}) "
+            f"AND game_id IN ({', '.join(map(str, game_ids))})")
+
+
+def partition_filter(days: list[date], game_ids: list[int]) -> str:
+    """
+    Athena condition on the listing partitions holding these days and games,
+    so only their folders are read instead of the whole table
+    """
+    months = {}
+    for day in days:
+        months.setdefault((day.year, day.month), []).append(str(day.day))
+    dates = " OR ".join(f"(year = {year} AND month = {month} AND day IN ({', '.join(month_days)}))"
+                        for (year, month), month_days in months.items())
+    return f"({dates}) AND {game_filter(game_ids)}"
+
+
+def price_drop_query(days: list[date], game_ids: list[int]) -> str:
+    """
+    Query for the listings of these days cheaper than the one before them on the same platform.
+    Listings are only written when the price changes or the heartbeat is due, so the last
+    listing of each game and platform from the HEARTBEAT_DAYS before the days is read with them,
+    from the buckets of these games only
+    """
+    lookback = days_before(days[0] - timedelta(days=1), HEARTBEAT_DAYS)
+    return f"""WITH listings AS (
+            SELECT game_id, platform_id, recording_date, price, 1 AS in_window
             FROM listing
+            WHERE {partition_filter(days, game_ids)}
+            UNION ALL
+            SELECT game_id, platform_id, recording_date, price, 0 AS in_window
+            FROM (
+                SELECT game_id, platform_id, recording_date, price,
+                ROW_NUMBER() OVER (PARTITION BY game_id, platform_id ORDER BY recording_date DESC) AS recency
+                FROM listing
+                WHERE {partition_filter(lookback, game_ids)}
+            ) earlier
+            WHERE recency = 1
+            ),
+            price_cte AS (
+            SELECT game_id, price, in_window,
+            LAG(price) OVER (PARTITION BY game_id, platform_id ORDER BY recording_date) as prev_price
+            FROM listings
             )
             SELECT DISTINCT g.game_id, g.game_name, price_cte.price as new_price, price_cte.prev_price as old_price
-                FROM price_cte 
-            JOIN game g on 
+                FROM price_cte
+            JOIN game g on
                 price_cte.game_id = g.game_id
-            WHERE price < prev_price"""
+            WHERE in_window = 1 AND price < prev_price"""
+
+
+def get_tracked_game_ids() -> list[int]:
+    """gets the ids of every game someone is tracking"""
+    conn = get_db_connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT game_id FROM wishbone.tracking")
+        game_ids = sorted(int(game_id) for (game_id,) in cur.fetchall())
+    conn.rollback()
+    metrics.count("DbRoundTrips")
+
+    return game_ids
+
 
-    session = boto3.Session(aws_access_key_id=environ["ACCESS_KEY_ID"],
-                            aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY_ID"], region_name='eu-west-2')
+def get_games_price_dropped(game_ids: list[int]) -> pd.DataFrame:
+    """gets the ids and name of the tracked games that have dropped in price in the last PRICE_DROP_DAYS"""
+    athena_query = price_drop_query(recent_days(PRICE_DROP_DAYS), game_ids)
 
-    game_id_df = awswrangler.athena.read_sql_query(
-        athena_query, database="wishbone-glue-db", boto3_session=session)
+    import awswrangler
+
+    with metrics.timer("StageTime", Stage="athena"):
+        game_id_df = awswrangler.athena.read_sql_query(
+            athena_query, database="wishbone-glue-db", boto3_session=get_boto3_session())
+    metrics.count("GamesDropped", len(game_id_df))
 
     return game_id_df
 
 
-def get_db_connection() -> connection:
-    """Returns a live connection from the database."""
-    return connect(
-        host=environ['RDS_HOST'],
-        port=environ['PORT'],
-        user=environ['RDS_USERNAME'],
-        password=environ['RDS_PASSWORD'],
-        dbname=environ['DB_NAME']
-    )
+def get_boto3_session():
+    """Returns the boto3 session for Athena, created on first use"""
+    if "session" not in CLIENTS:
+        import boto3
+        CLIENTS["session"] = boto3.Session(aws_access_key_id=environ["ACCESS_KEY_ID"],
+                                           aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY_ID"],
+                                           region_name='eu-west-2')
+    return CLIENTS["session"]
+
+
+def get_ses_client():
+    """Returns the SES client, created on first use"""
+    if "ses" not in CLIENTS:
+        import boto3
+        CLIENTS["ses"] = boto3.client("ses", region_name="eu-west-2")
+    return CLIENTS["ses"]
 
 
-def get_emails_for_dropped_price(g_id: int) -> pd.DataFrame:
+def get_db_connection() -> connection:
+    """Returns a live connection from the database, reusing the last one while it answers SELECT 1."""
+    if CLIENTS.get("db") is not None and not CLIENTS["db"].closed:
+        try:
+            with CLIENTS["db"].cursor() as cur:
+                cur.execute("SELECT 1")
+            CLIENTS["db"].rollback()
+        except Error:
+            # dropped while the container was idle
+            CLIENTS["db"].close()
+    if CLIENTS.get("db") is None or CLIENTS["db"].closed:
+        CLIENTS["db"] = connect(
+            host=environ['RDS_HOST'],
+            port=environ['PORT'],
+            user=environ['RDS_USERNAME'],
+            password=environ['RDS_PASSWORD'],
+            dbname=environ['DB_NAME']
+        )
+    return CLIENTS["db"]
+
+
+def get_emails_for_dropped_price(g_id: int) -> list[str]:
     """gets the emails of the people tracking games"""
     conn = get_db_connection()
     query = """SELECT email
                         FROM wishbone.tracking
                     WHERE game_id = %s
                     """
-    emails_df = pd.read_sql(query, con=conn, params=(g_id,))
+    with conn.cursor() as cur:
+        cur.execute(query, (int(g_id),))
+        emails = [email for (email,) in cur.fetchall()]
+    # ends the read transaction, so the connection is clean for the next invocation
+    conn.rollback()
+    metrics.count("DbRoundTrips")
 
-    return emails_df
+    return emails
 
 
 def get_all_emails_with_game(game_id_df: pd.DataFrame) -> list[dict]:
@@ -67,9 +186,7 @@ def get_all_emails_with_game(game_id_df: pd.DataFrame) -> list[dict]:
         new_price = row["new_price"]
         old_price = row["old_price"]
 
-        emails_df = get_emails_for_dropped_price(game_id)
-
-        list_emails = emails_df['email'].tolist()
+        list_emails = get_emails_for_dropped_price(game_id)
 
         game_email_list.append(
             {"game_id": game_id, "game_name": game_name, "new_price": new_price, "old_price": old_price, "emails": list_emails})
@@ -89,9 +206,7 @@ def send_out_email(email_address, email_body, game_name):
     """sends the HTML email using boto3 to alert on drop of price"""
     SENDER_EMAIL = environ["SENDER_EMAIL"]
     CHARSET = "UTF-8"
-    ses_client = boto3.client("ses", region_name="eu-west-2")
-
-    ses_client.send_email(
+    get_ses_client().send_email(
         Source=SENDER_EMAIL,
         Destination={"ToAddresses": [email_address]},
         Message={
@@ -111,12 +226,26 @@ def send_out_email(email_address, email_body, game_name):
 
 def lambda_handler(event, context):
     """performs an athena query, a rds query and then sends emails if necessary """
-    games_df = get_games_price_dropped()
+    try:
+        return send_price_drop_emails()
+    finally:
+        metrics.flush(Function="mailing")
+
+
+def send_price_drop_emails() -> dict:
+    """finds the games that dropped in price and emails everyone tracking them"""
+    game_ids = get_tracked_game_ids()
+
+    if not game_ids:
+        return {"message": "No games are tracked"}
+
+    games_df = get_games_price_dropped(game_ids)
 
     if games_df.empty:
         return {"message": "No games dropped in price"}
 
-    price_dropped_emails = get_all_emails_with_game(games_df)
+    with metrics.timer("StageTime", Stage="rds"):
+        price_dropped_emails = get_all_emails_with_game(games_df)
 
     print(price_dropped_emails)
 
@@ -134,10 +263,12 @@ def lambda_handler(event, context):
 
         for email in emails:
 
-            send_out_email(email, email_body, game_name)
+            with metrics.timer("SendTime"):
+                send_out_email(email, email_body, game_name)
 
             total_sent += 1
 
+    metrics.count("EmailsSent", total_sent)
     return {"message": f"Sent {total_sent} emails"}
 
 
@@ -0,0 +1,128 @@
+"""Tests for finding the price drops to email about"""
+
+from datetime import date, datetime, timedelta, timezone
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from mailing import recent_days, partition_filter, price_drop_query
+
+
+@pytest.fixture
+def athena():
+    """In memory stand-in for the listing and game tables Athena reads"""
+    db = sqlite3.connect(":memory:")
+    db.execute("""CREATE TABLE listing (game_id INT, platform_id INT, recording_date TEXT, price INT,
+                  year INT, month INT, day INT, game_bucket INT)""")
+    db.execute("CREATE TABLE game (game_id INT, game_name TEXT)")
+    db.executemany("INSERT INTO game VALUES (?, ?)", [(1, "Hades"), (2, "Celeste"), (9, "Balatro")])
+    yield db
+    db.close()
+
+
+def add_listing(db, game_id: int, platform_id: int, day: date, price: int) -> None:
+    db.execute("INSERT INTO listing VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+               (game_id, platform_id, day.isoformat(), price, day.year, day.month, day.day, game_id % 8))
+
+
+def price_drops(db, days: list[date], game_ids: list[int]) -> list[tuple]:
+    return sorted(db.execute(price_drop_query(days, game_ids)).fetchall())
+
+
+@patch("mailing.datetime")
+def test_recent_days_across_month_and_year(mock_datetime):
+    mock_datetime.now.return_value = datetime(2026, 1, 1, 9, tzinfo=timezone.utc)
+
+    assert recent_days(3) == [date(2025, 12, 30), date(2025, 12, 31), date(2026, 1, 1)]
+
+
+def test_partition_filter_one_month():
+    assert partition_filter([date(2025, 3, 4), date(2025, 3, 5)], [1, 9]) == (
+        "((year = 2025 AND month = 3 AND day IN (4, 5))) AND game_bucket IN (1) AND game_id IN (1, 9)")
+
+
+def test_partition_filter_across_month_and_year():
+    result = partition_filter([date(2025, 12, 31), date(2026, 1, 1)], [3])
+
+    assert result.startswith(
+        "((year = 2025 AND month = 12 AND day IN (31)) OR (year = 2026 AND month = 1 AND day IN (1)))")
+
+
+@patch("mailing.GAME_BUCKETS", 4)
+def test_partition_filter_buckets_of_tracked_games():
+    assert partition_filter([date(2025, 3, 4)], [2, 5, 6, 9]).endswith(
+        "game_bucket IN (1, 2) AND game_id IN (2, 5, 6, 9)")
+
+
+@patch("mailing.HEARTBEAT_DAYS", 3)
+def test_price_drop_query_looks_back_one_heartbeat():
+    query = price_drop_query([date(2026, 1, 1), date(2026, 1, 2)], [1])
+
+    # the days before the window, and nothing older
+    assert "((year = 2025 AND month = 12 AND day IN (29, 30, 31))) AND game_bucket IN (1)" in query
+    assert "year <" not in query
+
+
+def add_unchanged_price(db, game_id: int, platform_id: int, first: date, last: date, price: int) -> None:
+    """A price that did not change from first to last, written again every heartbeat as the pipeline does"""
+    day = first
+    while day <= last:
+        add_listing(db, game_id, platform_id, day, price)
+        day += timedelta(days=7)
+
+
+def test_price_drop_after_long_unchanged_price(athena):
+    add_unchanged_price(athena, 1, 1, date(2025, 1, 10), date(2025, 6, 30), 2000)
+    add_listing(athena, 1, 1, date(2025, 7, 2), 1500)
+
+    assert price_drops(athena, [date(2025, 7, 1), date(2025, 7, 2)], [1]) == [(1, "Hades", 1500, 2000)]
+
+
+def test_price_drop_uses_last_listing_before_days(athena):
+    add_listing(athena, 1, 1, date(2025, 6, 25), 1000)
+    add_listing(athena, 1, 1, date(2025, 6, 28), 2500)
+    add_listing(athena, 1, 1, date(2025, 7, 2), 2000)
+
+    assert price_drops(athena, [date(2025, 7, 1), date(2025, 7, 2)], [1]) == [(1, "Hades", 2000, 2500)]
+
+
+def test_price_drop_ignores_listings_older_than_heartbeat(athena):
+    # past the heartbeat, the pipeline has written a newer listing since
+    add_listing(athena, 1, 1, date(2025, 1, 10), 2000)
+    add_listing(athena, 1, 1, date(2025, 7, 2), 1500)
+
+    assert price_drops(athena, [date(2025, 7, 1), date(2025, 7, 2)], [1]) == []
+
+
+def test_price_drop_within_days(athena):
+    add_listing(athena, 2, 1, date(2025, 6, 30), 900)
+    add_listing(athena, 2, 1, date(2025, 7, 1), 800)
+
+    assert price_drops(athena, [date(2025, 6, 30), date(2025, 7, 1)], [2]) == [(2, "Celeste", 800, 900)]
+
+
+def test_no_price_drop_for_rise_or_old_drop(athena):
+    # dropped before the days, then rose
+    add_listing(athena, 1, 1, date(2025, 6, 24), 2000)
+    add_listing(athena, 1, 1, date(2025, 6, 27), 1000)
+    add_listing(athena, 1, 1, date(2025, 7, 2), 1200)
+    # first listing of a game is not a drop
+    add_listing(athena, 2, 1, date(2025, 7, 2), 500)
+
+    assert price_drops(athena, [date(2025, 7, 1), date(2025, 7, 2)], [1, 2]) == []
+
+
+def test_price_drop_compares_the_same_platform(athena):
+    add_listing(athena, 1, 1, date(2025, 6, 28), 1000)
+    add_listing(athena, 1, 2, date(2025, 7, 2), 1500)
+    add_listing(athena, 1, 2, date(2025, 7, 1), 1800)
+
+    assert price_drops(athena, [date(2025, 7, 1), date(2025, 7, 2)], [1]) == [(1, "Hades", 1500, 1800)]
+
+
+def test_price_drop_only_tracked_games(athena):
+    add_listing(athena, 9, 1, date(2025, 6, 28), 2000)
+    add_listing(athena, 9, 1, date(2025, 7, 2), 1000)
+
+    assert price_drops(athena, [date(2025, 7, 1), date(2025, 7, 2)], [1]) == []
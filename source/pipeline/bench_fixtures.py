@@ -0,0 +1,148 @@
+"""Synthetic store responses for the benchmarks, shaped like recorded Steam and GOG responses"""
+
+import json
+import random
+
+
+SEED = 20251201
+# the markup above the first result, Steam sends roughly this much navigation
+# and script before the search rows begin
+STEAM_HEADER_BYTES = 60_000
+STEAM_RESULTS_PER_PAGE = 25
+GOG_RESULTS_PER_PAGE = 48
+
+STEAM_HEADER = ('<!DOCTYPE html><html><head><title>Steam Search</title></head><body>'
+                '<div id="global_header"><div class="content">')
+STEAM_FILLER = '<div class="menuitem supernav" data-tooltip-type="selector">Store</div>\n'
+STEAM_ROW = (
+    '<a href="https://store.steampowered.com/app/{app_id}/{slug}/" data-ds-appid="{app_id}" '
+    'data-ds-itemkey="App_{app_id}" class="search_result_row ds_collapse_flag">'
+    '<div class="col search_capsule"><img src="https://shared.cloudflare.steamstatic.com/'
+    'store_item_assets/steam/apps/{app_id}/capsule_sm_120.jpg"></div>'
+    '<div class="responsive_search_name_combined">'
+    '<div class="search_name ellipsis"><span class="title">{title}</span>'
+    '<div><span class="platform_img win"></span></div></div>'
+    '<div class="search_released responsive_secondrow">24 Feb, 2016</div>'
+    '<div class="search_reviewscore responsive_secondrow">'
+    '<span class="search_review_summary positive" data-tooltip-html="Overwhelmingly Positive"></span></div>'
+    '<div class="search_price_discount_combined responsive_secondrow">'
+    '<div class="search_discount_and_price responsive_secondrow">{price_block}</div></div></div></a>\n'
+)
+STEAM_DISCOUNTED = ('<div class="discount_block search_discount_block" data-price-final="{final}">'
+                    '<div class="discount_pct">-{percent}%</div><div class="discount_prices">'
+                    '<div class="discount_original_price">£{base_text}</div>'
+                    '<div class="discount_final_price">£{final_text}</div></div></div>')
+STEAM_FULL_PRICE = ('<div class="discount_block search_discount_block no_discount" data-price-final="{final}">'
+                    '<div class="discount_prices"><div class="discount_final_price">£{final_text}</div>'
+                    '</div></div>')
+STEAM_FOOTER = '</div></div></body></html>'
+
+
+def game_titles(count: int) -> list[str]:
+    """Distinct, repeatable game titles"""
+    return [f'Benchmark Game {number:05d}' for number in range(count)]
+
+
+def title_rng(title: str) -> random.Random:
+    """Random numbers fixed per title, so every request for a title gets the same prices"""
+    return random.Random(f'{SEED}:{title}')
+
+
+def title_prices(title: str) -> tuple[int, int]:
+    """(base, final) price in pence, about a third of titles on sale"""
+    rng = title_rng(title)
+    base = rng.choice([499, 999, 1499, 1999, 2499, 3499, 4999, 5999])
+    if rng.random() < 1 / 3:
+        return base, int(base * (1 - rng.choice([10, 20, 25, 33, 50, 75]) / 100))
+    return base, base
+
+
+def store_id(title: str, store: str) -> int:
+    """Repeatable app / product id for a title"""
+    return title_rng(f'{store}:{title}').randrange(10_000, 3_000_000)
+
+
+def pounds(pence: int) -> str:
+    return f'{pence // 100}.{pence % 100:02d}'
+
+
+def steam_row(title: str) -> str:
+    """One Steam search result row"""
+    base, final = title_prices(title)
+    if final < base:
+        price_block = STEAM_DISCOUNTED.format(final=final, percent=round((1 - final / base) * 100),
+                                              base_text=pounds(base), final_text=pounds(final))
+    else:
+        price_block = STEAM_FULL_PRICE.format(final=final, final_text=pounds(final))
+    return STEAM_ROW.format(app_id=store_id(title, 'steam'), slug=title.replace(' ', '_'),
+                            title=title, price_block=price_block)
+
+
+def steam_search_page(term: str, results: int = STEAM_RESULTS_PER_PAGE) -> str:
+    """A Steam search page whose first result is the searched title, followed by near misses"""
+    filler = STEAM_FILLER * (STEAM_HEADER_BYTES // len(STEAM_FILLER))
+    rows = [steam_row(term)] + [steam_row(f'{term} Soundtrack {number}')
+                                for number in range(results - 1)]
+    return STEAM_HEADER + filler + ''.join(rows) + STEAM_FOOTER
+
+
+def steam_appdetails(app_titles: dict[int, str]) -> str:
+    """Steam appdetails price_overview response for {app id: title}"""
+    response = {}
+    for app_id, title in app_titles.items():
+        base, final = title_prices(title)
+        response[str(app_id)] = {'success': True, 'data': {'price_overview': {
+            'currency': 'GBP', 'initial': base, 'final': final,
+            'discount_percent': round((1 - final / base) * 100)}}}
+    return json.dumps(response)
+
+
+def gog_product(title: str) -> dict:
+    """One GOG catalog product, priced in USD as the catalog endpoint is"""
+    base, final = title_prices(title)
+    # pence to cents at a fixed rate, the pipeline converts back
+    return {'id': str(store_id(title, 'gog')), 'title': title,
+            'price': {'base': f'${pounds(int(base * 1.25))}',
+                      'final': f'${pounds(int(final * 1.25))}'},
+            'developers': ['Benchmark Studio'], 'releaseDate': '2016.02.26',
+            'productType': 'game', 'coverHorizontal': 'https://images.gog-statics.com/cover.jpg'}
+
+
+def gog_catalog(term: str, results: int = GOG_RESULTS_PER_PAGE) -> str:
+    """GOG catalog search response whose first product is the searched title"""
+    products = [gog_product(term)] + [gog_product(f'{term} Soundtrack {number}')
+                                      for number in range(results - 1)]
+    return json.dumps({'pages': 1, 'productCount': results, 'products': products})
+
+
+def gog_prices(product_titles: dict[int, str]) -> str:
+    """GOG products/prices response for {product id: title}, in the same USD as the catalog"""
+    items = []
+    for product_id, title in product_titles.items():
+        base, final = title_prices(title)
+        items.append({'_embedded': {'product': {'id': product_id}, 'prices': [
+            {'currency': {'code': 'USD'}, 'basePrice': f'{int(base * 1.25)} USD',
+             'finalPrice': f'{int(final * 1.25)} USD'}]}})
+    return json.dumps({'_embedded': {'items': items}})
+
+
+def raw_listings(titles: list[str]) -> list[dict]:
+    """Listings as the extract returns them, with one in ten titles unmatched"""
+    listings = []
+    for number, title in enumerate(titles):
+        if number % 10 == 9:
+            listings.append({})
+            continue
+        base, final = title_prices(title)
+        listings.append({'name': title, 'base_price_gbp_pence': base,
+                         'final_price_gbp_pence': final})
+    return listings
+
+
+def price_strings(titles: list[str]) -> list[str]:
+    """Price text as it appears on the store pages"""
+    strings = []
+    for title in titles:
+        base, final = title_prices(title)
+        strings.extend([f'£{pounds(base)}', f'${pounds(final)}', 'Free'])
+    return strings
@@ -0,0 +1,146 @@
+"""Local stand-in for the Steam and GOG endpoints, with configurable latency and throttling"""
+
+import asyncio
+from contextlib import ExitStack
+import random
+import threading
+import time
+from unittest.mock import patch
+
+from aiohttp import web
+
+import bench_fixtures
+
+
+class StandInServer:
+    """
+    Serves the store endpoints the extract calls from a background thread.
+    Each response waits latency seconds (give or take jitter), and once requests
+    arrive faster than throttle_rate per second they get a 429 with Retry-After
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5,
+                 throttle_rate: float = 0, retry_after: float = 1):
+        self.latency = latency
+        self.jitter = jitter  # fraction of latency added or removed at random
+        self.throttle_rate = throttle_rate  # 0 never throttles
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        # {store: {id: title}} the price endpoints can answer for
+        self.known_ids: dict[str, dict[int, str]] = {}
+        self.tokens = throttle_rate
+        self.updated = time.monotonic()
+        self.port = None
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    def throttle(self) -> bool:
+        """Token bucket of one second's worth of requests, True when this request is over the limit"""
+        if not self.throttle_rate:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.throttle_rate, self.tokens +
+                          (now - self.updated) * self.throttle_rate)
+        self.updated = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+
+    async def respond(self, body: str, content_type: str) -> web.Response:
+        self.requests += 1
+        if self.throttle():
+            self.throttled += 1
+            return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+        await asyncio.sleep(self.latency * (1 + random.uniform(-self.jitter, self.jitter)))
+        return web.Response(text=body, content_type=content_type)
+
+    async def steam_search(self, request: web.Request) -> web.Response:
+        return await self.respond(bench_fixtures.steam_search_page(request.query['term']), 'text/html')
+
+    async def steam_appdetails(self, request: web.Request) -> web.Response:
+        return await self.respond(bench_fixtures.steam_appdetails(self.titles_for(request, 'appids', 'steam')),
+                                  'application/json')
+
+    async def gog_catalog(self, request: web.Request) -> web.Response:
+        term = request.query['query'].removeprefix('like:')
+        return await self.respond(bench_fixtures.gog_catalog(term), 'application/json')
+
+    async def gog_prices(self, request: web.Request) -> web.Response:
+        return await self.respond(bench_fixtures.gog_prices(self.titles_for(request, 'ids', 'gog')),
+                                  'application/json')
+
+    def titles_for(self, request: web.Request, parameter: str, store: str) -> dict[int, str]:
+        """Titles of the ids asked for, the ids the fixtures hand out are only known from the searches"""
+        ids = {int(value) for value in request.query[parameter].split(',')}
+        return {store_id: title for store_id, title in self.known_ids.get(store, {}).items()
+                if store_id in ids}
+
+    def remember_titles(self, titles: list[str]) -> None:
+        """Let the price endpoints answer for these titles"""
+        for store in ('steam', 'gog'):
+            self.known_ids.setdefault(store, {}).update(
+                {bench_fixtures.store_id(title, store): title for title in titles})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/search', self.steam_search)
+        app.router.add_get('/api/appdetails', self.steam_appdetails)
+        app.router.add_get('/v1/catalog', self.gog_catalog)
+        app.router.add_get('/products/prices', self.gog_prices)
+        return app
+
+    def start(self) -> 'StandInServer':
+        """Start serving on a free port, returning once it accepts connections"""
+        started = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.runner = web.AppRunner(self.app(), access_log=None)
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, '127.0.0.1', 0)
+            self.loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def __enter__(self) -> 'StandInServer':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def store_urls(self) -> dict[str, str]:
+        """
+        extract's endpoint constants pointed at this server. Steam is reached as
+        localhost and GOG as 127.0.0.1, so each store keeps its own rate limiter
+        """
+        steam = f'http://localhost:{self.port}'
+        gog = f'http://127.0.0.1:{self.port}'
+        return {
+            'STEAM_SEARCH': f'{steam}/search?term={{search_term}}',
+            'STEAM_PRICES': f'{steam}/api/appdetails?appids={{app_ids}}&cc=gb&filters=price_overview',
+            'GOG_SEARCH': f'{gog}/v1/catalog?limit=48&query=like%3A{{search_term}}',
+            'GOG_PRICES': f'{gog}/products/prices?ids={{product_ids}}&countryCode=US&currency=USD'
+        }
+
+    def patch_extract(self) -> ExitStack:
+        """Context manager sending the extract's requests here"""
+        stack = ExitStack()
+        for name, url in self.store_urls().items():
+            stack.enter_context(patch(f'extract.{name}', url))
+        return stack
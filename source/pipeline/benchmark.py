@@ -0,0 +1,330 @@
+"""
+Offline benchmarks for the extract, transform and load hot paths.
+
+Runs each stage on synthetic titles at several sizes and worker counts and writes
+the timings to a JSON file that later runs can be compared against, e.g.
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+
+The load benchmarks need a throwaway local Postgres named by the usual RDS_* variables
+(--postgres), its wishbone schema is dropped and rebuilt from database/schema.sql.
+The scrape benchmark runs against a local stand-in for the store endpoints (--scrape).
+Every run also times a cold import of each Lambda handler
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+import bench_fixtures
+from bench_server import StandInServer
+import extract
+import load
+import rate_limiter
+import transform
+from etl_pipeline import make_chunks
+
+
+SIZES = [10, 100, 1000, 10000]
+SCRAPE_SIZES = [10, 100, 1000]
+WORKERS = [1, 2, 4, 8]
+REPEAT = 3
+DISTINCT_PAGES = 50  # Steam pages are cycled, building 10k of them would dwarf the parse
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'database', 'schema.sql')
+PIPELINE_TABLES = ['listing', 'latest_price', 'store_product',
+                   'watchlist', 'tracking', 'game', 'platform']
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+HANDLERS = ['etl_pipeline', 'search_pipeline', 'coordinator']
+
+
+def run_split(func, items: list, workers: int) -> None:
+    """Run func over items split between worker threads, as the ETL splits games into chunks"""
+    if workers == 1:
+        func(items)
+        return
+    chunks = make_chunks(items, max(1, -(-len(items) // workers)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(func, chunks))
+
+
+def best_time(run, setup=None, repeat: int = REPEAT) -> float:
+    """Fastest of repeat timed runs, setup runs untimed before each"""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def result(benchmark: str, titles: int, workers: int, seconds: float) -> dict:
+    print(f'{benchmark:>18} {titles:>6} titles {workers:>2} workers '
+          f'{seconds:9.4f}s {titles / seconds:12.1f} titles/s')
+    return {'benchmark': benchmark, 'titles': titles, 'workers': workers,
+            'seconds': round(seconds, 6), 'titles_per_second': round(titles / seconds, 2)}
+
+
+# <--- Stage benchmarks --->
+
+
+def bench_parse_steam(titles: list[str], workers: int, repeat: int) -> list[dict]:
+    """Cut the first result out of a search page and parse it, with BeautifulSoup and with the regex parser"""
+    pages = [bench_fixtures.steam_search_page(title)
+             for title in titles[:DISTINCT_PAGES]]
+    cycled = [pages[number % len(pages)] for number in range(len(titles))]
+    results = []
+
+    for name, parse in (('parse_steam', extract.parse_steam),
+                        ('parse_steam_fast', extract.parse_steam_fast)):
+        def run_chunk(chunk, parse=parse):
+            for page in chunk:
+                parse(extract.split_steam_html(page, ''))
+        results.append(result(name, len(titles), workers,
+                              best_time(lambda: run_split(run_chunk, cycled, workers), repeat=repeat)))
+    return results
+
+
+def bench_convert_price(titles: list[str], workers: int, repeat: int) -> list[dict]:
+    """Price text to pence, three strings per title"""
+    strings = bench_fixtures.price_strings(titles)
+
+    def run_chunk(chunk):
+        for value in chunk:
+            extract.convert_price(value, 0.8)
+    return [result('convert_price', len(titles), workers,
+                   best_time(lambda: run_split(run_chunk, strings, workers), repeat=repeat))]
+
+
+def bench_transform(titles: list[str], workers: int, repeat: int) -> list[dict]:
+    """The DataFrame path reading each store's json file, and the vectorised batch in memory"""
+    listings = bench_fixtures.raw_listings(titles)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        def run_source_chunk(chunk):
+            # each worker gets its own pair of files, as parallel chunks would
+            number = id(chunk)
+            for platform_name in ('steam', 'gog'):
+                filename = f'{platform_name}_{number}_products.json'
+                with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+                    json.dump(chunk, f)
+                transform.transform_source(filename)
+
+        with patch('transform.DIRECTORY', directory + '/'):
+            results.append(result('transform_source', len(titles), workers,
+                                  best_time(lambda: run_split(run_source_chunk, listings, workers),
+                                            repeat=repeat)))
+
+    def run_batch_chunk(chunk):
+        transform.transform_batch({'steam': chunk, 'gog': chunk})
+    results.append(result('transform_batch', len(titles), workers,
+                          best_time(lambda: run_split(run_batch_chunk, listings, workers), repeat=repeat)))
+    return results
+
+
+def prepare_database() -> None:
+    """Rebuild the pipeline's tables in a local Postgres, refusing anything that is not local"""
+    host = os.environ.get('RDS_HOST', '')
+    if host not in LOCAL_HOSTS and not host.startswith('/'):
+        raise SystemExit(f'Refusing to rebuild the schema on {host!r}, '
+                         'point RDS_HOST at a local Postgres')
+
+    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+        schema = f.read()
+    # the pipeline's tables only, without the database statements
+    schema = schema.split('CREATE TABLE user(')[0]
+    schema = schema.split('CREATE DATABASE wishbone;')[-1]
+
+    conn = load.get_connection()
+    with conn, conn.cursor() as cur:
+        cur.execute('DROP SCHEMA IF EXISTS wishbone CASCADE; CREATE SCHEMA wishbone;')
+        cur.execute('SET search_path TO wishbone;' + schema)
+    load.release_connection(conn)
+
+
+def empty_tables() -> None:
+    """
+    Empty the pipeline's tables and forget cached ids, so every run loads from scratch.
+    The platforms are kept, the row by row load would race to create them
+    """
+    conn = load.get_connection()
+    with conn, conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {', '.join(f'wishbone.{table}' for table in PIPELINE_TABLES)} "
+                    'RESTART IDENTITY CASCADE;')
+        cur.execute("INSERT INTO wishbone.platform (platform_name) VALUES ('steam'), ('gog');")
+    load.release_connection(conn)
+    load.GAME_ID_CACHE.clear()
+    load.PLATFORM_ID_CACHE.clear()
+
+
+def bench_load(titles: list[str], workers: int, repeat: int) -> list[dict]:
+    """Row by row load_data against set based load_data_bulk, from an empty database"""
+    listings = bench_fixtures.raw_listings(titles)
+    rows = transform.transform_all({'steam': listings, 'gog': listings})
+    # a game's rows stay in one chunk, as they would in the ETL
+    games = {}
+    for row in rows:
+        games.setdefault(row['game_name'], []).append(row)
+    results = []
+
+    for name, load_rows in (('load_data', load.load_data),
+                            ('load_data_bulk', load.load_data_bulk)):
+        def run_chunk(chunk, load_rows=load_rows):
+            load_rows([row for game_rows in chunk for row in game_rows])
+        results.append(result(name, len(titles), workers,
+                              best_time(lambda: run_split(run_chunk, list(games.values()), workers),
+                                        setup=empty_tables, repeat=repeat)))
+    return results
+
+
+def bench_scrape(titles: list[str], workers: int, repeat: int, server: StandInServer) -> list[dict]:
+    """Search both stores for every title, then price them again by store id as a repeat run does"""
+    results = []
+    store_ids = {}
+
+    def search_chunk(chunk):
+        extract.scrape_games(chunk, 0.8, {})
+
+    def batch_chunk(chunk):
+        extract.scrape_games(chunk, 0.8, {platform_name: dict(ids)
+                                          for platform_name, ids in store_ids.items()})
+
+    results.append(result('scrape_search', len(titles), workers,
+                          best_time(lambda: run_split(search_chunk, titles, workers), repeat=repeat)))
+
+    extract.scrape_games(titles, 0.8, store_ids)
+    server.remember_titles(titles)
+    results.append(result('scrape_batch', len(titles), workers,
+                          best_time(lambda: run_split(batch_chunk, titles, workers), repeat=repeat)))
+    return results
+
+
+def bench_imports(repeat: int) -> list[dict]:
+    """Cold import of each Lambda handler in a fresh interpreter, less the interpreter's own start up"""
+    def start(code: str) -> float:
+        return best_time(lambda: subprocess.run([sys.executable, '-c', code], check=True,
+                                                cwd=os.path.dirname(__file__) or '.'),
+                         repeat=repeat)
+
+    startup = start('pass')
+    results = []
+    for handler in HANDLERS:
+        seconds = max(start(f'import {handler}') - startup, 0)
+        print(f"{'import ' + handler:>24} {seconds:9.4f}s")
+        results.append({'benchmark': f'import {handler}', 'titles': 0, 'workers': 1,
+                        'seconds': round(seconds, 6)})
+    return results
+
+
+# <--- Runner --->
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(__file__) or '.').stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace) -> list[dict]:
+    results = bench_imports(args.repeat)
+    for size in args.sizes:
+        titles = bench_fixtures.game_titles(size)
+        for workers in args.workers:
+            results += bench_parse_steam(titles, workers, args.repeat)
+            results += bench_convert_price(titles, workers, args.repeat)
+            results += bench_transform(titles, workers, args.repeat)
+
+    if args.postgres:
+        prepare_database()
+        for size in args.sizes:
+            titles = bench_fixtures.game_titles(size)
+            for workers in args.workers:
+                results += bench_load(titles, workers, args.repeat)
+
+    if args.scrape:
+        server = StandInServer(args.latency, throttle_rate=args.throttle)
+        # pace the stand-in like a store, or not at all to time only our own work
+        with server, server.patch_extract(), \
+                patch('http_cache.CACHE_ENABLED', False), \
+                patch('rate_limiter.START_RATE', args.requests_per_second), \
+                patch('rate_limiter.MAX_RATE', args.requests_per_second):
+            for size in args.scrape_sizes:
+                titles = bench_fixtures.game_titles(size)
+                for workers in args.workers:
+                    rate_limiter.LIMITERS.clear()
+                    results += bench_scrape(titles, workers, args.repeat, server)
+        print(f'Stand-in served {server.requests} requests, throttled {server.throttled}')
+
+    return results
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    """Print the speed of each result relative to the same benchmark in a baseline file"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(old['benchmark'], old['titles'], old['workers']): old
+                    for old in json.load(f)['results']}
+
+    print(f'\nCompared with {baseline_path} (above 1 is faster)')
+    for new in results:
+        old = baseline.get((new['benchmark'], new['titles'], new['workers']))
+        if old and new['seconds']:
+            print(f"{new['benchmark']:>18} {new['titles']:>6} titles {new['workers']:>2} workers "
+                  f"{old['seconds'] / new['seconds']:8.2f}x")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKERS)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--postgres', action='store_true',
+                        help='run the load benchmarks against the local Postgres in RDS_*')
+    parser.add_argument('--scrape', action='store_true',
+                        help='run the scrape benchmarks against the local stand-in')
+    parser.add_argument('--scrape-sizes', type=int, nargs='+', default=SCRAPE_SIZES)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the stand-in takes to answer')
+    parser.add_argument('--throttle', type=float, default=0,
+                        help='requests per second the stand-in allows before sending 429s, 0 for no limit')
+    parser.add_argument('--requests-per-second', type=float, default=1000,
+                        help='pace of the rate limiter for each stand-in store')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    results = run_benchmarks(args)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'cpus': os.cpu_count(),
+            'arguments': vars(args),
+            'results': results
+        }, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Stand-ins for aiohttp shared by the extract, response cache and rate limiter tests"""
+
+import json
+import pytest
+
+
+class FakeResponse:
+    """Defines mock aiohttp response, bodies that are not text are sent as JSON"""
+
+    def __init__(self, status=200, body='', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def text(self):
+        return self.body if isinstance(self.body, str) else json.dumps(self.body)
+
+
+class FakeSession:
+    """
+    Defines mock aiohttp session answering with the queued responses in order, the last
+    one repeating. A queued exception is raised, anything else is sent as a 200 body
+    """
+
+    def __init__(self, *responses):
+        self.responses = [response if isinstance(response, (FakeResponse, Exception))
+                          else FakeResponse(200, response) for response in responses]
+        self.urls = []
+        self.sent_headers = []
+        self.calls = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        self.sent_headers.append(headers)
+        self.calls += 1
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def fake_session():
+    """FakeSession, e.g. fake_session(body) or fake_session(fake_response(304), error)"""
+    return FakeSession
+
+
+@pytest.fixture
+def fake_response():
+    """FakeResponse, e.g. fake_response(200, 'page', {'ETag': '"v1"'})"""
+    return FakeResponse
@@ -0,0 +1,146 @@
+"""Lambda function fanning the daily ETL out to one search pipeline Lambda per shard of tracked games"""
+from os import environ
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+import json
+import time
+
+from etl_pipeline import get_game_names, make_chunks
+import search_pipeline
+
+WORKER_FUNCTION = environ.get('WORKER_FUNCTION_NAME', 'wishbone-search-lambda')
+SHARD_SIZE = int(environ.get('SHARD_SIZE', 50))  # games per worker invocation
+# workers running at once, the store rate limits are per worker so keep this modest
+MAX_INVOCATIONS = int(environ.get('MAX_INVOCATIONS', 10))
+# a worker may run up to its own 300 second timeout before answering
+INVOKE_READ_TIMEOUT = 310
+# seconds kept back from the coordinator's own timeout to return the summary
+SUMMARY_SECONDS = 10
+
+# lambda clients by pool size, kept for the life of the container
+LAMBDA_CLIENTS = {}
+
+
+def invoke_worker(client, game_inputs: list[str]) -> dict:
+    """Run one shard on a worker Lambda, returning the status it reports"""
+    response = client.invoke(FunctionName=WORKER_FUNCTION,
+                             InvocationType='RequestResponse',
+                             Payload=json.dumps({'game_inputs': game_inputs, 'watch': False}))
+    payload = json.loads(response['Payload'].read() or 'null')
+
+    if response.get('FunctionError'):
+        message = payload.get('errorMessage') if isinstance(payload, dict) else payload
+        return {'status': 'error', 'msg': f'worker failed: {message}'}
+    return payload
+
+
+def run_local_worker(game_inputs: list[str]) -> dict:
+    """Stand-in for a worker Lambda, running the search pipeline in this process"""
+    return search_pipeline.lambda_handler({'game_inputs': game_inputs, 'watch': False}, None)
+
+
+def run_shard(shard_number: int, game_inputs: list[str], worker, deadline: float | None = None) -> dict:
+    """
+    Run one shard on a worker, returning how it went instead of raising.
+    A shard whose worker could still be running at deadline (time.time()) is not started
+    and counts as failed, so the coordinator returns its summary before its own timeout
+    """
+    start_time = time.perf_counter()
+    if deadline is not None and time.time() + INVOKE_READ_TIMEOUT > deadline:
+        result = {'status': 'error', 'msg': 'not started, the coordinator would time out before it finished'}
+    else:
+        try:
+            result = worker(game_inputs)
+        except Exception as e:
+            result = {'status': 'error', 'msg': f'{type(e).__name__}: {e}'}
+    if not isinstance(result, dict):
+        result = {'status': 'error', 'msg': f'unexpected worker response {result!r}'}
+    if result.get('status') != 'success':
+        print(f"Shard {shard_number} failed: {result.get('msg')}")
+
+    return {
+        'shard': shard_number,
+        'games': len(game_inputs),
+        'status': result.get('status', 'error'),
+        'msg': result.get('msg'),
+        'seconds': round(time.perf_counter() - start_time, 3)
+    }
+
+
+def get_lambda_client(max_pool_connections: int):
+    """Lambda client able to hold max_pool_connections invocations open at once, created on first use"""
+    if max_pool_connections not in LAMBDA_CLIENTS:
+        # boto3 is slow to import and not needed by local runs
+        import boto3
+        from botocore.config import Config
+        LAMBDA_CLIENTS[max_pool_connections] = boto3.client(
+            'lambda', region_name='eu-west-2',
+            config=Config(read_timeout=INVOKE_READ_TIMEOUT,
+                          retries={'max_attempts': 0},
+                          max_pool_connections=max_pool_connections))
+    return LAMBDA_CLIENTS[max_pool_connections]
+
+
+def fan_out(shards: list[list[str]], max_invocations: int = MAX_INVOCATIONS,
+            local: bool = False, deadline: float | None = None) -> list[dict]:
+    """
+    Start a worker for every shard and collect each shard's result in order.
+    Workers are Lambda invocations, or processes when running locally.
+    Shards not started by deadline fail without running, see run_shard
+    """
+    if not shards:
+        return []
+    workers = min(max_invocations, len(shards))
+
+    if local:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_shard, shard_number, shard, run_local_worker, deadline)
+                       for shard_number, shard in enumerate(shards)]
+            return [future.result() for future in futures]
+
+    worker = partial(invoke_worker, get_lambda_client(workers))
+    # each thread only waits on its invocation, the work happens in the workers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_shard, shard_number, shard, worker, deadline)
+                   for shard_number, shard in enumerate(shards)]
+        return [future.result() for future in futures]
+
+
+def summarise_fan_out(shard_results: list[dict], seconds: float) -> dict:
+    """Totals for a fanned out run, with the result of every shard"""
+    failed = [result for result in shard_results if result['status'] != 'success']
+    return {
+        'status': 'error' if failed else 'success',
+        'games': sum(result['games'] for result in shard_results),
+        'shards': len(shard_results),
+        'failed_shards': len(failed),
+        'seconds': round(seconds, 3),
+        'shard_results': shard_results
+    }
+
+
+def get_deadline(context) -> float | None:
+    """time.time() by which the summary must be returned, None outside Lambda"""
+    remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if remaining is None:
+        return None
+    return time.time() + remaining() / 1000 - SUMMARY_SECONDS
+
+
+def lambda_handler(event, context):
+    """for the lambda, returns a summary of the run. The event may set shard_size, max_invocations and local"""
+    start_time = time.perf_counter()
+    games = get_game_names()
+    shards = make_chunks(games, int(event.get('shard_size', SHARD_SIZE)))
+    shard_results = fan_out(shards,
+                            int(event.get('max_invocations', MAX_INVOCATIONS)),
+                            bool(event.get('local', False)),
+                            deadline=get_deadline(context))
+    summary = summarise_fan_out(shard_results, time.perf_counter() - start_time)
+    print(f"Ran {summary['games']} games over {summary['shards']} workers in "
+          f"{summary['seconds']} seconds, {summary['failed_shards']} shards failed")
+    return summary
+
+
+if __name__ == "__main__":
+    print(lambda_handler({'local': True}, {}))
@@ -1,83 +1,109 @@
-"""Lambda function checking emails on RDS are verified"""
+"""Lambda function running the daily ETL for every tracked game, in parallel chunks"""
 from os import environ
-import awswrangler
-import boto3
-from dotenv import load_dotenv
-import pandas as pd
 from concurrent.futures import ThreadPoolExecutor
 import time
 
 from extract import extract_games
-from transform import transform_all
-from load import load_data
+from transform import transform_batch
+from load import load_data_bulk, get_store_ids
+from streaming import stream_games
+from tracked_games import get_tracked_games
+import metrics
 
-CHUNK_NUM = 4
-NUM_PROCESSES = 64
-# Most recent duration test
-#     16: 242 seconds
-#     32: 130 seconds
-# --> 64: 118 seconds
-#     128: 491 seconds
-
-
-load_dotenv()
+CHUNK_SIZE = int(environ.get('CHUNK_SIZE', 25))  # games per pipeline chunk
+# chunks run at once, each chunk already scrapes its games concurrently
+# and the rate limiter paces the stores, so this only needs to cover DB waits
+MAX_WORKERS = int(environ.get('MAX_WORKERS', 8))
+# stream each chunk's listings into the DB as they are scraped instead of stage by stage
+STREAMING = environ.get('STREAMING', 'false').lower() == 'true'
 
 
 def get_game_names() -> list[str]:
     """get all names of games we're tracking"""
-    athena_query = """
-    SELECT
-        DISTINCT g.game_name,
-        l.recording_date
-    FROM
-        game g
-    JOIN
-        listing l
-    ON
-        g.game_id = l.game_id
-    ORDER BY
-        l.recording_date
-    DESC
-    LIMIT
-        100
-    ;
-    """
-    # query above loads latest hundred unique game names
-
-    session = boto3.Session(aws_access_key_id=environ["ACCESS_KEY_ID"],
-                            aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY_ID"], region_name='eu-west-2')
-
-    game_names = pd.DataFrame(awswrangler.athena.read_sql_query(
-        athena_query, database="wishbone-glue-db", boto3_session=session))
-
-    results = game_names['game_name'].to_list()
-
-    if len(results) == len(set(results)):
-        return results
-
-    raise ValueError(
-        'Not unique names! How could this happen? The SQL Query was magnificent!')
-
-
-def pipeline(game_inputs: list[str]) -> None:
-    """pipeline for multiprocessing"""
-    extract_games(game_inputs)
-    transform_all()
-    load_data()
+    return get_tracked_games()
+
+
+def pipeline(game_inputs: list[str]) -> int:
+    """pipeline for one chunk, keeping its data in memory. Returns the number of rows loaded"""
+    # games already found on a store are priced by id instead of searched
+    store_ids = get_store_ids(game_inputs)
+    if STREAMING:
+        with metrics.timer('StageTime', Stage='stream'):
+            return stream_games(game_inputs, store_ids=store_ids)
+    with metrics.timer('StageTime', Stage='extract'):
+        listings = extract_games(game_inputs, store_ids=store_ids)
+    with metrics.timer('StageTime', Stage='transform'):
+        batch = transform_batch(listings)
+    with metrics.timer('StageTime', Stage='load'):
+        return load_data_bulk(batch, store_ids)
+
+
+def make_chunks(games: list[str], chunk_size: int = CHUNK_SIZE) -> list[list[str]]:
+    """Split the games into consecutive chunks of at most chunk_size"""
+    if chunk_size < 1:
+        raise ValueError(f'Chunk size must be positive, not {chunk_size}')
+    return [games[i:i + chunk_size] for i in range(0, len(games), chunk_size)]
+
+
+def run_chunk(chunk_number: int, game_inputs: list[str]) -> dict:
+    """Run the pipeline for one chunk, returning how it went instead of raising"""
+    start_time = time.perf_counter()
+    try:
+        rows = pipeline(game_inputs)
+        status, error = 'success', None
+    except Exception as e:
+        rows, status, error = 0, 'error', f'{type(e).__name__}: {e}'
+        print(f'Chunk {chunk_number} failed: {error}')
+
+    return {
+        'chunk': chunk_number,
+        'games': len(game_inputs),
+        'rows': rows,
+        'status': status,
+        'error': error,
+        'seconds': round(time.perf_counter() - start_time, 3)
+    }
+
+
+def run_chunks(game_chunks: list[list[str]], max_workers: int = MAX_WORKERS) -> list[dict]:
+    """Run every chunk on a pool no bigger than needed, collecting each chunk's result in order"""
+    if not game_chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(game_chunks))) as executor:
+        futures = [executor.submit(run_chunk, chunk_number, chunk)
+                   for chunk_number, chunk in enumerate(game_chunks)]
+        return [future.result() for future in futures]
+
+
+def summarise_run(chunk_results: list[dict], seconds: float) -> dict:
+    """Totals for a run, with the result of every chunk"""
+    failed = [result for result in chunk_results if result['status'] == 'error']
+    return {
+        'status': 'error' if failed else 'success',
+        'games': sum(result['games'] for result in chunk_results),
+        'rows': sum(result['rows'] for result in chunk_results),
+        'chunks': len(chunk_results),
+        'failed_chunks': len(failed),
+        'seconds': round(seconds, 3),
+        'chunk_results': chunk_results
+    }
 
 
 def lambda_handler(event, context):
-    """for the lambda"""
+    """for the lambda, returns a summary of the run. The event may set chunk_size and max_workers"""
+    start_time = time.perf_counter()
     games = get_game_names()
-    size = int(len(games)/CHUNK_NUM)
-    game_chunks = [games[i::size] for i in range(size)]
-
-    with ThreadPoolExecutor(max_workers=NUM_PROCESSES) as executor:
-        executor.map(pipeline, game_chunks)
+    game_chunks = make_chunks(games, int(event.get('chunk_size', CHUNK_SIZE)))
+    chunk_results = run_chunks(game_chunks,
+                               int(event.get('max_workers', MAX_WORKERS)))
+    summary = summarise_run(chunk_results, time.perf_counter() - start_time)
+    metrics.count('FailedChunks', summary['failed_chunks'])
+    summary['metrics'] = metrics.flush(Function='etl_pipeline')
+    print(f"Loaded {summary['rows']} rows for {summary['games']} games in "
+          f"{summary['seconds']} seconds, {summary['failed_chunks']} chunks failed")
+    return summary
 
 
 if __name__ == "__main__":
-    start_time = time.time()
-    lambda_handler({}, {})
-    end_time = time.time()
-    print(f'Time taken: {end_time - start_time}')
+    print(lambda_handler({}, {}))
@@ -1,41 +1,69 @@
 """Script which gets data from web api search console, one game at a time or a list of daily games"""
 
+import asyncio
+from functools import partial
+import html
 import json
 import os
+import re
 
-from bs4 import BeautifulSoup
-from forex_python.converter import CurrencyRates
-import requests
+import aiohttp
+
+from http_cache import fetch_text, remember_parsed
+import metrics
+from rates import DEFAULT_RATE, get_usd_to_gbp_rate
 
 
 FOLDER_PATH = '/var/task/tmp/data/'  # needs to be /tmp/data for lambda
 
-STEAM_PATH = f'{FOLDER_PATH}steam_products.json'
+STEAM_PATH = f'{FOLDER_PATH}steam_products.arrow'
 STEAM_SEARCH = 'https://store.steampowered.com/search?term={search_term}'
 STEAM_SPLIT = '<div class="search_name ellipsis">'
-
-GOG_PATH = f'{FOLDER_PATH}gog_products.json'
+STEAM_TITLE = re.compile(r'<span class="title">(.*?)</span>', re.DOTALL)
+STEAM_FINAL_PRICE = re.compile(
+    r'<div class="[^"]*\bdiscount_final_price\b[^"]*">(.*?)</div>', re.DOTALL)
+STEAM_ORIGINAL_PRICE = re.compile(
+    r'<div class="[^"]*\bdiscount_original_price\b[^"]*">(.*?)</div>', re.DOTALL)
+HTML_TAG = re.compile(r'<[^>]+>')
+STEAM_APP_ID = re.compile(r'data-ds-appid="(\d+)"')
+STEAM_PRICES = 'https://store.steampowered.com/api/appdetails?appids={app_ids}&cc=gb&filters=price_overview'
+
+GOG_PATH = f'{FOLDER_PATH}gog_products.arrow'
 GOG_SEARCH = 'https://catalog.gog.com/v1/catalog?limit=48&query=like%3A{search_term}'
-DEFAULT_RATE = 0.77  # as of 19 nov 2025
+# USD like the catalog search, so both are converted with the same rate and agree
+GOG_PRICES = 'https://api.gog.com/products/prices?ids={product_ids}&countryCode=US&currency=USD'
+BATCH_SIZE = 48  # titles priced per request, same as the GOG catalog page size
+MAX_REQUESTS_PER_HOST = int(os.environ.get('MAX_REQUESTS_PER_HOST', 16))
+REQUEST_TIMEOUT = 30  # seconds, per request
+KEEPALIVE_TIMEOUT = 30  # seconds an idle pooled connection is kept open
 
 # <--- Steam functions --->
 
 
 def get_steam_html(search_input: str) -> str:
     """Get first result data from steam search term"""
+    import requests  # only the one at a time helpers use it, the pipelines use aiohttp
     response = requests.get(STEAM_SEARCH.format(search_term=search_input))
-    raw_data = response.text
-    raw_data = raw_data.split(STEAM_SPLIT)
-    # len = 1 means no search results found, return falsey value
-    if len(raw_data) <= 1:
+    return split_steam_html(response.text, search_input)
+
+
+def split_steam_html(raw_data: str, search_input: str) -> str:
+    """Cut the first result out of a Steam search page without splitting the rest"""
+    start = raw_data.find(STEAM_SPLIT)
+    # no marker means no search results found, return falsey value
+    if start == -1:
         print(f'{search_input} leads to no match for Steam')
         return ''
-    # else get the first result ignoring the headers
-    return raw_data[1]
+    # else get the first result ignoring the headers, up to the next result
+    start += len(STEAM_SPLIT)
+    end = raw_data.find(STEAM_SPLIT, start)
+    return raw_data[start:end] if end != -1 else raw_data[start:]
 
 
 def parse_steam(data: str) -> dict:
     """Function to scrape top selling games and output list of dicts with prices and titles"""
+    # slow to import and only needed by this fallback parser
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(data, 'html.parser')
 
     title = soup.find("span", {"class": "title"})
@@ -69,14 +97,80 @@ def parse_steam(data: str) -> dict:
     return listing
 
 
+def find_steam_app_id(raw_data: str) -> int | None:
+    """App id of the first Steam search result, read from its row link just before the result name"""
+    start = raw_data.find(STEAM_SPLIT)
+    if start == -1:
+        return None
+    row_start = max(raw_data.rfind('<a ', 0, start), 0)
+    match = STEAM_APP_ID.search(raw_data, row_start, start)
+    # bundles list several app ids and are not matched
+    return int(match.group(1)) if match else None
+
+
+def tag_text(match: re.Match | None) -> str:
+    """Plain text inside a matched tag, like BeautifulSoup's get_text().strip()"""
+    if not match:
+        return ''
+    return html.unescape(HTML_TAG.sub('', match.group(1))).strip()
+
+
+def parse_steam_fast(data: str) -> dict:
+    """
+    Same output as parse_steam, but pulls the title and prices out with targeted
+    regexes that stop at their first match instead of building a BeautifulSoup tree
+    """
+    title = tag_text(STEAM_TITLE.search(data))
+    if not title:
+        return {}  # if no match
+
+    discount_price = tag_text(STEAM_FINAL_PRICE.search(data))
+    if not discount_price:
+        print(
+            f'Issue grabbing price: {title} must be DLC, only available in a bundle, or not a game')
+        return {}
+
+    #  not on discount when there is no original price
+    original_price = tag_text(
+        STEAM_ORIGINAL_PRICE.search(data)) or discount_price
+
+    return {
+        'name': title,
+        'base_price_gbp_pence': convert_price(original_price),
+        'final_price_gbp_pence': convert_price(discount_price)
+    }
+
+
+def parse_steam_price(title: str, app_data: dict) -> dict:
+    """Build a listing from one app of a Steam appdetails price_overview response"""
+    data = app_data.get('data') if app_data.get('success') else None
+    # apps without a price (free, unreleased) come back with an empty list
+    prices = data.get('price_overview') if isinstance(data, dict) else None
+    if not prices or prices.get('currency') != 'GBP':
+        print(f'No Steam price for {title}')
+        return {}
+
+    return {
+        'name': title,
+        'base_price_gbp_pence': int(prices['initial']),
+        'final_price_gbp_pence': int(prices['final'])
+    }
+
+
 # <--- GOG functions --->
 
 
 def get_gog_html(search_input: str) -> dict:
     """Get first result data from search term"""
+    import requests
     # build url
     response = requests.get(GOG_SEARCH.format(search_term=search_input))
-    raw_data = dict(response.json()).get('products')
+    return first_gog_product(response.json(), search_input)
+
+
+def first_gog_product(response_data: dict, search_input: str) -> dict:
+    """Get the first product out of a GOG catalog response"""
+    raw_data = dict(response_data).get('products')
     if raw_data:
         return raw_data[0]  # only the first match
     # else:
@@ -85,7 +179,12 @@ def get_gog_html(search_input: str) -> dict:
 
 
 def get_gog_prices(search_input: str, convert_rate: float = DEFAULT_RATE) -> dict:
-    data = get_gog_html(search_input)
+    """Get the listing of the first GOG result for a search term"""
+    return parse_gog(get_gog_html(search_input), convert_rate)
+
+
+def parse_gog(data: dict, convert_rate: float = DEFAULT_RATE) -> dict:
+    """Build a listing from a GOG catalog product"""
     title = data.get('title')
     if not title:  # no matches
         return {}
@@ -105,6 +204,217 @@ def get_gog_prices(search_input: str, convert_rate: float = DEFAULT_RATE) -> dic
     }
     return listing
 
+def gog_amount(value: str, convert_rate: float = DEFAULT_RATE) -> int:
+    """Convert a GOG price like '1999 GBP' (minor units and currency) to pence"""
+    amount, currency = value.split()
+    if currency == 'GBP':
+        return int(amount)
+    if currency == 'USD':
+        return int(int(amount) * convert_rate)
+    raise ValueError(f'Unexpected currency: {value}')
+
+
+def parse_gog_price(title: str, item: dict, convert_rate: float = DEFAULT_RATE) -> dict:
+    """Build a listing from one product of a GOG products/prices response"""
+    prices = item.get('_embedded', {}).get('prices')
+    if not prices:
+        print(f'No GOG price for {title}')
+        return {}
+
+    return {
+        'name': title,
+        'base_price_gbp_pence': gog_amount(prices[0]['basePrice'], convert_rate),
+        'final_price_gbp_pence': gog_amount(prices[0]['finalPrice'], convert_rate)
+    }
+
+# <--- Async scraping engine --->
+
+
+def create_store_session(limit_per_host: int = MAX_REQUESTS_PER_HOST) -> aiohttp.ClientSession:
+    """Create a keep-alive connection pool for one store, capping in-flight requests to it"""
+    connector = aiohttp.TCPConnector(limit_per_host=limit_per_host,
+                                     keepalive_timeout=KEEPALIVE_TIMEOUT,
+                                     resolver=aiohttp.AsyncResolver())
+    return aiohttp.ClientSession(connector=connector,
+                                 timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+
+async def fetch_steam_listing(session: aiohttp.ClientSession, search_input: str,
+                              found_ids: dict | None = None) -> dict:
+    """
+    Get the listing of the first Steam result without blocking the event loop,
+    recording its app id and title in found_ids when given
+    """
+    url = STEAM_SEARCH.format(search_term=search_input)
+    with metrics.timer('TitleTime', Store='steam'):
+        try:
+            raw_data, parsed = await fetch_text(session, url)
+            # unchanged pages reuse the result parsed last time
+            if parsed is None:
+                parsed = {'listing': parse_steam_fast(split_steam_html(raw_data, search_input)),
+                          'store_id': find_steam_app_id(raw_data)}
+                remember_parsed(url, parsed)
+            listing, app_id = parsed['listing'], parsed['store_id']
+            if listing and app_id and found_ids is not None:
+                found_ids[search_input] = (app_id, listing['name'])
+            return listing
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f'Steam lookup failed for {search_input}: {e}')
+            return {}
+
+
+async def fetch_gog_listing(session: aiohttp.ClientSession, search_input: str,
+                            convert_rate: float = DEFAULT_RATE, found_ids: dict | None = None) -> dict:
+    """
+    Get the listing of the first GOG result without blocking the event loop,
+    recording its product id and title in found_ids when given
+    """
+    url = GOG_SEARCH.format(search_term=search_input)
+    with metrics.timer('TitleTime', Store='gog'):
+        try:
+            raw_data, parsed = await fetch_text(session, url)
+            # unchanged responses reuse the product found last time. It is kept in USD
+            # and converted here, so a cached product gets this run's rate
+            if parsed is None:
+                product = first_gog_product(json.loads(raw_data), search_input)
+                parsed = {'product': {'title': product.get('title'), 'price': product.get('price')},
+                          'store_id': product.get('id')}
+                remember_parsed(url, parsed)
+            listing, product_id = parse_gog(parsed['product'], convert_rate), parsed['store_id']
+            if listing and product_id and found_ids is not None:
+                found_ids[search_input] = (int(product_id), listing['name'])
+            return listing
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f'GOG lookup failed for {search_input}: {e}')
+            return {}
+
+
+async def fetch_steam_prices(session: aiohttp.ClientSession,
+                             app_ids: dict[str, tuple[int, str]]) -> dict[str, dict]:
+    """Price up to BATCH_SIZE games (name: (Steam app id, Steam title)) with one appdetails request"""
+    url = STEAM_PRICES.format(app_ids=','.join(str(app_id)
+                              for app_id, _ in app_ids.values()))
+    with metrics.timer('BatchTime', Store='steam'):
+        try:
+            raw_data, listings = await fetch_text(session, url)
+            if listings is None:
+                response_data = json.loads(raw_data) or {}
+                listings = {name: parse_steam_price(title, response_data.get(str(app_id), {}))
+                            for name, (app_id, title) in app_ids.items()}
+                remember_parsed(url, listings)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            print(f'Steam batch price lookup failed: {e}')
+            return {}
+
+        return {name: listing for name, listing in listings.items() if listing}
+
+
+async def fetch_gog_prices(session: aiohttp.ClientSession, product_ids: dict[str, tuple[int, str]],
+                           convert_rate: float = DEFAULT_RATE) -> dict[str, dict]:
+    """Price up to BATCH_SIZE games (name: (GOG product id, GOG title)) with one prices request"""
+    url = GOG_PRICES.format(product_ids=','.join(str(product_id)
+                            for product_id, _ in product_ids.values()))
+    with metrics.timer('BatchTime', Store='gog'):
+        try:
+            raw_data, items = await fetch_text(session, url)
+            # the USD prices are cached and converted here, so cached prices get this run's rate
+            if items is None:
+                response_data = json.loads(raw_data) or {}
+                items = {str(item.get('_embedded', {}).get('product', {}).get('id')): item
+                         for item in response_data.get('_embedded', {}).get('items', [])}
+                remember_parsed(url, items)
+            listings = {name: parse_gog_price(title, items.get(str(product_id), {}), convert_rate)
+                        for name, (product_id, title) in product_ids.items()}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+            print(f'GOG batch price lookup failed: {e}')
+            return {}
+
+        return {name: listing for name, listing in listings.items() if listing}
+
+
+async def price_games(game_inputs: list[str], known_ids: dict[str, tuple], fetch_batch, fetch_one,
+                      on_priced=None) -> list[dict]:
+    """
+    Price the games whose store id is known BATCH_SIZE at a time with fetch_batch,
+    then search one by one with fetch_one for the rest and any the batches missed.
+    on_priced, when given, is awaited with the listings found by each lookup as it finishes
+    """
+    async def emit(listings: list[dict]) -> None:
+        listings = [listing for listing in listings if listing]
+        if on_priced is not None and listings:
+            await on_priced(listings)
+
+    async def batch_then_emit(ids: dict) -> dict:
+        result = await fetch_batch(ids)
+        await emit(list(result.values()))
+        return result
+
+    async def search_then_emit(name: str) -> dict:
+        listing = await fetch_one(name)
+        await emit([listing])
+        return listing
+
+    known = [(name, known_ids[name])
+             for name in game_inputs if name in known_ids]
+    batch_results = await asyncio.gather(
+        *(batch_then_emit(dict(known[i:i + BATCH_SIZE])) for i in range(0, len(known), BATCH_SIZE)))
+
+    priced = {}
+    for result in batch_results:
+        priced.update(result)
+
+    to_search = [name for name in game_inputs if name not in priced]
+    searched = await asyncio.gather(*(search_then_emit(name) for name in to_search))
+    priced.update(zip(to_search, searched))
+
+    return [priced[name] for name in game_inputs]
+
+
+async def scrape_stores(game_inputs: list[str], convert_rate: float = DEFAULT_RATE,
+                        limit_per_host: int = MAX_REQUESTS_PER_HOST,
+                        store_ids: dict[str, dict[str, tuple]] | None = None,
+                        on_priced=None) -> tuple[list[dict], list[dict]]:
+    """
+    Price every game on Steam and GOG concurrently, one connection pool per store.
+    store_ids maps platform name to {game name: (store id, store title)} for games that
+    can skip the search, and is updated in place with the ids resolved by searching.
+    on_priced, when given, is awaited with (platform name, listings) as listings are found
+    """
+    def platform_callback(platform_name: str):
+        return partial(on_priced, platform_name) if on_priced is not None else None
+
+    if store_ids is None:
+        store_ids = {}
+    steam_ids = store_ids.setdefault('steam', {})
+    gog_ids = store_ids.setdefault('gog', {})
+
+    async with create_store_session(limit_per_host) as steam_session, \
+            create_store_session(limit_per_host) as gog_session:
+        steam_games = price_games(game_inputs, steam_ids,
+                                  partial(fetch_steam_prices, steam_session),
+                                  partial(fetch_steam_listing, steam_session, found_ids=steam_ids),
+                                  platform_callback('steam'))
+        gog_games = price_games(game_inputs, gog_ids,
+                                partial(fetch_gog_prices, gog_session,
+                                        convert_rate=convert_rate),
+                                partial(fetch_gog_listing, gog_session,
+                                        convert_rate=convert_rate, found_ids=gog_ids),
+                                platform_callback('gog'))
+        steam_games, gog_games = await asyncio.gather(steam_games, gog_games)
+
+    for platform_name, listings in (('steam', steam_games), ('gog', gog_games)):
+        found = sum(1 for listing in listings if listing)
+        metrics.count('TitlesFound', found, Store=platform_name)
+        metrics.count('TitlesMissing', len(listings) - found, Store=platform_name)
+    return steam_games, gog_games
+
+
+def scrape_games(game_inputs: list[str], convert_rate: float = DEFAULT_RATE,
+                 store_ids: dict[str, dict[str, tuple]] | None = None) -> tuple[list[dict], list[dict]]:
+    """Blocking entry point to the async scraper, safe to call from worker threads"""
+    return asyncio.run(scrape_stores(game_inputs, convert_rate, store_ids=store_ids))
+
+
 # <--- Main function --->
 
 
@@ -127,42 +437,33 @@ def convert_price(value: str, convert_rate: float = DEFAULT_RATE) -> int:
 
 
 def output(results: list[dict], destination: str) -> None:
-    """Function to create output json file"""
+    """Function to create the output Arrow file read by the transform"""
     if not results:
+        # still written, so the transform never picks up a previous run's file
         print(f'no matches for {destination}')
-        return
-
-    if not os.path.isdir(FOLDER_PATH):
-        os.mkdir(FOLDER_PATH)
-
-    with open(destination, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=4)
 
+    # pyarrow is only needed when the stages run on their own
+    from interchange import write_raw_listings
+    write_raw_listings(results, destination)
 
-def extract_games(game_inputs: list[str] = ['stardew valley']) -> None:
 
-    os.makedirs(FOLDER_PATH, exist_ok=True)
-    steam_games = []
-    gog_games = []
-
-    # steam search
-    for game_name in game_inputs:
-        game = get_steam_html(game_name)
-        steam_games.append(parse_steam(game))
-
-        # gog search
-        try:
-            c = CurrencyRates()
-            usd_to_gbp_rate = float(c.get_rate("USD", "GBP"))
-        except:
-            print("RatesNotAvailableError - Forex API is currently unavailable")
-            usd_to_gbp_rate = DEFAULT_RATE
+def extract_games(game_inputs: list[str] = ['stardew valley'], usd_to_gbp_rate: float | None = None,
+                  store_ids: dict[str, dict[str, tuple]] | None = None) -> dict[str, list[dict]]:
+    """
+    Scrape every game from each store, returning the listings keyed by platform name.
+    Games in store_ids are priced by id, the rest are searched for and added to it
+    """
+    if usd_to_gbp_rate is None:
+        usd_to_gbp_rate = get_usd_to_gbp_rate()
 
-        gog_games.append(get_gog_prices(game_name, usd_to_gbp_rate))
+    # both stores are scraped concurrently for every game
+    steam_games, gog_games = scrape_games(
+        game_inputs, usd_to_gbp_rate, store_ids)
 
-    output(steam_games, STEAM_PATH)
-    output(gog_games, GOG_PATH)
+    return {'steam': steam_games, 'gog': gog_games}
 
 
 if __name__ == '__main__':
-    extract_games()
+    listings = extract_games()
+    output(listings['steam'], STEAM_PATH)
+    output(listings['gog'], GOG_PATH)
@@ -0,0 +1,103 @@
+"""Script which caches store responses on local disk, revalidating them with ETag / Last-Modified"""
+
+import hashlib
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import metrics
+from rate_limiter import request
+
+
+CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', '/tmp/http_cache/')
+CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 60 * 60))  # seconds
+CACHE_ENABLED = os.environ.get('HTTP_CACHE_ENABLED', 'true').lower() == 'true'
+
+
+def cache_path(url: str) -> str:
+    """File the cache entry for a url is kept in"""
+    return os.path.join(CACHE_DIR, f'{hashlib.sha256(url.encode()).hexdigest()}.json')
+
+
+def read_entry(url: str) -> dict:
+    """Return the cache entry for a url, or an empty dict if there is none"""
+    try:
+        with open(cache_path(url), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_entry(url: str, entry: dict) -> None:
+    """Write a cache entry, replacing the old one in a single step so other threads never read half a file"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = cache_path(url)
+    tmp_path = f'{path}.{os.getpid()}.{id(entry)}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f'Could not cache {url}: {e}')
+
+
+def remember_parsed(url: str, parsed: dict) -> None:
+    """
+    Store the parsed result of a response so it is reused while the response
+    is unchanged, the raw body is dropped as it is no longer needed
+    """
+    if not CACHE_ENABLED:
+        return
+    entry = read_entry(url)
+    if entry:
+        entry['parsed'] = parsed
+        entry['body'] = None
+        write_entry(url, entry)
+
+
+async def fetch_text(session: aiohttp.ClientSession, url: str,
+                     max_age: int = CACHE_MAX_AGE) -> tuple[str | None, dict | None]:
+    """
+    Return (body, parsed) for a url. parsed is what was stored with remember_parsed
+    when the response is fresh or the store says it is unchanged, in which case
+    there is nothing to parse. Otherwise parsed is None and body is the new response
+    """
+    entry = read_entry(url) if CACHE_ENABLED else {}
+    reusable = entry.get('body') is not None or 'parsed' in entry
+    host = urlsplit(url).hostname
+
+    if reusable and time.time() - entry.get('fetched_at', 0) < max_age:
+        metrics.count('CacheHit', Host=host)
+        return entry.get('body'), entry.get('parsed')
+
+    headers = {}
+    if reusable and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if reusable and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    status, response_headers, body = await request(session, url, headers)
+    if status == 304 and reusable:
+        metrics.count('CacheRevalidated', Host=host)
+        entry['fetched_at'] = time.time()
+        write_entry(url, entry)
+        return entry.get('body'), entry.get('parsed')
+
+    metrics.count('CacheMiss', Host=host)
+    if status >= 400:
+        raise aiohttp.ClientError(f'{status} response from {url}')
+    etag = response_headers.get('ETag')
+    last_modified = response_headers.get('Last-Modified')
+
+    if CACHE_ENABLED:
+        write_entry(url, {
+            'url': url,
+            'body': body,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time()
+        })
+    return body, None
@@ -0,0 +1,71 @@
+"""Script which reads and writes the files passed between pipeline stages as Arrow IPC with fixed schemas"""
+
+import os
+
+import numpy as np
+import pyarrow as pa
+
+
+# listings as scraped from one store, unmatched games are all null rows
+RAW_SCHEMA = pa.schema([
+    ('name', pa.string()),
+    ('base_price_gbp_pence', pa.int64()),
+    ('final_price_gbp_pence', pa.int64())
+])
+
+# rows ready for RDS, the columns of a transform_batch batch
+CLEAN_SCHEMA = pa.schema([
+    ('game_name', pa.string()),
+    ('retail_price', pa.int64()),
+    ('platform_name', pa.string()),
+    ('listing_date', pa.date32()),
+    ('discount_percent', pa.int64()),
+    ('final_price', pa.int64())
+])
+
+
+def write_table(table: pa.Table, path: str) -> None:
+    """Write a table as an Arrow IPC file, replacing any old file in a single step"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def read_table(path: str, schema: pa.Schema) -> pa.Table:
+    """
+    Memory map an Arrow IPC file, so its columns are read from the page cache
+    without copying. Raises ValueError if it was not written with schema
+    """
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    if not table.schema.equals(schema):
+        raise ValueError(f'{path} does not match the expected schema')
+    return table
+
+
+def write_raw_listings(listings: list[dict], path: str) -> None:
+    """Write the listings scraped from one store"""
+    write_table(pa.Table.from_pylist(listings, schema=RAW_SCHEMA), path)
+
+
+def read_raw_listings(path: str) -> pa.Table:
+    """Read the listings scraped from one store"""
+    return read_table(path, RAW_SCHEMA)
+
+
+def write_clean_batch(batch: dict[str, np.ndarray], path: str) -> None:
+    """Write a columnar batch of transformed rows"""
+    write_table(pa.table({column: pa.array(batch[column], type=field.type)
+                          for column, field in zip(CLEAN_SCHEMA.names, CLEAN_SCHEMA)},
+                         schema=CLEAN_SCHEMA), path)
+
+
+def read_clean_batch(path: str) -> dict[str, np.ndarray]:
+    """Read transformed rows back into a columnar batch, numeric columns without a copy"""
+    table = read_table(path, CLEAN_SCHEMA)
+    return {column: table.column(column).to_numpy() for column in CLEAN_SCHEMA.names}
@@ -1,35 +1,112 @@
 """Script for loading data to RDS"""
 import json
+import threading
 import psycopg2
+from psycopg2.extensions import cursor
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from datetime import date
 from os import environ
 
+import metrics
+
 load_dotenv()
 
 
-DATA_PATH = "/var/task/tmp/data/clean_data.json"
+DATA_PATH = "/var/task/tmp/data/clean_data.arrow"
+PAGE_SIZE = 1000  # rows sent per statement by the bulk loader
+# listings whose price and discount match the last one written are skipped,
+# unless HEARTBEAT_DAYS (0 for never) have passed since it. The Athena queries only look
+# that many days back for a game's price, so keep it in step with theirs
+SKIP_UNCHANGED = environ.get('SKIP_UNCHANGED_PRICES', 'true').lower() == 'true'
+HEARTBEAT_DAYS = int(environ.get('HEARTBEAT_DAYS', 7))
+LOAD_COLUMNS = ['game_name', 'retail_price', 'platform_name',
+                'listing_date', 'discount_percent', 'final_price']
+
+# Game and platform ids never change once committed, so they are kept for the
+# life of the process (and across warm Lambda invocations) to skip lookups
+GAME_ID_CACHE: dict[str, int] = {}
+PLATFORM_ID_CACHE: dict[str, int] = {}
+ID_CACHE_LOCK = threading.Lock()
+
+# connections kept open for the life of the container, so warm invocations skip connecting.
+# Up to DB_POOL_SIZE idle ones are kept, enough for every ETL chunk thread
+POOL_SIZE = int(environ.get('DB_POOL_SIZE', 10))
+IDLE_CONNECTIONS = []
+POOL_LOCK = threading.Lock()
+
+
+class CountingCursor(cursor):
+    """Cursor counting every statement it sends as a DB round trip"""
+
+    def execute(self, query, vars=None):
+        metrics.count('DbRoundTrips')
+        return super().execute(query, vars)
+
+
+def is_alive(conn) -> bool:
+    """
+    Check a kept connection with SELECT 1, closing it if the server does not answer.
+    RDS and NAT gateways drop idle connections without conn.closed noticing
+    """
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        conn.close()
+        return False
 
 
 def get_connection():
-    """Create and return new DB connection"""
+    """
+    Return an idle DB connection left by an earlier caller that still answers, or a new one.
+    Hand it back with release_connection instead of closing it
+    """
+    while True:
+        with POOL_LOCK:
+            if not IDLE_CONNECTIONS:
+                break
+            conn = IDLE_CONNECTIONS.pop()
+        if is_alive(conn):
+            return conn
+
     return psycopg2.connect(
         host=environ['RDS_HOST'],
         port=environ['PORT'],
         user=environ['RDS_USERNAME'],
         password=environ['RDS_PASSWORD'],
-        dbname=environ['DB_NAME']
+        dbname=environ['DB_NAME'],
+        cursor_factory=CountingCursor
     )
 
 
+def release_connection(conn) -> None:
+    """
+    Keep a connection for the next caller, rolling back anything left uncommitted.
+    Broken connections and any beyond POOL_SIZE are closed
+    """
+    if not conn.closed:
+        try:
+            conn.rollback()
+            with POOL_LOCK:
+                if len(IDLE_CONNECTIONS) < POOL_SIZE:
+                    IDLE_CONNECTIONS.append(conn)
+                    return
+        except psycopg2.Error:
+            pass
+    conn.close()
+
+
 def get_or_create_game(cur, game_name: str, retail_price: int) -> int:
     """Return game_id: insert if game does not exist."""
-    cur.execute(
-        """
+    select = """
             SELECT game_id FROM wishbone.game WHERE game_name = %s;
-        """,
-        (game_name,)
-    )
+        """
+    cur.execute(select, (game_name,))
     row = cur.fetchone()
 
     if row:
@@ -39,21 +116,26 @@ def get_or_create_game(cur, game_name: str, retail_price: int) -> int:
         """
             INSERT INTO wishbone.game (game_name, retail_price)
             VALUES (%s, %s)
+            ON CONFLICT (game_name) DO NOTHING
             RETURNING game_id;
         """,
         (game_name, retail_price)
     )
+    row = cur.fetchone()
+    if row:
+        return row[0]
+
+    # inserted by another worker since our lookup
+    cur.execute(select, (game_name,))
     return cur.fetchone()[0]
 
 
 def get_or_create_platform(cur, platform_name: str) -> int:
     """Return platform_id: insert if platform does not exist."""
-    cur.execute(
-        """
+    select = """
             SELECT platform_id FROM wishbone.platform WHERE platform_name = %s;
-        """,
-        (platform_name,)
-    )
+        """
+    cur.execute(select, (platform_name,))
     row = cur.fetchone()
 
     if row:
@@ -63,10 +145,17 @@ def get_or_create_platform(cur, platform_name: str) -> int:
         """
             INSERT INTO wishbone.platform (platform_name)
             VALUES (%s)
+            ON CONFLICT (platform_name) DO NOTHING
             RETURNING platform_id;
         """,
         (platform_name,)
     )
+    row = cur.fetchone()
+    if row:
+        return row[0]
+
+    # inserted by another worker since our lookup
+    cur.execute(select, (platform_name,))
     return cur.fetchone()[0]
 
 
@@ -81,15 +170,389 @@ def insert_listing(cur, game_id: int, platform_id: int, price: int, discount_per
     )
 
 
-def load_data() -> None:
-    """Main load function"""
-    with open(DATA_PATH, "r") as f:
-        data = json.load(f)
+def get_dimension_ids(cur, game_names: list[str], platform_names: list[str]) -> tuple[dict, dict]:
+    """Return the existing game and platform ids for the given names in one query"""
+    cur.execute(
+        """
+            SELECT 'game', game_name, game_id FROM wishbone.game WHERE game_name = ANY(%s)
+            UNION ALL
+            SELECT 'platform', platform_name, platform_id FROM wishbone.platform WHERE platform_name = ANY(%s);
+        """,
+        (game_names, platform_names)
+    )
+    game_ids = {}
+    platform_ids = {}
+    for table, name, dimension_id in cur.fetchall():
+        if table == 'game':
+            game_ids[name] = dimension_id
+        else:
+            platform_ids[name] = dimension_id
+
+    return game_ids, platform_ids
+
+
+def get_cached_ids(cur, game_names: list[str], platform_names: list[str]) -> tuple[dict, dict]:
+    """
+    Return the known game and platform ids, only querying RDS (in one
+    query) for the names missing from the in-process cache
+    """
+    with ID_CACHE_LOCK:
+        game_ids = {name: GAME_ID_CACHE[name]
+                    for name in game_names if name in GAME_ID_CACHE}
+        platform_ids = {name: PLATFORM_ID_CACHE[name]
+                        for name in platform_names if name in PLATFORM_ID_CACHE}
+
+    missing_games = [name for name in game_names if name not in game_ids]
+    missing_platforms = [
+        name for name in platform_names if name not in platform_ids]
+    if not missing_games and not missing_platforms:
+        return game_ids, platform_ids
+
+    # rows found here were committed by earlier runs, so they are safe to cache
+    found_games, found_platforms = get_dimension_ids(
+        cur, missing_games, missing_platforms)
+    remember_ids(found_games, found_platforms)
+
+    game_ids.update(found_games)
+    platform_ids.update(found_platforms)
+    return game_ids, platform_ids
+
+
+def remember_ids(game_ids: dict[str, int], platform_ids: dict[str, int]) -> None:
+    """Add committed game and platform ids to the in-process cache"""
+    with ID_CACHE_LOCK:
+        GAME_ID_CACHE.update(game_ids)
+        PLATFORM_ID_CACHE.update(platform_ids)
+
+
+def insert_games(cur, games: dict[str, int]) -> dict[str, int]:
+    """Insert games (name: retail price) in one statement, returning name: game_id"""
+    if not games:
+        return {}
+
+    rows = execute_values(
+        cur,
+        """
+            INSERT INTO wishbone.game (game_name, retail_price)
+            VALUES %s
+            ON CONFLICT (game_name) DO NOTHING
+            RETURNING game_name, game_id;
+        """,
+        # in name order, so workers inserting the same names lock them in the same order
+        sorted(games.items()),
+        page_size=PAGE_SIZE,
+        fetch=True
+    )
+    game_ids = dict(rows)
+
+    # names not returned were inserted by another worker since our lookup
+    raced = [name for name in games if name not in game_ids]
+    if raced:
+        game_ids.update(get_dimension_ids(cur, raced, [])[0])
+    return game_ids
+
+
+def insert_platforms(cur, platform_names: list[str]) -> dict[str, int]:
+    """Insert platforms in one statement, returning name: platform_id"""
+    if not platform_names:
+        return {}
+
+    rows = execute_values(
+        cur,
+        """
+            INSERT INTO wishbone.platform (platform_name)
+            VALUES %s
+            ON CONFLICT (platform_name) DO NOTHING
+            RETURNING platform_name, platform_id;
+        """,
+        [(name,) for name in sorted(platform_names)],
+        page_size=PAGE_SIZE,
+        fetch=True
+    )
+    platform_ids = dict(rows)
+
+    # names not returned were inserted by another worker since our lookup
+    raced = [name for name in platform_names if name not in platform_ids]
+    if raced:
+        platform_ids.update(get_dimension_ids(cur, [], raced)[1])
+    return platform_ids
+
+
+def insert_listings(cur, listings: list[tuple]) -> None:
+    """Insert listing rows, skipping any already recorded, in as few statements as possible"""
+    execute_values(
+        cur,
+        """
+            INSERT INTO wishbone.listing (game_id, platform_id, price, discount_percent, recording_date)
+            VALUES %s
+            ON CONFLICT DO NOTHING;
+        """,
+        # in key order, so concurrent workers lock the rows in the same order
+        sorted(listings),
+        page_size=PAGE_SIZE
+    )
+
+
+def get_latest_prices(cur, game_ids: list[int], platform_ids: list[int]) -> dict[tuple[int, int], tuple]:
+    """Return {(game id, platform id): (price, discount, date)} of the last listing written for each pair, in one query"""
+    cur.execute(
+        """
+            SELECT game_id, platform_id, price, discount_percent, recording_date
+            FROM wishbone.latest_price
+            WHERE game_id = ANY(%s) AND platform_id = ANY(%s);
+        """,
+        (list(game_ids), list(platform_ids))
+    )
+    return {(game_id, platform_id): (price, discount_percent, recording_date)
+            for game_id, platform_id, price, discount_percent, recording_date in cur.fetchall()}
+
+
+def select_changes(listings: list[tuple], latest: dict[tuple[int, int], tuple],
+                   heartbeat_days: int = 0) -> list[tuple]:
+    """
+    Keep the listings whose price or discount moved since the last one written
+    for their game and platform, or whose heartbeat is due. latest is updated as it goes
+    """
+    changed = []
+    for listing in listings:
+        game_id, platform_id, price, discount_percent, listing_date = listing
+        listing_day = date.fromisoformat(str(listing_date))
+        last = latest.get((game_id, platform_id))
+
+        if last is not None:
+            last_price, last_discount, last_day = last
+            heartbeat_due = heartbeat_days > 0 and (
+                listing_day - last_day).days >= heartbeat_days
+            if (price, discount_percent) == (last_price, last_discount) and not heartbeat_due:
+                continue
+
+        latest[(game_id, platform_id)] = (price, discount_percent, listing_day)
+        changed.append(listing)
+    return changed
+
+
+def save_latest_prices(cur, listings: list[tuple]) -> None:
+    """Record the listings just written as the last known price of their game and platform"""
+    # one row per pair, a statement cannot update the same row twice. Sorted so
+    # concurrent workers lock the pairs in the same order and cannot deadlock
+    latest = sorted({(listing[0], listing[1]): listing for listing in listings}.items())
+    latest = [listing for _, listing in latest]
+    if not latest:
+        return
+
+    execute_values(
+        cur,
+        """
+            INSERT INTO wishbone.latest_price (game_id, platform_id, price, discount_percent, recording_date)
+            VALUES %s
+            ON CONFLICT (game_id, platform_id) DO UPDATE
+                SET price = EXCLUDED.price, discount_percent = EXCLUDED.discount_percent,
+                    recording_date = EXCLUDED.recording_date
+                WHERE latest_price.recording_date <= EXCLUDED.recording_date;
+        """,
+        latest,
+        page_size=PAGE_SIZE
+    )
+
+
+def get_store_ids(game_names: list[str]) -> dict[str, dict[str, tuple[int, str]]]:
+    """
+    Return {platform name: {game name: (store product id, store title)}} for the
+    games already resolved on each store, or nothing if the lookup fails
+    """
+    try:
+        conn = get_connection()
+    except psycopg2.Error as e:
+        print(f"Error: {e}")
+        return {}
+
+    cur = conn.cursor()
+    store_ids = {}
+
+    try:
+        cur.execute(
+            """
+                SELECT p.platform_name, g.game_name, s.store_product_id, s.store_title
+                FROM wishbone.store_product s
+                JOIN wishbone.game g ON g.game_id = s.game_id
+                JOIN wishbone.platform p ON p.platform_id = s.platform_id
+                WHERE g.game_name = ANY(%s);
+            """,
+            (game_names,)
+        )
+        for platform_name, game_name, product_id, title in cur.fetchall():
+            store_ids.setdefault(platform_name, {})[
+                game_name] = (product_id, title)
+
+    except psycopg2.Error as e:
+        print(f"Error: {e}")
+
+    finally:
+        cur.close()
+        release_connection(conn)
+
+    return store_ids
+
+
+def save_store_ids(cur, store_ids: dict[str, dict[str, tuple[int, str]]]) -> None:
+    """Upsert resolved store ids, skipping names with no game row and rows that have not changed"""
+    rows = [(game_name, platform_name, product_id, title)
+            for platform_name, resolved in store_ids.items()
+            for game_name, (product_id, title) in resolved.items()]
+    if not rows:
+        return
+
+    execute_values(
+        cur,
+        """
+            INSERT INTO wishbone.store_product (game_id, platform_id, store_product_id, store_title)
+            SELECT g.game_id, p.platform_id, v.store_product_id, v.store_title
+            FROM (VALUES %s) AS v (game_name, platform_name, store_product_id, store_title)
+            JOIN wishbone.game g ON g.game_name = v.game_name
+            JOIN wishbone.platform p ON p.platform_name = v.platform_name
+            -- in key order, so concurrent workers lock the rows in the same order
+            ORDER BY g.game_id, p.platform_id
+            ON CONFLICT (game_id, platform_id) DO UPDATE
+                SET store_product_id = EXCLUDED.store_product_id, store_title = EXCLUDED.store_title
+                WHERE (store_product.store_product_id, store_product.store_title)
+                    IS DISTINCT FROM (EXCLUDED.store_product_id, EXCLUDED.store_title);
+        """,
+        rows,
+        page_size=PAGE_SIZE
+    )
+
+
+def add_to_watchlist(cur, game_ids: list[int]) -> None:
+    """Keep these games in the daily ETL, restarting the watch of ones already on the watchlist"""
+    if not game_ids:
+        return
+    cur.execute(
+        """
+            INSERT INTO wishbone.watchlist (game_id)
+            SELECT UNNEST(%s::INT[])
+            ON CONFLICT (game_id) DO UPDATE SET added = NOW();
+        """,
+        (sorted(game_ids),)
+    )
+
+
+def read_clean_data() -> list[dict] | dict:
+    """
+    Read the transformed rows written by a standalone transform run, as a
+    columnar batch from its Arrow file or as rows from an older json file
+    """
+    if DATA_PATH.endswith(".json"):
+        with open(DATA_PATH, "r") as f:
+            return json.load(f)
+    # pyarrow is only needed when the stages run on their own
+    from interchange import read_clean_batch
+    return read_clean_batch(DATA_PATH)
+
+
+def batch_columns(data: list[dict] | dict) -> dict[str, list]:
+    """
+    The loaded columns as plain python lists, from a columnar batch
+    of arrays (transform_batch) or a list of row dicts (transform_all)
+    """
+    if isinstance(data, dict):
+        return {column: data[column].tolist() for column in LOAD_COLUMNS}
+    return {column: [product.get(column) for product in data] for column in LOAD_COLUMNS}
+
+
+def load_data_bulk(data: list[dict] | dict | None = None, store_ids: dict | None = None,
+                   watch: bool = False) -> int:
+    """
+    Set based load: resolves every id in one query, upserts missing
+    games and platforms and writes the listings whose price changed in a single transaction,
+    along with any store ids resolved by the extract. With watch the games
+    are added to the watchlist priced by the daily ETL. Returns the listings written,
+    errors are raised after rolling back
+    """
+    if data is None:
+        data = read_clean_data()
+    columns = batch_columns(data)
+
+    if not columns["game_name"]:
+        print("No rows to load")
+        return 0
+
+    # the first listing seen for a game sets its retail price
+    games = {}
+    for game_name, retail_price in zip(columns["game_name"], columns["retail_price"]):
+        games.setdefault(game_name, retail_price)
+    platform_names = list(set(columns["platform_name"]))
+
+    conn = get_connection()
+    cur = conn.cursor()
+
+    try:
+        game_ids, platform_ids = get_cached_ids(
+            cur, list(games), platform_names)
+
+        new_game_ids = insert_games(
+            cur, {name: price for name, price in games.items() if name not in game_ids})
+        new_platform_ids = insert_platforms(
+            cur, [name for name in platform_names if name not in platform_ids])
+        game_ids.update(new_game_ids)
+        platform_ids.update(new_platform_ids)
+
+        listings = [
+            (game_ids[game_name], platform_ids[platform_name],
+             final_price, discount_percent, listing_date)
+            for game_name, platform_name, final_price, discount_percent, listing_date
+            in zip(columns["game_name"], columns["platform_name"], columns["final_price"],
+                   columns["discount_percent"], columns["listing_date"])
+        ]
+        if SKIP_UNCHANGED:
+            latest = get_latest_prices(cur, list(set(game_ids.values())),
+                                       list(set(platform_ids.values())))
+            listings = select_changes(listings, latest, HEARTBEAT_DAYS)
+        insert_listings(cur, listings)
+        save_latest_prices(cur, listings)
+
+        if store_ids:
+            save_store_ids(cur, store_ids)
+        if watch:
+            add_to_watchlist(cur, list(game_ids.values()))
+
+        conn.commit()
+        # new ids only go in the cache once they can no longer be rolled back
+        remember_ids(new_game_ids, new_platform_ids)
+        metrics.count('RowsReceived', len(columns['game_name']))
+        metrics.count('RowsWritten', len(listings))
+        print(f"Bulk load completed successfully: {len(listings)} of "
+              f"{len(columns['game_name'])} rows changed")
+        return len(listings)
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error: {e}")
+        # let the caller record the failed chunk
+        raise
+
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def load_data(data: list[dict] | dict | None = None) -> None:
+    """
+    Main load function, reads the transformed rows from disk when none are given.
+    Row by row, but skips unchanged prices and records the latest ones as load_data_bulk does
+    """
+    if data is None:
+        data = read_clean_data()
+    if isinstance(data, dict):
+        data = [dict(zip(LOAD_COLUMNS, row))
+                for row in zip(*batch_columns(data).values())]
 
     conn = get_connection()
     cur = conn.cursor()
+    game_ids = {}
+    platform_ids = {}
 
     try:
+        listings = []
         for product in data:
             game_name = product.get("game_name")
             retail_price = product.get("retail_price")
@@ -98,14 +561,27 @@ def load_data() -> None:
             discount_percent = product.get("discount_percent")
             price = product.get("final_price")
 
-            game_id = get_or_create_game(cur, game_name, retail_price)
-            platform_id = get_or_create_platform(cur, platform_name)
+            if game_name not in game_ids:
+                game_ids[game_name] = GAME_ID_CACHE.get(
+                    game_name) or get_or_create_game(cur, game_name, retail_price)
+            if platform_name not in platform_ids:
+                platform_ids[platform_name] = PLATFORM_ID_CACHE.get(
+                    platform_name) or get_or_create_platform(cur, platform_name)
 
-            insert_listing(cur, game_id, platform_id, price,
-                           discount_percent, listing_date)
+            listings.append((game_ids[game_name], platform_ids[platform_name], price,
+                             discount_percent, listing_date))
 
-            conn.commit()
-            print("Load completed successfully")
+        if SKIP_UNCHANGED:
+            latest = get_latest_prices(cur, list(set(game_ids.values())),
+                                       list(set(platform_ids.values())))
+            listings = select_changes(listings, latest, HEARTBEAT_DAYS)
+        for listing in listings:
+            insert_listing(cur, *listing)
+        save_latest_prices(cur, listings)
+
+        conn.commit()
+        remember_ids(game_ids, platform_ids)
+        print("Load completed successfully")
 
     except Exception as e:
         conn.rollback()
@@ -113,7 +589,7 @@ def load_data() -> None:
 
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""
+Script which records stage timings, HTTP latency, row counts and cache hits and emits them
+as CloudWatch embedded metric format (EMF) or JSON log lines. The same file is copied into
+each Lambda's folder
+"""
+
+from contextlib import contextmanager
+import json
+from os import environ
+import threading
+import time
+
+
+# emf on Lambda, where CloudWatch turns the log lines into metrics, nothing when run locally
+BACKEND = environ.get('METRICS_BACKEND',
+                      'emf' if 'AWS_LAMBDA_FUNCTION_NAME' in environ else 'none').lower()
+NAMESPACE = environ.get('METRICS_NAMESPACE', 'Wishbone')
+EMF_MAX_VALUES = 100  # values CloudWatch accepts for one metric in one log line
+
+# {dimensions: {metric name: {'unit': unit, 'values': [...]}}}, shared by every worker thread
+METRICS: dict[tuple, dict[str, dict]] = {}
+METRICS_LOCK = threading.Lock()
+
+
+def record(name: str, value: float, unit: str = 'Count', **dimensions) -> None:
+    """
+    Record one value of a metric. Keep dimensions few and fixed (a store, a stage),
+    every distinct combination is a separate CloudWatch metric
+    """
+    key = tuple(sorted(dimensions.items()))
+    with METRICS_LOCK:
+        metric = METRICS.setdefault(key, {}).setdefault(
+            name, {'unit': unit, 'values': []})
+        metric['values'].append(value)
+
+
+def count(name: str, value: int = 1, **dimensions) -> None:
+    """Add to a count, e.g. rows written or cache hits"""
+    record(name, value, 'Count', **dimensions)
+
+
+@contextmanager
+def timer(name: str, **dimensions):
+    """Record the time the block takes in milliseconds, whether or not it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, 'Milliseconds', **dimensions)
+
+
+def summarise(values: list[float]) -> dict:
+    return {'count': len(values), 'sum': round(sum(values), 3),
+            'min': round(min(values), 3), 'max': round(max(values), 3)}
+
+
+def summary(recorded: dict[tuple, dict[str, dict]] | None = None) -> dict[str, dict]:
+    """Every metric in recorded (by default all so far) summed over its dimensions, {name: {unit, count, sum, min, max}}"""
+    values, units = {}, {}
+    with METRICS_LOCK:
+        for metrics in (METRICS if recorded is None else recorded).values():
+            for name, metric in metrics.items():
+                values.setdefault(name, []).extend(metric['values'])
+                units[name] = metric['unit']
+    return {name: {'unit': units[name], **summarise(values[name])}
+            for name in sorted(values)}
+
+
+def emf_lines(dimensions: dict, metrics: dict[str, dict], properties: dict) -> list[dict]:
+    """EMF documents for one set of dimensions, split so no metric has more than EMF_MAX_VALUES values"""
+    longest = max(len(metric['values']) for metric in metrics.values())
+    lines = []
+    for start in range(0, longest, EMF_MAX_VALUES):
+        chunk = {name: metric for name, metric in metrics.items()
+                 if len(metric['values']) > start}
+        lines.append({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': metric['unit']}
+                                for name, metric in chunk.items()]
+                }]
+            },
+            **properties,
+            **dimensions,
+            **{name: metric['values'][start:start + EMF_MAX_VALUES]
+               for name, metric in chunk.items()}
+        })
+    return lines
+
+
+def json_line(dimensions: dict, metrics: dict[str, dict], properties: dict) -> dict:
+    """One JSON log line for a set of dimensions, each metric summarised"""
+    return {
+        'timestamp': time.time(),
+        **properties,
+        **dimensions,
+        'metrics': {name: {'unit': metric['unit'], **summarise(metric['values'])}
+                    for name, metric in metrics.items()}
+    }
+
+
+def flush(**properties) -> dict[str, dict]:
+    """
+    Emit everything recorded since the last flush with BACKEND, properties (e.g. the
+    function name) are added to every line. Returns the summary of what was emitted
+    """
+    with METRICS_LOCK:
+        recorded = dict(METRICS)
+        METRICS.clear()
+
+    for key, metrics in recorded.items():
+        dimensions = dict(key)
+        if BACKEND == 'emf':
+            for line in emf_lines(dimensions, metrics, properties):
+                print(json.dumps(line, default=str))
+        elif BACKEND == 'json':
+            print(json.dumps(json_line(dimensions, metrics, properties), default=str))
+    return summary(recorded)
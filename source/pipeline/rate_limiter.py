@@ -0,0 +1,128 @@
+"""Script which paces requests to each store host and retries throttled requests with jittered backoff"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+import metrics
+
+
+START_RATE = float(os.environ.get('START_REQUESTS_PER_SECOND', 8))  # per host
+MIN_RATE = 0.5
+MAX_RATE = float(os.environ.get('MAX_REQUESTS_PER_SECOND', 32))
+RATE_STEP = 0.1  # requests per second added after every success
+BURST = 4  # requests a quiet host may send at once
+MAX_RETRIES = 4
+BASE_BACKOFF = 0.5  # seconds
+MAX_BACKOFF = 30  # seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostLimiter:
+    """
+    Token bucket for one host. The refill rate climbs slowly while requests
+    succeed and halves whenever the host throttles us or fails
+    """
+
+    def __init__(self, rate: float | None = None, burst: int = BURST):
+        self.rate = rate or START_RATE
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # shared by the event loops of every worker thread
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def on_success(self) -> None:
+        """Additive increase after a good response"""
+        with self.lock:
+            self.rate = min(MAX_RATE, self.rate + RATE_STEP)
+
+    def on_throttle(self, retry_after: float | None = None) -> None:
+        """Multiplicative decrease after a 429 / 5xx, pausing the host if it asked us to wait"""
+        with self.lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until,
+                                        time.monotonic() + retry_after)
+
+
+LIMITERS: dict[str, HostLimiter] = {}
+LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(host: str) -> HostLimiter:
+    """Return the limiter for a host, creating it on first use"""
+    with LIMITERS_LOCK:
+        if host not in LIMITERS:
+            LIMITERS[host] = HostLimiter()
+        return LIMITERS[host]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter exponential backoff, so retries from many workers spread out"""
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+def retry_after_seconds(headers) -> float | None:
+    """Seconds from a Retry-After header, if it holds a number"""
+    value = headers.get('Retry-After')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+async def request(session: aiohttp.ClientSession, url: str,
+                  headers: dict | None = None) -> tuple[int, dict, str]:
+    """
+    GET a url at the pace its host allows, retrying 429 / 5xx responses and
+    dropped connections. Returns the status, headers and body of the last attempt
+    """
+    host = urlsplit(url).hostname
+    limiter = get_limiter(host)
+
+    for attempt in range(MAX_RETRIES + 1):
+        await asyncio.sleep(limiter.reserve())
+        try:
+            # the time on the wire, not the time spent waiting for a token
+            with metrics.timer('HttpLatency', Host=host):
+                async with session.get(url, headers=headers) as response:
+                    status = response.status
+                    response_headers = response.headers.copy()
+                    body = await response.text()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            metrics.count('HttpRetries', Host=host)
+            if attempt == MAX_RETRIES:
+                raise
+            limiter.on_throttle()
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+
+        if status not in RETRY_STATUSES:
+            limiter.on_success()
+            return status, response_headers, body
+
+        limiter.on_throttle(retry_after_seconds(response_headers))
+        metrics.count('HttpRetries', Host=host)
+        if attempt < MAX_RETRIES:
+            print(f'{status} from {host}, retrying')
+            await asyncio.sleep(backoff_delay(attempt))
+
+    return status, response_headers, body
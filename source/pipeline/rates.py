@@ -0,0 +1,74 @@
+"""Script which provides the USD to GBP exchange rate, fetched at most once per TTL and shared across threads"""
+
+import json
+import threading
+import time
+from os import environ
+
+
+DEFAULT_RATE = 0.77  # as of 19 nov 2025
+RATE_TTL = int(environ.get('FX_RATE_TTL', 6 * 60 * 60))  # seconds
+RETRY_TTL = 5 * 60  # seconds before retrying the API after a failure
+RATE_CACHE_PATH = environ.get('FX_RATE_CACHE_PATH', '/tmp/usd_gbp_rate.json')
+
+RATE_LOCK = threading.Lock()
+CACHED_RATE = {'rate': None, 'expires_at': 0.0}
+
+
+def fetch_live_rate() -> float:
+    """Ask the forex API for the current USD to GBP rate"""
+    # imported here so containers that find a cached rate never load it
+    from forex_python.converter import CurrencyRates
+    return float(CurrencyRates().get_rate("USD", "GBP"))
+
+
+RATE_PROVIDER = fetch_live_rate
+
+
+def set_rate_provider(provider) -> None:
+    """Swap the function used to fetch the rate (e.g. a stub in tests) and forget the cached rate"""
+    global RATE_PROVIDER
+    with RATE_LOCK:
+        RATE_PROVIDER = provider
+        CACHED_RATE.update(rate=None, expires_at=0.0)
+
+
+def read_last_good_rate() -> float:
+    """Return the last rate saved to disk, or the default if there is none"""
+    try:
+        with open(RATE_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return float(json.load(f)['rate'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_RATE
+
+
+def save_last_good_rate(rate: float) -> None:
+    """Save a rate to disk so later runs can fall back on it"""
+    try:
+        with open(RATE_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'rate': rate, 'saved_at': time.time()}, f)
+    except OSError as e:
+        print(f'Could not save exchange rate: {e}')
+
+
+def get_usd_to_gbp_rate(ttl: int = RATE_TTL) -> float:
+    """
+    Return the cached rate while it is fresh, otherwise fetch a new one.
+    Threads wait on the lock rather than all calling the API at once
+    """
+    with RATE_LOCK:
+        now = time.monotonic()
+        if CACHED_RATE['rate'] is not None and now < CACHED_RATE['expires_at']:
+            return CACHED_RATE['rate']
+
+        try:
+            rate = RATE_PROVIDER()
+            save_last_good_rate(rate)
+            expires_at = now + ttl
+        except Exception:
+            print("RatesNotAvailableError - Forex API is currently unavailable")
+            rate = read_last_good_rate()
+            expires_at = now + min(ttl, RETRY_TTL)
+
+        CACHED_RATE.update(rate=rate, expires_at=expires_at)
+        return rate
@@ -1,26 +1,44 @@
 """Lambda function for the transform and load stages"""
 from extract import extract_games
-from transform import transform_all
-from load import load_data
+from transform import transform_batch
+from load import load_data_bulk, get_store_ids
+import metrics
 
 
-def lambda_handler(event, context):
+def run_stages(game_inputs: list[str], watch: bool = True) -> dict:
+    """
+    Extract, transform and load the searched games, timing each stage.
+    With watch the games are priced by the daily ETL from now on
+    """
     try:
-        game_inputs = event.get('game_inputs')
-        extract_games(game_inputs)
+        with metrics.timer('StageTime', Stage='extract'):
+            store_ids = get_store_ids(game_inputs)
+            listings = extract_games(game_inputs, store_ids=store_ids)
     except Exception as e:
         return {'status': 'error', 'msg': f'{str(e)} occurred in extract_gog'}
     try:
-        transform_all()
+        with metrics.timer('StageTime', Stage='transform'):
+            batch = transform_batch(listings)
     except Exception as e:
         return {'status': 'error', 'msg': f'{str(e)} occurred in transform'}
     try:
-        load_data()
+        with metrics.timer('StageTime', Stage='load'):
+            load_data_bulk(batch, store_ids, watch=watch)
     except Exception as e:
         return {'status': 'error', 'msg': f'{str(e)} occurred in load'}
 
     return {'status': 'success', 'msg': 'RDS updated, pipeline successfully run'}
 
 
+def lambda_handler(event, context):
+    """
+    Run the search pipeline, returning its status with the metrics recorded on the way.
+    The coordinator sends "watch": false so its shards leave the watchlist alone
+    """
+    result = run_stages(event.get('game_inputs'), event.get('watch', True))
+    result['metrics'] = metrics.flush(Function='search_pipeline')
+    return result
+
+
 if __name__ == "__main__":
     pass
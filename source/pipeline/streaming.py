@@ -0,0 +1,116 @@
+"""Script which streams listings from the scraper through the transform into batched DB writes"""
+
+import asyncio
+import os
+
+import numpy as np
+
+from extract import scrape_stores
+from transform import transform_batch
+from load import load_data_bulk
+from rates import get_usd_to_gbp_rate
+import metrics
+
+
+QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 64))  # items held between stages
+WRITE_BATCH_SIZE = int(os.environ.get('STREAM_WRITE_BATCH_SIZE', 100))  # rows per DB write
+# seconds a part filled batch waits for more rows before it is written anyway
+WRITE_INTERVAL = float(os.environ.get('STREAM_WRITE_INTERVAL', 2))
+
+DONE = None  # sent down a queue when the stage before it has finished
+
+
+def merge_batches(batches: list[dict]) -> dict:
+    """Join columnar batches into one"""
+    return {column: np.concatenate([batch[column] for batch in batches])
+            for column in batches[0]}
+
+
+async def scrape_stage(raw_queue: asyncio.Queue, game_inputs: list[str],
+                       convert_rate: float, store_ids: dict) -> None:
+    """Put (platform name, listings) on the queue as each store lookup finishes"""
+    async def on_priced(platform_name: str, listings: list[dict]) -> None:
+        await raw_queue.put((platform_name, listings))
+
+    await scrape_stores(game_inputs, convert_rate, store_ids=store_ids,
+                        on_priced=on_priced)
+    await raw_queue.put(DONE)
+
+
+async def transform_stage(raw_queue: asyncio.Queue, clean_queue: asyncio.Queue) -> None:
+    """Calculate the discount columns for listings as they arrive"""
+    while (item := await raw_queue.get()) is not DONE:
+        platform_name, listings = item
+        batch = transform_batch({platform_name: listings})
+        if len(batch['game_name']):
+            await clean_queue.put(batch)
+    await clean_queue.put(DONE)
+
+
+async def load_stage(clean_queue: asyncio.Queue, store_ids: dict, watch: bool = False) -> int:
+    """
+    Write rows in batches of WRITE_BATCH_SIZE, or sooner if no rows arrive for WRITE_INTERVAL,
+    on a worker thread so scraping carries on during the write. Returns the listings written
+    """
+    pending, pending_rows, written = [], 0, 0
+
+    async def flush() -> None:
+        nonlocal pending, pending_rows, written
+        batch = merge_batches(pending)
+        # the scraper keeps adding ids, so the writer thread gets a copy
+        resolved = {platform_name: dict(ids)
+                    for platform_name, ids in store_ids.items()}
+        with metrics.timer('StageTime', Stage='stream_write'):
+            written += await asyncio.to_thread(load_data_bulk, batch, resolved, watch)
+        pending, pending_rows = [], 0
+
+    while True:
+        try:
+            item = await asyncio.wait_for(clean_queue.get(), WRITE_INTERVAL)
+        except asyncio.TimeoutError:
+            if pending:
+                await flush()
+            continue
+
+        if item is DONE:
+            if pending:
+                await flush()
+            return written
+
+        pending.append(item)
+        pending_rows += len(item['game_name'])
+        if pending_rows >= WRITE_BATCH_SIZE:
+            await flush()
+
+
+async def stream_pipeline(game_inputs: list[str], convert_rate: float,
+                          store_ids: dict | None = None, watch: bool = False) -> int:
+    """
+    Run scrape, transform and load at once, joined by bounded queues so a slow
+    stage holds back the ones before it. Returns the listings written, the first
+    error of any stage is raised after the others are cancelled
+    """
+    if store_ids is None:
+        store_ids = {}
+    raw_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    clean_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(scrape_stage(
+                raw_queue, game_inputs, convert_rate, store_ids))
+            group.create_task(transform_stage(raw_queue, clean_queue))
+            loaded = group.create_task(
+                load_stage(clean_queue, store_ids, watch))
+    except ExceptionGroup as errors:
+        raise errors.exceptions[0]
+
+    return loaded.result()
+
+
+def stream_games(game_inputs: list[str], usd_to_gbp_rate: float | None = None,
+                 store_ids: dict | None = None, watch: bool = False) -> int:
+    """Blocking entry point to the streaming pipeline, safe to call from worker threads"""
+    if usd_to_gbp_rate is None:
+        usd_to_gbp_rate = get_usd_to_gbp_rate()
+    return asyncio.run(stream_pipeline(game_inputs, usd_to_gbp_rate, store_ids, watch))
@@ -0,0 +1,102 @@
+"""Tests for the benchmark fixtures, store stand-in and runner"""
+
+import json
+from unittest.mock import patch
+import requests
+
+import bench_fixtures
+from bench_server import StandInServer
+from benchmark import run_split, best_time, compare
+import extract
+import rate_limiter
+
+
+def test_game_titles_repeatable():
+    assert bench_fixtures.game_titles(3) == ['Benchmark Game 00000', 'Benchmark Game 00001',
+                                             'Benchmark Game 00002']
+    assert bench_fixtures.title_prices('A') == bench_fixtures.title_prices('A')
+
+
+def test_steam_page_parses_to_title_prices():
+    title = 'Benchmark Game 00004'
+    base, final = bench_fixtures.title_prices(title)
+    page = extract.split_steam_html(bench_fixtures.steam_search_page(title), title)
+
+    expected = {'name': title, 'base_price_gbp_pence': base, 'final_price_gbp_pence': final}
+    assert extract.parse_steam(page) == expected
+    assert extract.parse_steam_fast(page) == expected
+
+
+def test_gog_catalog_first_product_is_title():
+    title = 'Benchmark Game 00001'
+    product = extract.first_gog_product(json.loads(bench_fixtures.gog_catalog(title)), title)
+
+    assert product['title'] == title
+    assert extract.parse_gog(product, 0.8)['name'] == title
+
+
+def test_raw_listings_unmatched():
+    listings = bench_fixtures.raw_listings(bench_fixtures.game_titles(20))
+
+    assert listings[9] == {} and listings[19] == {}
+    assert listings[0]['name'] == 'Benchmark Game 00000'
+
+
+def test_stand_in_throttles():
+    with StandInServer(latency=0, throttle_rate=2, retry_after=3) as server:
+        url = server.store_urls()['GOG_SEARCH'].format(search_term='Benchmark')
+        statuses = [requests.get(url, timeout=5).status_code for _ in range(4)]
+        response = requests.get(url, timeout=5)
+
+    assert statuses[0] == 200
+    assert 429 in statuses
+    assert response.headers.get('Retry-After') == '3'
+    assert server.throttled >= 2
+
+
+def test_extract_against_stand_in():
+    titles = bench_fixtures.game_titles(3)
+    store_ids = {}
+
+    with StandInServer(latency=0) as server, server.patch_extract(), \
+            patch('http_cache.CACHE_ENABLED', False), \
+            patch('rate_limiter.START_RATE', 1000), patch('rate_limiter.MAX_RATE', 1000):
+        rate_limiter.LIMITERS.clear()
+        found = extract.extract_games(titles, 0.8, store_ids)
+        server.remember_titles(titles)
+        repriced = extract.extract_games(titles, 0.8, store_ids)
+    rate_limiter.LIMITERS.clear()
+
+    assert [listing['name'] for listing in found['steam']] == titles
+    assert [listing['name'] for listing in found['gog']] == titles
+    assert repriced['steam'] == found['steam']
+    assert repriced['gog'] == found['gog']
+
+
+def test_run_split_covers_every_item():
+    seen = []
+    run_split(seen.extend, list(range(10)), 3)
+
+    assert sorted(seen) == list(range(10))
+
+
+def test_best_time_runs_setup_each_repeat():
+    calls = []
+    seconds = best_time(lambda: calls.append('run'), setup=lambda: calls.append('setup'), repeat=2)
+
+    assert calls == ['setup', 'run', 'setup', 'run']
+    assert seconds >= 0
+
+
+def test_compare(tmp_path, capsys):
+    baseline = tmp_path / 'before.json'
+    baseline.write_text(json.dumps({'results': [
+        {'benchmark': 'transform_batch', 'titles': 10, 'workers': 1, 'seconds': 2.0}]}))
+
+    compare([{'benchmark': 'transform_batch', 'titles': 10, 'workers': 1, 'seconds': 1.0},
+             {'benchmark': 'parse_steam', 'titles': 10, 'workers': 1, 'seconds': 1.0}],
+            str(baseline))
+
+    output = capsys.readouterr().out
+    assert '2.00x' in output
+    assert 'parse_steam' not in output
@@ -0,0 +1,29 @@
+"""Tests keeping the Lambda handlers quick to import"""
+
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+
+HANDLERS = ['etl_pipeline', 'search_pipeline', 'coordinator']
+# only needed off the hot path, each adds to every cold start if imported at the top
+SLOW_IMPORTS = ['pandas', 'pyarrow', 'bs4', 'requests', 'forex_python',
+                'boto3', 'botocore', 'awswrangler']
+
+
+def imported_modules(module: str) -> set[str]:
+    """Modules loaded by importing module in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, '-c', f'import json, sys, {module}; print(json.dumps(list(sys.modules)))'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return set(json.loads(output.stdout.splitlines()[-1]))
+
+
+@pytest.mark.parametrize('handler', HANDLERS)
+def test_handler_import_skips_slow_modules(handler):
+    loaded = imported_modules(handler)
+
+    assert handler in loaded
+    assert [module for module in SLOW_IMPORTS if module in loaded] == []
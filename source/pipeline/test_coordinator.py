@@ -0,0 +1,137 @@
+"""Tests for the fan out coordinator"""
+
+import io
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+from coordinator import (invoke_worker, run_local_worker, run_shard, fan_out, summarise_fan_out, lambda_handler,
+                         get_deadline)
+
+
+def lambda_response(payload, function_error=None):
+    """Shape of a boto3 lambda invoke response"""
+    response = {'StatusCode': 200,
+                'Payload': io.BytesIO(json.dumps(payload).encode())}
+    if function_error:
+        response['FunctionError'] = function_error
+    return response
+
+
+def test_invoke_worker_sends_shard():
+    client = MagicMock()
+    client.invoke.return_value = lambda_response(
+        {'status': 'success', 'msg': 'RDS updated, pipeline successfully run'})
+
+    result = invoke_worker(client, ['hades', 'celeste'])
+
+    assert result['status'] == 'success'
+    kwargs = client.invoke.call_args.kwargs
+    assert kwargs['InvocationType'] == 'RequestResponse'
+    assert json.loads(kwargs['Payload']) == {'game_inputs': ['hades', 'celeste'], 'watch': False}
+
+
+def test_run_local_worker_leaves_watchlist_alone():
+    with patch("coordinator.search_pipeline.run_stages", return_value={'status': 'success'}) as run_stages:
+        run_local_worker(['hades'])
+
+    run_stages.assert_called_once_with(['hades'], False)
+
+
+def test_invoke_worker_function_error():
+    client = MagicMock()
+    client.invoke.return_value = lambda_response(
+        {'errorMessage': 'Task timed out'}, 'Unhandled')
+
+    result = invoke_worker(client, ['hades'])
+
+    assert result['status'] == 'error'
+    assert 'Task timed out' in result['msg']
+
+
+def test_run_shard_success():
+    result = run_shard(3, ['a', 'b'], lambda games: {'status': 'success', 'msg': 'ok'})
+
+    assert result['shard'] == 3
+    assert result['games'] == 2
+    assert result['status'] == 'success'
+
+
+def test_run_shard_worker_raises():
+    def worker(games):
+        raise ConnectionError('no route')
+
+    result = run_shard(0, ['a'], worker)
+
+    assert result['status'] == 'error'
+    assert 'ConnectionError' in result['msg']
+
+
+def test_run_shard_not_started_near_deadline():
+    worker = MagicMock()
+
+    result = run_shard(0, ['a'], worker, deadline=time.time() + 60)
+
+    assert result['status'] == 'error'
+    assert 'not started' in result['msg']
+    worker.assert_not_called()
+
+
+def test_run_shard_started_before_deadline():
+    result = run_shard(0, ['a'], lambda games: {'status': 'success'}, deadline=time.time() + 900)
+
+    assert result['status'] == 'success'
+
+
+def test_get_deadline_from_lambda_context():
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 900_000
+
+    assert 880 < get_deadline(context) - time.time() <= 890
+    assert get_deadline({}) is None
+
+
+def test_run_shard_worker_returns_nothing():
+    result = run_shard(0, ['a'], lambda games: None)
+
+    assert result['status'] == 'error'
+
+
+def test_fan_out_invokes_one_worker_per_shard():
+    client = MagicMock()
+    client.invoke.side_effect = [lambda_response({'status': 'success'}),
+                                 lambda_response({'status': 'error', 'msg': 'load'})]
+
+    with patch("coordinator.get_lambda_client", return_value=client):
+        results = fan_out([['a', 'b'], ['c']], max_invocations=1)
+
+    assert client.invoke.call_count == 2
+    assert [result['shard'] for result in results] == [0, 1]
+    assert [result['status'] for result in results] == ['success', 'error']
+
+
+def test_fan_out_nothing_to_do():
+    assert fan_out([]) == []
+
+
+def test_summarise_fan_out():
+    summary = summarise_fan_out([
+        {'games': 2, 'status': 'success'},
+        {'games': 1, 'status': 'error'}
+    ], 2.0004)
+
+    assert summary['status'] == 'error'
+    assert summary['games'] == 3
+    assert summary['shards'] == 2
+    assert summary['failed_shards'] == 1
+    assert summary['seconds'] == 2.0
+
+
+def test_lambda_handler_shards_games():
+    with patch("coordinator.get_game_names", return_value=['a', 'b', 'c']), \
+            patch("coordinator.fan_out", return_value=[]) as fan_out_mock:
+        lambda_handler({'shard_size': 2, 'local': True}, {})
+
+    shards, _, local = fan_out_mock.call_args.args
+    assert shards == [['a', 'b'], ['c']]
+    assert local is True
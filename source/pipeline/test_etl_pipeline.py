@@ -0,0 +1,89 @@
+"""Tests for the ETL pipeline scheduler"""
+
+from unittest.mock import patch
+import pytest
+
+from etl_pipeline import make_chunks, run_chunk, run_chunks, summarise_run, lambda_handler
+
+
+def test_make_chunks_sizes():
+    games = [f'game {i}' for i in range(7)]
+
+    chunks = make_chunks(games, 3)
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert sum(chunks, []) == games
+
+
+def test_make_chunks_fewer_games_than_chunk_size():
+    assert make_chunks(['a', 'b'], 25) == [['a', 'b']]
+
+
+def test_make_chunks_no_games():
+    assert make_chunks([], 25) == []
+
+
+def test_make_chunks_invalid_size():
+    with pytest.raises(ValueError):
+        make_chunks(['a'], 0)
+
+
+def test_run_chunk_success():
+    with patch("etl_pipeline.pipeline", return_value=4):
+        result = run_chunk(2, ['a', 'b'])
+
+    assert result['chunk'] == 2
+    assert result['games'] == 2
+    assert result['rows'] == 4
+    assert result['status'] == 'success'
+    assert result['error'] is None
+
+
+def test_run_chunk_error_is_collected():
+    with patch("etl_pipeline.pipeline", side_effect=KeyError('RDS_HOST')):
+        result = run_chunk(0, ['a'])
+
+    assert result['status'] == 'error'
+    assert result['rows'] == 0
+    assert 'KeyError' in result['error']
+
+
+def test_run_chunks_keeps_order_and_errors():
+    def fake_pipeline(games):
+        if games == ['bad']:
+            raise ValueError('boom')
+        return len(games) * 2
+
+    with patch("etl_pipeline.pipeline", side_effect=fake_pipeline):
+        results = run_chunks([['a', 'b'], ['bad'], ['c']], max_workers=2)
+
+    assert [result['chunk'] for result in results] == [0, 1, 2]
+    assert [result['status'] for result in results] == [
+        'success', 'error', 'success']
+
+
+def test_run_chunks_nothing_to_do():
+    assert run_chunks([]) == []
+
+
+def test_summarise_run():
+    summary = summarise_run([
+        {'games': 2, 'rows': 4, 'status': 'success'},
+        {'games': 1, 'rows': 0, 'status': 'error'}
+    ], 1.23456)
+
+    assert summary['status'] == 'error'
+    assert summary['games'] == 3
+    assert summary['rows'] == 4
+    assert summary['failed_chunks'] == 1
+    assert summary['seconds'] == 1.235
+
+
+def test_lambda_handler_summary():
+    with patch("etl_pipeline.get_game_names", return_value=['a', 'b', 'c']), \
+            patch("etl_pipeline.pipeline", return_value=2):
+        summary = lambda_handler({'chunk_size': 2}, {})
+
+    assert summary['status'] == 'success'
+    assert summary['chunks'] == 2
+    assert summary['rows'] == 4
@@ -1,11 +1,28 @@
 """Tests for the extract script"""
 
 
+import aiohttp
 import pytest
 import requests
 from unittest.mock import patch
 
-from extract import get_steam_html, get_gog_prices, get_gog_html, convert_price, parse_steam, extract_games, output
+from extract import (get_steam_html, get_gog_prices, get_gog_html, convert_price, parse_steam, extract_games, output,
+                     split_steam_html, first_gog_product, parse_gog, fetch_steam_listing, fetch_gog_listing,
+                     parse_steam_fast, parse_steam_price, parse_gog_price, gog_amount, fetch_steam_prices,
+                     fetch_gog_prices, price_games, find_steam_app_id, scrape_stores)
+from rates import DEFAULT_RATE
+
+STEAM_PAGE = ('<div class="header"></div>'
+              '<a href="https://store.steampowered.com/app/413150/" data-ds-appid="413150">'
+              '<div class="search_name ellipsis"><span class="title">Stardew Valley</span></div>'
+              '<div class="discount_original_price">£10.99</div>'
+              '<div class="discount_final_price">£8.79</div>'
+              '<div class="search_name ellipsis"><span class="title">Stardew Valley OST</span></div>')
+
+GOG_RESPONSE = {'products': [
+    {'id': '1453375253', 'title': 'Stardew Valley', 'price': {'base': '$14.99', 'final': '$9.99'}},
+    {'title': 'Stardew Valley Soundtrack', 'price': {'base': '$5.99', 'final': '$5.99'}}
+]}
 
 
 class APIClient:
@@ -16,6 +33,13 @@ class APIClient:
         return response
 
 
+@pytest.fixture(autouse=True)
+def http_cache_dir(tmp_path):
+    """Every test starts with an empty response cache"""
+    with patch("http_cache.CACHE_DIR", str(tmp_path / "http_cache")):
+        yield
+
+
 @pytest.fixture
 def mock_response():
     with patch('requests.get') as mock_get:
@@ -44,3 +68,292 @@ def test_get_steam_html_valid_2():
     assert get_steam_html('qazwsxedcrfvtgbyhnujmikolp') == ''
     # note: this test fails if any game is created with this name
     # I believe this is unlikely
+
+
+def test_split_steam_html_first_result():
+    result = split_steam_html(STEAM_PAGE, 'stardew')
+    assert 'Stardew Valley</span>' in result
+    assert 'OST' not in result
+
+
+def test_split_steam_html_no_results():
+    assert split_steam_html('<div>nothing here</div>', 'stardew') == ''
+
+
+def test_first_gog_product():
+    assert first_gog_product(GOG_RESPONSE, 'stardew')[
+        'title'] == 'Stardew Valley'
+
+
+def test_first_gog_product_no_results():
+    assert first_gog_product({'products': []}, 'stardew') == {}
+
+
+def test_parse_gog_converts_dollars():
+    assert parse_gog(GOG_RESPONSE['products'][0], 0.5) == {
+        'name': 'Stardew Valley',
+        'base_price_gbp_pence': 749,
+        'final_price_gbp_pence': 499
+    }
+
+
+def test_parse_gog_no_price():
+    assert parse_gog({'title': 'Stardew Valley'}) == {}
+
+
+@pytest.mark.asyncio
+async def test_fetch_steam_listing(fake_session):
+    session = fake_session(STEAM_PAGE)
+
+    result = await fetch_steam_listing(session, 'stardew valley')
+
+    assert session.urls == [
+        'https://store.steampowered.com/search?term=stardew valley']
+    assert result == {
+        'name': 'Stardew Valley',
+        'base_price_gbp_pence': 1099,
+        'final_price_gbp_pence': 879
+    }
+
+
+@pytest.mark.asyncio
+async def test_fetch_gog_listing(fake_session):
+    result = await fetch_gog_listing(fake_session(GOG_RESPONSE), 'stardew valley', 0.5)
+
+    assert result['name'] == 'Stardew Valley'
+    assert result['final_price_gbp_pence'] == 499
+
+
+@pytest.mark.asyncio
+async def test_fetch_gog_listing_cached_uses_current_rate(fake_session):
+    session = fake_session(GOG_RESPONSE)
+
+    first = await fetch_gog_listing(session, 'stardew valley', 0.5)
+    cached = await fetch_gog_listing(session, 'stardew valley', 1.0)
+
+    assert len(session.urls) == 1
+    assert first['final_price_gbp_pence'] == 499
+    assert cached['final_price_gbp_pence'] == 999
+
+
+@pytest.mark.asyncio
+async def test_fetch_gog_prices_cached_uses_current_rate(fake_session):
+    session = fake_session(GOG_PRICE_RESPONSE)
+    product_ids = {"stardew valley": (1453375253, "Stardew Valley")}
+
+    await fetch_gog_prices(session, product_ids, 0.5)
+    cached = await fetch_gog_prices(session, product_ids, 1.0)
+
+    assert len(session.urls) == 1
+    assert cached["stardew valley"]["final_price_gbp_pence"] == 999
+
+
+@pytest.mark.asyncio
+async def test_fetch_gog_listing_bad_price(fake_session):
+    bad_response = {'products': [
+        {'title': 'Stardew Valley', 'price': {'base': 'soon', 'final': 'soon'}}]}
+
+    assert await fetch_gog_listing(fake_session(bad_response), 'stardew valley') == {}
+
+
+STEAM_BLOCKS = [
+    '<span class="title">Hades</span></div><div class="discount_block">'
+    '<div class="discount_pct">-50%</div><div class="discount_prices">'
+    '<div class="discount_original_price">£19.49</div>'
+    '<div class="discount_final_price">£9.74</div></div></div>',
+    '<span class="title">Stardew Valley</span>'
+    '<div class="discount_final_price">£10.99</div>',
+    '<span class="title">Tom &amp; Jerry</span>'
+    '<div class="discount_final_price your_price">Free</div>',
+    '<span class="title">Soundtrack Bundle</span><div class="bundle"></div>',
+    '<div class="no results"></div>',
+    ''
+]
+
+
+@pytest.mark.parametrize("block", STEAM_BLOCKS)
+def test_parse_steam_fast_matches_parse_steam(block):
+    assert parse_steam_fast(block) == parse_steam(block)
+
+
+def test_parse_steam_fast_discounted():
+    assert parse_steam_fast(STEAM_BLOCKS[0]) == {
+        'name': 'Hades',
+        'base_price_gbp_pence': 1949,
+        'final_price_gbp_pence': 974
+    }
+
+
+STEAM_PRICE_RESPONSE = {
+    "413150": {"success": True, "data": {"price_overview": {
+        "currency": "GBP", "initial": 1099, "final": 879, "discount_percent": 20}}},
+    "570": {"success": True, "data": []}
+}
+
+GOG_PRICE_RESPONSE = {"_embedded": {"items": [
+    {"_embedded": {"product": {"id": 1453375253},
+                   "prices": [{"currency": {"code": "USD"}, "basePrice": "1499 USD", "finalPrice": "999 USD"}]}}
+]}}
+
+
+def test_parse_steam_price():
+    assert parse_steam_price("Stardew Valley", STEAM_PRICE_RESPONSE["413150"]) == {
+        'name': 'Stardew Valley',
+        'base_price_gbp_pence': 1099,
+        'final_price_gbp_pence': 879
+    }
+
+
+def test_parse_steam_price_no_price():
+    assert parse_steam_price("Dota 2", STEAM_PRICE_RESPONSE["570"]) == {}
+
+
+def test_gog_amount():
+    assert gog_amount("1199 GBP") == 1199
+    assert gog_amount("1000 USD", 0.5) == 500
+
+
+def test_gog_amount_unknown_currency():
+    with pytest.raises(ValueError):
+        gog_amount("1000 EUR")
+
+
+def test_gog_search_and_batch_prices_agree():
+    """A game moving between the search and the batch path keeps its price"""
+    searched = parse_gog(GOG_RESPONSE["products"][0], 0.79)
+    batched = parse_gog_price("Stardew Valley", GOG_PRICE_RESPONSE["_embedded"]["items"][0], 0.79)
+
+    assert searched == batched
+
+
+def test_parse_gog_price_missing_product():
+    assert parse_gog_price("Stardew Valley", {}) == {}
+
+
+@pytest.mark.asyncio
+async def test_fetch_steam_prices_batch(fake_session):
+    session = fake_session(STEAM_PRICE_RESPONSE)
+
+    result = await fetch_steam_prices(session, {"stardew valley": (413150, "Stardew Valley"),
+                                                "dota 2": (570, "Dota 2")})
+
+    assert session.urls == [
+        "https://store.steampowered.com/api/appdetails?appids=413150,570&cc=gb&filters=price_overview"]
+    assert list(result) == ["stardew valley"]
+    assert result["stardew valley"]["name"] == "Stardew Valley"
+
+
+@pytest.mark.asyncio
+async def test_fetch_gog_prices_batch(fake_session):
+    session = fake_session(GOG_PRICE_RESPONSE)
+
+    result = await fetch_gog_prices(session, {"stardew valley": (1453375253, "Stardew Valley"),
+                                              "gone": (1, "Gone")})
+
+    assert "ids=1453375253,1" in session.urls[0]
+    assert "currency=USD" in session.urls[0]
+    assert result == {"stardew valley": {
+        'name': 'Stardew Valley',
+        'base_price_gbp_pence': int(1499 * DEFAULT_RATE),
+        'final_price_gbp_pence': int(999 * DEFAULT_RATE)
+    }}
+
+
+@pytest.mark.asyncio
+async def test_price_games_batches_known_and_searches_rest():
+    batches = []
+    searched = []
+
+    async def fetch_batch(ids):
+        batches.append(ids)
+        return {name: {'name': name} for name in ids if name != "Stale"}
+
+    async def fetch_one(name):
+        searched.append(name)
+        return {'name': name, 'searched': True}
+
+    with patch("extract.BATCH_SIZE", 2):
+        result = await price_games(["A", "B", "Stale", "New"],
+                                   {"A": 1, "B": 2, "Stale": 3},
+                                   fetch_batch, fetch_one)
+
+    assert batches == [{"A": 1, "B": 2}, {"Stale": 3}]
+    assert searched == ["Stale", "New"]
+    assert [listing['name'] for listing in result] == ["A", "B", "Stale", "New"]
+
+
+@pytest.mark.asyncio
+async def test_price_games_emits_listings_as_found():
+    emitted = []
+
+    async def fetch_batch(ids):
+        return {name: {'name': name} for name in ids}
+
+    async def fetch_one(name):
+        return {} if name == "Missing" else {'name': name}
+
+    async def on_priced(listings):
+        emitted.append([listing['name'] for listing in listings])
+
+    await price_games(["A", "New", "Missing"], {"A": 1},
+                      fetch_batch, fetch_one, on_priced)
+
+    # empty results are not emitted
+    assert emitted == [["A"], ["New"]]
+
+
+def test_find_steam_app_id():
+    assert find_steam_app_id(STEAM_PAGE) == 413150
+
+
+def test_find_steam_app_id_bundle():
+    page = '<a href="x" data-ds-appid="1,2,3"><div class="search_name ellipsis">'
+    assert find_steam_app_id(page) is None
+
+
+def test_find_steam_app_id_no_results():
+    assert find_steam_app_id('<div>nothing here</div>') is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_steam_listing_records_app_id(fake_session):
+    found_ids = {}
+
+    await fetch_steam_listing(fake_session(STEAM_PAGE), 'stardew', found_ids)
+
+    assert found_ids == {'stardew': (413150, 'Stardew Valley')}
+
+
+@pytest.mark.asyncio
+async def test_fetch_gog_listing_records_product_id(fake_session):
+    found_ids = {}
+
+    await fetch_gog_listing(fake_session(GOG_RESPONSE), 'stardew', found_ids=found_ids)
+
+    assert found_ids == {'stardew': (1453375253, 'Stardew Valley')}
+
+
+@pytest.mark.asyncio
+async def test_scrape_stores_updates_store_ids(fake_session):
+    store_ids = {'steam': {'hades': (1145360, 'Hades')}}
+
+    async def fake_steam_prices(session, ids):
+        return {name: {'name': title} for name, (_, title) in ids.items()}
+
+    async def fake_steam_listing(session, name, found_ids=None):
+        found_ids[name] = (413150, 'Stardew Valley')
+        return {'name': 'Stardew Valley'}
+
+    async def fake_gog_listing(session, name, convert_rate=None, found_ids=None):
+        return {}
+
+    with patch("extract.create_store_session", return_value=fake_session({})), \
+            patch("extract.fetch_steam_prices", fake_steam_prices), \
+            patch("extract.fetch_steam_listing", fake_steam_listing), \
+            patch("extract.fetch_gog_listing", fake_gog_listing):
+        steam_games, gog_games = await scrape_stores(['hades', 'stardew'], store_ids=store_ids)
+
+    assert steam_games == [{'name': 'Hades'}, {'name': 'Stardew Valley'}]
+    assert gog_games == [{}, {}]
+    assert store_ids['steam'] == {'hades': (1145360, 'Hades'),
+                                  'stardew': (413150, 'Stardew Valley')}
@@ -0,0 +1,108 @@
+"""Tests for the store response cache"""
+
+from unittest.mock import patch
+import aiohttp
+import pytest
+
+from http_cache import fetch_text, remember_parsed, read_entry, write_entry
+
+URL = 'https://store.steampowered.com/search?term=hades'
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path):
+    with patch("http_cache.CACHE_DIR", str(tmp_path)):
+        yield tmp_path
+
+
+@pytest.mark.asyncio
+async def test_fetch_text_miss_stores_body(fake_session, fake_response):
+    session = fake_session(fake_response(200, 'page', {'ETag': '"v1"'}))
+
+    result = await fetch_text(session, URL)
+
+    assert result == ('page', None)
+    assert session.sent_headers == [{}]
+    assert read_entry(URL)['etag'] == '"v1"'
+
+
+@pytest.mark.asyncio
+async def test_fetch_text_fresh_entry_skips_request(fake_session, fake_response):
+    session = fake_session(fake_response(200, 'page'))
+    await fetch_text(session, URL)
+    remember_parsed(URL, {'listing': {'name': 'Hades'}})
+
+    result = await fetch_text(session, URL)
+
+    assert result == (None, {'listing': {'name': 'Hades'}})
+    assert len(session.sent_headers) == 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_text_revalidates_stale_entry(fake_session, fake_response):
+    session = fake_session(
+        fake_response(200, 'page', {'ETag': '"v1"',
+                       'Last-Modified': 'Mon, 01 Dec 2025 00:00:00 GMT'}),
+        fake_response(304))
+    await fetch_text(session, URL)
+    remember_parsed(URL, {'listing': {}})
+
+    result = await fetch_text(session, URL, max_age=0)
+
+    assert result == (None, {'listing': {}})
+    assert session.sent_headers[1] == {
+        'If-None-Match': '"v1"',
+        'If-Modified-Since': 'Mon, 01 Dec 2025 00:00:00 GMT'
+    }
+
+
+@pytest.mark.asyncio
+async def test_fetch_text_changed_response_needs_parsing(fake_session, fake_response):
+    session = fake_session(fake_response(200, 'old', {'ETag': '"v1"'}),
+                           fake_response(200, 'new', {'ETag': '"v2"'}))
+    await fetch_text(session, URL)
+    remember_parsed(URL, {'listing': {}})
+
+    result = await fetch_text(session, URL, max_age=0)
+
+    assert result == ('new', None)
+    assert read_entry(URL)['etag'] == '"v2"'
+
+
+@pytest.mark.asyncio
+async def test_fetch_text_error_not_cached(fake_session, fake_response):
+    session = fake_session(fake_response(404, 'not found'))
+
+    with pytest.raises(aiohttp.ClientError):
+        await fetch_text(session, URL)
+
+    assert read_entry(URL) == {}
+
+
+@pytest.mark.asyncio
+async def test_fetch_text_disabled(fake_session, fake_response):
+    session = fake_session(fake_response(200, 'page'), fake_response(200, 'page'))
+
+    with patch("http_cache.CACHE_ENABLED", False):
+        await fetch_text(session, URL)
+        await fetch_text(session, URL)
+
+    assert len(session.sent_headers) == 2
+    assert read_entry(URL) == {}
+
+
+def test_remember_parsed_drops_body():
+    write_entry(URL, {'body': 'page', 'fetched_at': 0})
+
+    remember_parsed(URL, {'listing': {}})
+
+    assert read_entry(URL) == {'body': None,
+                               'fetched_at': 0, 'parsed': {'listing': {}}}
+
+
+def test_read_entry_corrupt_file(cache_dir):
+    write_entry(URL, {'body': 'page'})
+    for path in cache_dir.iterdir():
+        path.write_text('not json')
+
+    assert read_entry(URL) == {}
@@ -0,0 +1,68 @@
+"""Tests for the Arrow files passed between pipeline stages"""
+
+from datetime import date
+import numpy as np
+import pytest
+
+from interchange import (write_raw_listings, read_raw_listings, write_clean_batch, read_clean_batch,
+                         write_table, read_table, RAW_SCHEMA, CLEAN_SCHEMA)
+
+
+CLEAN_BATCH = {
+    "game_name": np.array(["Game A", "Game B"], dtype=object),
+    "retail_price": np.array([1000, 2000], dtype=np.int64),
+    "platform_name": np.array(["steam", "gog"], dtype=object),
+    "listing_date": np.array(["2025-01-01", "2025-01-01"], dtype="datetime64[D]"),
+    "discount_percent": np.array([50, 0], dtype=np.int64),
+    "final_price": np.array([500, 2000], dtype=np.int64)
+}
+
+
+def test_raw_listings_round_trip(tmp_path):
+    path = str(tmp_path / "steam_products.arrow")
+
+    write_raw_listings([{"name": "Game A", "base_price_gbp_pence": 1000,
+                         "final_price_gbp_pence": 500}, {}], path)
+    table = read_raw_listings(path)
+
+    assert table.schema.equals(RAW_SCHEMA)
+    assert table.to_pylist() == [
+        {"name": "Game A", "base_price_gbp_pence": 1000, "final_price_gbp_pence": 500},
+        {"name": None, "base_price_gbp_pence": None, "final_price_gbp_pence": None}
+    ]
+
+
+def test_raw_listings_no_matches(tmp_path):
+    path = str(tmp_path / "gog_products.arrow")
+
+    write_raw_listings([], path)
+
+    assert read_raw_listings(path).num_rows == 0
+
+
+def test_clean_batch_round_trip_keeps_types(tmp_path):
+    path = str(tmp_path / "clean_data.arrow")
+
+    write_clean_batch(CLEAN_BATCH, path)
+    batch = read_clean_batch(path)
+
+    assert batch["retail_price"].dtype == np.int64
+    assert batch["final_price"].tolist() == [500, 2000]
+    assert batch["game_name"].tolist() == ["Game A", "Game B"]
+    assert batch["listing_date"].tolist() == [date(2025, 1, 1)] * 2
+
+
+def test_read_table_wrong_schema(tmp_path):
+    path = str(tmp_path / "clean_data.arrow")
+    write_clean_batch(CLEAN_BATCH, path)
+
+    with pytest.raises(ValueError):
+        read_table(path, RAW_SCHEMA)
+
+
+def test_write_table_creates_directory(tmp_path):
+    path = str(tmp_path / "data" / "clean_data.arrow")
+
+    write_table(CLEAN_SCHEMA.empty_table(), path)
+
+    assert read_table(path, CLEAN_SCHEMA).num_rows == 0
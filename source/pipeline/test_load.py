@@ -2,7 +2,41 @@
 
 from unittest.mock import MagicMock, patch, mock_open
 from datetime import date
-from load import get_or_create_game, get_or_create_platform, insert_listing, load_data, get_connection
+import numpy as np
+import psycopg2
+import pytest
+from interchange import write_clean_batch
+from load import (get_or_create_game, get_or_create_platform, insert_listing, load_data, get_connection,
+                  get_dimension_ids, insert_games, insert_platforms, load_data_bulk, get_cached_ids,
+                  GAME_ID_CACHE, PLATFORM_ID_CACHE, get_store_ids, save_store_ids, add_to_watchlist,
+                  read_clean_data, select_changes, save_latest_prices, get_latest_prices,
+                  release_connection)
+
+BULK_ROWS = [
+    {"game_name": "Bob", "retail_price": 5000, "platform_name": "steam",
+     "listing_date": "2025-01-01", "discount_percent": 50, "final_price": 2500},
+    {"game_name": "Bob", "retail_price": 5200, "platform_name": "gog",
+     "listing_date": "2025-01-01", "discount_percent": 0, "final_price": 5200},
+    {"game_name": "Alice", "retail_price": 1000, "platform_name": "steam",
+     "listing_date": "2025-01-01", "discount_percent": 0, "final_price": 1000}
+]
+
+
+@pytest.fixture(autouse=True)
+def write_every_listing():
+    """Change detection has its own tests, the rest load every row"""
+    with patch("load.SKIP_UNCHANGED", False):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def empty_id_cache():
+    """Every test starts from a cold id cache"""
+    GAME_ID_CACHE.clear()
+    PLATFORM_ID_CACHE.clear()
+    yield
+    GAME_ID_CACHE.clear()
+    PLATFORM_ID_CACHE.clear()
 
 
 def test_get_create_game_existing_1():
@@ -68,6 +102,18 @@ def test_get_or_create_game_insert_3():
     assert cur.execute.call_count == 2
 
 
+def test_get_or_create_game_race():
+    cur = MagicMock()
+    # another worker inserts the game between the lookup and the insert
+    cur.fetchone.side_effect = [None, None, (78,)]
+
+    result = get_or_create_game(cur, "Expedition 2", 4000)
+
+    assert result == 78
+    assert cur.execute.call_count == 3
+    assert "ON CONFLICT (game_name) DO NOTHING" in cur.execute.call_args_list[1][0][0]
+
+
 def test_get_create_platform_existing_1():
     cur = MagicMock()
     cur.fetchone.return_value = (1,)
@@ -155,10 +201,12 @@ def test_insert_listing_calls_execute_3():
     assert params == (7, 25, 8000, 20, date(2024, 3, 3))
 
 
+@patch("load.DATA_PATH", "/var/task/tmp/data/clean_data.json")
 @patch("load.open", new_callable=mock_open, read_data="[]")
 @patch("load.json.load")
+@patch("load.execute_values")
 @patch("load.get_connection")
-def test_load_data_success(mock_conn_function, mock_json_load, mock_open_file):
+def test_load_data_success(mock_conn_function, mock_execute_values, mock_json_load, mock_open_file):
     mock_json_load.return_value = [{
         "game_name": "Bob",
         "retail_price": 5000,
@@ -182,6 +230,7 @@ def test_load_data_success(mock_conn_function, mock_json_load, mock_open_file):
     assert mock_conn.close.called
 
 
+@patch("load.DATA_PATH", "/var/task/tmp/data/clean_data.json")
 @patch("load.open", new_callable=mock_open, read_data="[]")
 @patch("load.json.load")
 @patch("load.get_connection")
@@ -206,3 +255,474 @@ def test_load_data_error(mock_conn_function, mock_json_load, mock_open_file):
     mock_conn.rollback.assert_called_once()
     mock_cursor.close.assert_called_once()
     mock_conn.close.assert_called_once()
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_in_memory(mock_conn_function, mock_execute_values):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_conn_function.return_value = mock_conn
+
+    mock_cursor.fetchone.side_effect = [(3,), (1,)]
+
+    load_data([{
+        "game_name": "Bob",
+        "retail_price": 5000,
+        "platform_name": "steam",
+        "listing_date": "2025-01-01",
+        "discount_percent": 50,
+        "final_price": 2500
+    }])
+
+    _, params = mock_cursor.execute.call_args[0]
+    assert params == (3, 1, 2500, 50, "2025-01-01")
+    # recorded as the latest price, as the bulk load does
+    assert mock_execute_values.call_args[0][2] == [(3, 1, 2500, 50, "2025-01-01")]
+    assert mock_conn.commit.call_count == 1
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_skips_unchanged(mock_conn_function, mock_execute_values):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchone.side_effect = [(3,), (1,), (2,)]
+    mock_cursor.fetchall.return_value = [(3, 1, 2500, 50, date(2025, 1, 1))]
+
+    with patch("load.SKIP_UNCHANGED", True):
+        load_data([
+            {"game_name": "Bob", "retail_price": 5000, "platform_name": "steam",
+             "listing_date": "2025-01-02", "discount_percent": 50, "final_price": 2500},
+            {"game_name": "Bob", "retail_price": 5000, "platform_name": "gog",
+             "listing_date": "2025-01-02", "discount_percent": 0, "final_price": 5000}])
+
+    inserted = [call[0][1] for call in mock_cursor.execute.call_args_list
+                if "INSERT INTO wishbone.listing" in call[0][0]]
+    assert inserted == [(3, 2, 5000, 0, "2025-01-02")]
+    assert mock_execute_values.call_args[0][2] == [(3, 2, 5000, 0, "2025-01-02")]
+
+
+def test_get_dimension_ids_single_query():
+    cur = MagicMock()
+    cur.fetchall.return_value = [
+        ("game", "Bob", 3), ("platform", "steam", 1), ("platform", "gog", 2)]
+
+    game_ids, platform_ids = get_dimension_ids(
+        cur, ["Bob", "Alice"], ["steam", "gog"])
+
+    cur.execute.assert_called_once()
+    assert game_ids == {"Bob": 3}
+    assert platform_ids == {"steam": 1, "gog": 2}
+
+
+@patch("load.execute_values")
+def test_insert_games_returns_ids(mock_execute_values):
+    mock_execute_values.return_value = [("Alice", 8)]
+
+    result = insert_games(MagicMock(), {"Alice": 1000})
+
+    assert result == {"Alice": 8}
+    assert mock_execute_values.call_args[0][2] == [("Alice", 1000)]
+    assert mock_execute_values.call_args[1]["fetch"] is True
+
+
+@patch("load.execute_values")
+def test_insert_games_race(mock_execute_values):
+    cur = MagicMock()
+    # Alice was inserted by another worker, so only Bob comes back
+    mock_execute_values.return_value = [("Bob", 9)]
+    cur.fetchall.return_value = [("game", "Alice", 8)]
+
+    result = insert_games(cur, {"Alice": 1000, "Bob": 500})
+
+    assert result == {"Alice": 8, "Bob": 9}
+    cur.execute.assert_called_once()
+
+
+def test_get_create_platform_race():
+    cur = MagicMock()
+    cur.fetchone.side_effect = [None, None, (4,)]
+
+    result = get_or_create_platform(cur, "epic")
+
+    assert result == 4
+    assert cur.execute.call_count == 3
+
+
+@patch("load.execute_values")
+def test_insert_games_and_platforms_in_name_order(mock_execute_values):
+    mock_execute_values.return_value = []
+    cur = MagicMock()
+    cur.fetchall.return_value = []
+
+    insert_games(cur, {"Zed": 100, "Alice": 1000})
+    assert mock_execute_values.call_args[0][2] == [("Alice", 1000), ("Zed", 100)]
+    insert_platforms(cur, ["steam", "gog"])
+    assert mock_execute_values.call_args[0][2] == [("gog",), ("steam",)]
+
+
+@patch("load.execute_values")
+def test_insert_nothing_missing(mock_execute_values):
+    assert insert_games(MagicMock(), {}) == {}
+    assert insert_platforms(MagicMock(), []) == {}
+    mock_execute_values.assert_not_called()
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_success(mock_conn_function, mock_execute_values):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_conn_function.return_value = mock_conn
+
+    mock_cursor.fetchall.return_value = [
+        ("game", "Bob", 3), ("platform", "steam", 1), ("platform", "gog", 2)]
+    mock_execute_values.side_effect = [[("Alice", 8)], None, None]
+
+    load_data_bulk(BULK_ROWS)
+
+    # one lookup query, then one upsert for Alice, one listing insert
+    # and one upsert of the latest prices
+    mock_cursor.execute.assert_called_once()
+    assert mock_execute_values.call_count == 3
+    assert mock_execute_values.call_args_list[0][0][2] == [("Alice", 1000)]
+    assert mock_execute_values.call_args_list[1][0][2] == [
+        (3, 1, 2500, 50, "2025-01-01"),
+        (3, 2, 5200, 0, "2025-01-01"),
+        (8, 1, 1000, 0, "2025-01-01")
+    ]
+    mock_conn.commit.assert_called_once()
+    mock_conn.close.assert_called_once()
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_error(mock_conn_function, mock_execute_values):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_conn_function.return_value = mock_conn
+
+    mock_cursor.execute.side_effect = Exception("DB error")
+
+    with pytest.raises(Exception):
+        load_data_bulk(BULK_ROWS)
+
+    mock_conn.rollback.assert_called_once()
+    mock_conn.commit.assert_not_called()
+    mock_conn.close.assert_called_once()
+
+
+@patch("load.get_connection")
+def test_load_data_bulk_no_rows(mock_conn_function):
+    load_data_bulk([])
+
+    mock_conn_function.assert_not_called()
+
+
+def test_get_cached_ids_warm_cache_skips_query():
+    cur = MagicMock()
+    GAME_ID_CACHE.update({"Bob": 3})
+    PLATFORM_ID_CACHE.update({"steam": 1})
+
+    result = get_cached_ids(cur, ["Bob"], ["steam"])
+
+    assert result == ({"Bob": 3}, {"steam": 1})
+    cur.execute.assert_not_called()
+
+
+def test_get_cached_ids_only_queries_missing():
+    cur = MagicMock()
+    PLATFORM_ID_CACHE.update({"steam": 1})
+    cur.fetchall.return_value = [("game", "Bob", 3)]
+
+    result = get_cached_ids(cur, ["Bob", "Alice"], ["steam"])
+
+    assert result == ({"Bob": 3}, {"steam": 1})
+    assert cur.execute.call_args[0][1] == (["Bob", "Alice"], [])
+    assert GAME_ID_CACHE == {"Bob": 3}
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_caches_after_commit(mock_conn_function, mock_execute_values):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_conn_function.return_value = mock_conn
+
+    mock_cursor.fetchall.return_value = [
+        ("game", "Bob", 3), ("platform", "steam", 1), ("platform", "gog", 2)]
+    mock_execute_values.side_effect = [[("Alice", 8)], None, None]
+
+    load_data_bulk(BULK_ROWS)
+
+    assert GAME_ID_CACHE == {"Bob": 3, "Alice": 8}
+    assert PLATFORM_ID_CACHE == {"steam": 1, "gog": 2}
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_rollback_does_not_cache_new_ids(mock_conn_function, mock_execute_values):
+    mock_conn = MagicMock()
+    mock_cursor = MagicMock()
+    mock_conn.cursor.return_value = mock_cursor
+    mock_conn_function.return_value = mock_conn
+
+    mock_cursor.fetchall.return_value = [
+        ("platform", "steam", 1), ("platform", "gog", 2)]
+    mock_execute_values.side_effect = [
+        [("Alice", 8), ("Bob", 9)], Exception("DB error")]
+
+    with pytest.raises(Exception):
+        load_data_bulk(BULK_ROWS)
+
+    mock_conn.rollback.assert_called_once()
+    assert GAME_ID_CACHE == {}
+
+
+@patch("load.get_connection")
+def test_get_store_ids_grouped_by_platform(mock_conn_function):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [
+        ("steam", "Bob", 10, "Bob"), ("gog", "Bob", 77, "Bob GOTY")]
+
+    result = get_store_ids(["Bob"])
+
+    assert result == {"steam": {"Bob": (10, "Bob")},
+                      "gog": {"Bob": (77, "Bob GOTY")}}
+    mock_conn_function.return_value.close.assert_called_once()
+
+
+@patch("load.get_connection")
+def test_get_store_ids_db_error(mock_conn_function):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.execute.side_effect = psycopg2.Error("no table")
+
+    assert get_store_ids(["Bob"]) == {}
+
+
+@patch("load.execute_values")
+def test_save_store_ids_rows(mock_execute_values):
+    save_store_ids(MagicMock(), {"steam": {"Bob": (10, "Bob")},
+                                 "gog": {"Bob": (77, "Bob GOTY")}})
+
+    assert mock_execute_values.call_args[0][2] == [
+        ("Bob", "steam", 10, "Bob"), ("Bob", "gog", 77, "Bob GOTY")]
+
+
+@patch("load.execute_values")
+def test_save_store_ids_nothing_resolved(mock_execute_values):
+    save_store_ids(MagicMock(), {"steam": {}})
+
+    mock_execute_values.assert_not_called()
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_saves_store_ids(mock_conn_function, mock_execute_values):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [
+        ("game", "Bob", 3), ("game", "Alice", 8), ("platform", "steam", 1), ("platform", "gog", 2)]
+
+    load_data_bulk(BULK_ROWS, {"steam": {"Bob": (10, "Bob")}})
+
+    # listings, latest prices then store ids, in the same transaction
+    assert mock_execute_values.call_count == 3
+    assert mock_execute_values.call_args[0][2] == [("Bob", "steam", 10, "Bob")]
+    mock_conn_function.return_value.commit.assert_called_once()
+
+
+def test_add_to_watchlist_one_statement():
+    cur = MagicMock()
+
+    add_to_watchlist(cur, [3, 8])
+
+    cur.execute.assert_called_once()
+    assert cur.execute.call_args[0][1] == ([3, 8],)
+
+
+def test_add_to_watchlist_nothing_to_add():
+    cur = MagicMock()
+
+    add_to_watchlist(cur, [])
+
+    cur.execute.assert_not_called()
+
+
+@patch("load.add_to_watchlist")
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_watch(mock_conn_function, mock_execute_values, mock_watch):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [
+        ("game", "Bob", 3), ("game", "Alice", 8), ("platform", "steam", 1), ("platform", "gog", 2)]
+
+    load_data_bulk(BULK_ROWS, watch=True)
+
+    assert sorted(mock_watch.call_args[0][1]) == [3, 8]
+    mock_conn_function.return_value.commit.assert_called_once()
+
+
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_columnar_batch(mock_conn_function, mock_execute_values):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [
+        ("game", "Bob", 3), ("game", "Alice", 8), ("platform", "steam", 1), ("platform", "gog", 2)]
+    batch = {
+        "game_name": np.array(["Bob", "Alice"], dtype=object),
+        "retail_price": np.array([5000, 1000]),
+        "platform_name": np.array(["steam", "gog"], dtype=object),
+        "listing_date": np.array(["2025-01-01", "2025-01-01"], dtype="datetime64[D]"),
+        "discount_percent": np.array([50, 0]),
+        "final_price": np.array([2500, 1000])
+    }
+
+    load_data_bulk(batch)
+
+    listings = mock_execute_values.call_args_list[0][0][2]
+    assert listings == [(3, 1, 2500, 50, date(2025, 1, 1)),
+                        (8, 2, 1000, 0, date(2025, 1, 1))]
+    # numpy values would not adapt in psycopg2
+    assert type(listings[0][2]) is int
+
+
+def test_read_clean_data_arrow(tmp_path):
+    path = str(tmp_path / "clean_data.arrow")
+    write_clean_batch({
+        "game_name": np.array(["Bob"], dtype=object),
+        "retail_price": np.array([5000]),
+        "platform_name": np.array(["steam"], dtype=object),
+        "listing_date": np.array(["2025-01-01"], dtype="datetime64[D]"),
+        "discount_percent": np.array([50]),
+        "final_price": np.array([2500])
+    }, path)
+
+    with patch("load.DATA_PATH", path):
+        batch = read_clean_data()
+
+    assert batch["final_price"].tolist() == [2500]
+    assert batch["listing_date"].tolist() == [date(2025, 1, 1)]
+
+
+def test_get_latest_prices_single_query():
+    cur = MagicMock()
+    cur.fetchall.return_value = [(3, 1, 2500, 50, date(2025, 1, 1))]
+
+    latest = get_latest_prices(cur, [3, 8], [1])
+
+    cur.execute.assert_called_once()
+    assert latest == {(3, 1): (2500, 50, date(2025, 1, 1))}
+
+
+def test_select_changes_skips_unchanged():
+    latest = {(3, 1): (2500, 50, date(2025, 1, 1)), (8, 1): (1000, 0, date(2025, 1, 1))}
+    listings = [(3, 1, 2500, 50, "2025-01-02"),
+                (8, 1, 900, 10, "2025-01-02"),
+                (9, 2, 100, 0, "2025-01-02")]
+
+    changed = select_changes(listings, latest)
+
+    # a new price and a pair never seen before
+    assert changed == listings[1:]
+    assert latest[(8, 1)] == (900, 10, date(2025, 1, 2))
+
+
+def test_select_changes_discount_only_change():
+    latest = {(3, 1): (2500, 50, date(2025, 1, 1))}
+
+    assert select_changes([(3, 1, 2500, 40, date(2025, 1, 2))], latest) == [
+        (3, 1, 2500, 40, date(2025, 1, 2))]
+
+
+def test_select_changes_heartbeat():
+    latest = {(3, 1): (2500, 50, date(2025, 1, 1)), (8, 1): (1000, 0, date(2025, 1, 6))}
+    listings = [(3, 1, 2500, 50, "2025-01-08"), (8, 1, 1000, 0, "2025-01-08")]
+
+    changed = select_changes(listings, latest, heartbeat_days=7)
+
+    assert changed == [(3, 1, 2500, 50, "2025-01-08")]
+
+
+def test_select_changes_repeat_within_batch():
+    listings = [(3, 1, 2500, 50, "2025-01-01"), (3, 1, 2500, 50, "2025-01-01")]
+
+    assert select_changes(listings, {}) == listings[:1]
+
+
+@patch("load.execute_values")
+def test_save_latest_prices_one_row_per_pair(mock_execute_values):
+    save_latest_prices(MagicMock(), [(3, 1, 2500, 50, "2025-01-01"),
+                                     (3, 1, 2400, 52, "2025-01-01")])
+
+    assert mock_execute_values.call_args[0][2] == [(3, 1, 2400, 52, "2025-01-01")]
+
+
+@patch("load.execute_values")
+def test_save_latest_prices_in_key_order(mock_execute_values):
+    save_latest_prices(MagicMock(), [(8, 1, 100, 0, "2025-01-01"),
+                                     (3, 2, 200, 0, "2025-01-01"),
+                                     (3, 1, 300, 0, "2025-01-01")])
+
+    assert [row[:2] for row in mock_execute_values.call_args[0][2]] == [(3, 1), (3, 2), (8, 1)]
+
+
+@patch("load.execute_values")
+def test_save_latest_prices_nothing_written(mock_execute_values):
+    save_latest_prices(MagicMock(), [])
+
+    mock_execute_values.assert_not_called()
+
+
+@patch("load.get_latest_prices", return_value={(3, 1): (2500, 50, date(2025, 1, 1))})
+@patch("load.execute_values")
+@patch("load.get_connection")
+def test_load_data_bulk_writes_only_changes(mock_conn_function, mock_execute_values, mock_latest):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.return_value = [
+        ("game", "Bob", 3), ("game", "Alice", 8), ("platform", "steam", 1), ("platform", "gog", 2)]
+
+    with patch("load.SKIP_UNCHANGED", True):
+        written = load_data_bulk(BULK_ROWS)
+
+    assert written == 2
+    assert mock_execute_values.call_args_list[0][0][2] == [
+        (3, 2, 5200, 0, "2025-01-01"),
+        (8, 1, 1000, 0, "2025-01-01")
+    ]
+
+
+@patch("load.IDLE_CONNECTIONS", new_callable=list)
+@patch("load.psycopg2.connect")
+def test_get_connection_reuses_live_connection(mock_connect, idle):
+    conn = MagicMock(closed=0)
+    release_connection(conn)
+
+    assert get_connection() is conn
+    conn.cursor.return_value.__enter__.return_value.execute.assert_called_once_with('SELECT 1')
+    mock_connect.assert_not_called()
+
+
+@patch.dict("load.environ", {"RDS_HOST": "db", "PORT": "5432", "RDS_USERNAME": "user",
+                             "RDS_PASSWORD": "password", "DB_NAME": "wishbone"})
+@patch("load.IDLE_CONNECTIONS", new_callable=list)
+@patch("load.psycopg2.connect")
+def test_get_connection_replaces_dropped_connection(mock_connect, idle):
+    dropped = MagicMock(closed=0)
+    dropped.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError(
+        'server closed the connection unexpectedly')
+    idle.append(dropped)
+
+    assert get_connection() is mock_connect.return_value
+    dropped.close.assert_called_once()
+    assert not idle
@@ -0,0 +1,95 @@
+"""Tests for the metrics recorder"""
+
+import json
+import os
+from unittest.mock import patch
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics():
+    metrics.METRICS.clear()
+    yield
+    metrics.METRICS.clear()
+
+
+def emitted(capsys) -> list[dict]:
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_summary_sums_over_dimensions():
+    metrics.count('CacheHit', Host='a')
+    metrics.count('CacheHit', 2, Host='b')
+    metrics.record('HttpLatency', 30, 'Milliseconds', Host='a')
+    metrics.record('HttpLatency', 10, 'Milliseconds', Host='a')
+
+    summary = metrics.summary()
+
+    assert summary['CacheHit'] == {'unit': 'Count', 'count': 2, 'sum': 3, 'min': 1, 'max': 2}
+    assert summary['HttpLatency']['min'] == 10
+    assert summary['HttpLatency']['max'] == 30
+
+
+def test_timer_records_when_block_raises():
+    with pytest.raises(ValueError):
+        with metrics.timer('StageTime', Stage='load'):
+            raise ValueError('failed')
+
+    recorded = metrics.METRICS[(('Stage', 'load'),)]['StageTime']
+    assert recorded['unit'] == 'Milliseconds'
+    assert len(recorded['values']) == 1
+
+
+def test_flush_none_backend_prints_nothing(capsys):
+    metrics.count('RowsWritten', 5)
+
+    with patch('metrics.BACKEND', 'none'):
+        summary = metrics.flush(Function='test')
+
+    assert summary['RowsWritten']['sum'] == 5
+    assert capsys.readouterr().out == ''
+    assert not metrics.METRICS
+
+
+def test_flush_json_backend(capsys):
+    metrics.count('CacheMiss', Host='store.steampowered.com')
+
+    with patch('metrics.BACKEND', 'json'):
+        metrics.flush(Function='test')
+
+    [line] = emitted(capsys)
+    assert line['Function'] == 'test'
+    assert line['Host'] == 'store.steampowered.com'
+    assert line['metrics']['CacheMiss']['sum'] == 1
+
+
+def test_flush_emf_backend_splits_long_metrics(capsys):
+    for value in range(150):
+        metrics.record('TitleTime', value, 'Milliseconds', Store='gog')
+    metrics.count('TitlesFound', 150, Store='gog')
+
+    with patch('metrics.BACKEND', 'emf'):
+        metrics.flush(Function='test')
+
+    first, second = emitted(capsys)
+    directive = first['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == metrics.NAMESPACE
+    assert directive['Dimensions'] == [['Store']]
+    assert {metric['Name'] for metric in directive['Metrics']} == {'TitleTime', 'TitlesFound'}
+    assert len(first['TitleTime']) == 100 and first['TitlesFound'] == [150]
+    assert len(second['TitleTime']) == 50 and 'TitlesFound' not in second
+    assert second['Store'] == 'gog' and second['Function'] == 'test'
+
+
+def test_lambda_images_copy_this_file():
+    """The other Lambda images copy this file in at build time instead of keeping their own"""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    for folder in ('s3-pipeline', 'mailing'):
+        assert not os.path.exists(os.path.join(here, '..', folder, 'metrics.py'))
+        with open(os.path.join(here, '..', folder, 'Dockerfile'), encoding='utf-8') as f:
+            assert 'COPY --from=pipeline metrics.py' in f.read()
+        with open(os.path.join(here, '..', folder, 'build.sh'), encoding='utf-8') as f:
+            assert '--build-context pipeline=../pipeline' in f.read()
@@ -0,0 +1,126 @@
+"""Tests for the per host rate limiter and retry scheduler"""
+
+from unittest.mock import patch
+import aiohttp
+import pytest
+
+from rate_limiter import HostLimiter, backoff_delay, retry_after_seconds, request, get_limiter, LIMITERS, MIN_RATE
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiters():
+    """Every test starts with new limiters and no backoff"""
+    LIMITERS.clear()
+    with patch("rate_limiter.BASE_BACKOFF", 0):
+        yield
+    LIMITERS.clear()
+
+
+def test_reserve_allows_burst_then_waits():
+    limiter = HostLimiter(rate=10, burst=2)
+
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_on_throttle_halves_rate():
+    limiter = HostLimiter(rate=8)
+
+    limiter.on_throttle()
+
+    assert limiter.rate == 4
+
+
+def test_on_throttle_has_floor():
+    limiter = HostLimiter(rate=MIN_RATE)
+
+    limiter.on_throttle()
+
+    assert limiter.rate == MIN_RATE
+
+
+def test_on_throttle_retry_after_pauses_host():
+    limiter = HostLimiter(rate=100, burst=10)
+
+    limiter.on_throttle(retry_after=5)
+
+    assert limiter.reserve() == pytest.approx(5, abs=0.1)
+
+
+def test_on_success_raises_rate():
+    limiter = HostLimiter(rate=8)
+
+    limiter.on_success()
+
+    assert limiter.rate > 8
+
+
+def test_get_limiter_one_per_host():
+    assert get_limiter("a.com") is get_limiter("a.com")
+    assert get_limiter("a.com") is not get_limiter("b.com")
+
+
+def test_backoff_delay_capped():
+    with patch("rate_limiter.BASE_BACKOFF", 1):
+        assert all(0 <= backoff_delay(20) <= 30 for _ in range(50))
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({'Retry-After': '3'}) == 3
+    assert retry_after_seconds(
+        {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}) is None
+    assert retry_after_seconds({}) is None
+
+
+@pytest.mark.asyncio
+async def test_request_retries_throttled_response(fake_session, fake_response):
+    session = fake_session(fake_response(429), fake_response(503),
+                           fake_response(200, 'page'))
+
+    status, _, body = await request(session, 'https://store.steampowered.com/search')
+
+    assert (status, body) == (200, 'page')
+    assert session.calls == 3
+    # halved twice, then one success
+    assert get_limiter('store.steampowered.com').rate < 8 / 4 + 1
+
+
+@pytest.mark.asyncio
+async def test_request_gives_up_after_max_retries(fake_session, fake_response):
+    session = fake_session(*[fake_response(429) for _ in range(3)])
+
+    with patch("rate_limiter.MAX_RETRIES", 2):
+        status, _, _ = await request(session, 'https://catalog.gog.com/v1/catalog')
+
+    assert status == 429
+    assert session.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_request_does_not_retry_client_errors(fake_session, fake_response):
+    session = fake_session(fake_response(404))
+
+    status, _, _ = await request(session, 'https://catalog.gog.com/v1/catalog')
+
+    assert status == 404
+    assert session.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_request_retries_dropped_connection(fake_session, fake_response):
+    session = fake_session(aiohttp.ClientConnectionError(),
+                           fake_response(200, 'ok'))
+
+    status, _, _ = await request(session, 'https://catalog.gog.com/v1/catalog')
+
+    assert status == 200
+
+
+@pytest.mark.asyncio
+async def test_request_raises_when_connection_keeps_failing(fake_session):
+    session = fake_session(*[aiohttp.ClientConnectionError() for _ in range(2)])
+
+    with patch("rate_limiter.MAX_RETRIES", 1):
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await request(session, 'https://catalog.gog.com/v1/catalog')
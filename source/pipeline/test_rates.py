@@ -0,0 +1,62 @@
+"""Tests for the exchange rate provider"""
+
+import json
+from unittest.mock import MagicMock, patch
+import pytest
+
+import rates
+from rates import get_usd_to_gbp_rate, set_rate_provider, read_last_good_rate, DEFAULT_RATE
+
+
+@pytest.fixture(autouse=True)
+def rate_file(tmp_path):
+    """Every test gets its own rate file and a fresh cache"""
+    path = tmp_path / "rate.json"
+    with patch("rates.RATE_CACHE_PATH", str(path)):
+        yield path
+    set_rate_provider(rates.fetch_live_rate)
+
+
+def test_rate_fetched_once_within_ttl():
+    provider = MagicMock(return_value=0.8)
+    set_rate_provider(provider)
+
+    assert get_usd_to_gbp_rate() == 0.8
+    assert get_usd_to_gbp_rate() == 0.8
+
+    provider.assert_called_once()
+
+
+def test_rate_refetched_after_ttl():
+    provider = MagicMock(side_effect=[0.8, 0.9])
+    set_rate_provider(provider)
+
+    assert get_usd_to_gbp_rate(ttl=0) == 0.8
+    assert get_usd_to_gbp_rate(ttl=0) == 0.9
+
+
+def test_good_rate_saved_to_file(rate_file):
+    set_rate_provider(lambda: 0.81)
+
+    get_usd_to_gbp_rate()
+
+    assert json.loads(rate_file.read_text())["rate"] == 0.81
+
+
+def test_failure_falls_back_to_saved_rate(rate_file):
+    rate_file.write_text(json.dumps({"rate": 0.79}))
+    set_rate_provider(MagicMock(side_effect=Exception("API down")))
+
+    assert get_usd_to_gbp_rate() == 0.79
+
+
+def test_failure_without_saved_rate_uses_default():
+    set_rate_provider(MagicMock(side_effect=Exception("API down")))
+
+    assert get_usd_to_gbp_rate() == DEFAULT_RATE
+
+
+def test_read_last_good_rate_corrupt_file(rate_file):
+    rate_file.write_text("not json")
+
+    assert read_last_good_rate() == DEFAULT_RATE
@@ -0,0 +1,103 @@
+"""Tests for the streaming pipeline"""
+
+import asyncio
+from unittest.mock import patch
+import numpy as np
+import pytest
+
+from streaming import merge_batches, stream_pipeline, load_stage, DONE
+
+
+def fake_scraper(found: list[tuple[str, list[dict]]], resolved: dict | None = None):
+    """scrape_stores stand-in, emitting each (platform, listings) pair in turn"""
+    async def scrape_stores(game_inputs, convert_rate, store_ids=None, on_priced=None):
+        for platform_name, listings in found:
+            await asyncio.sleep(0)
+            await on_priced(platform_name, listings)
+        store_ids.update(resolved or {})
+    return scrape_stores
+
+
+def listing(name: str, base: int = 1000, final: int = 500) -> dict:
+    return {'name': name, 'base_price_gbp_pence': base, 'final_price_gbp_pence': final}
+
+
+def test_merge_batches():
+    batch = merge_batches([{'final_price': np.array([1, 2])},
+                           {'final_price': np.array([3])}])
+
+    assert batch['final_price'].tolist() == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_stream_pipeline_writes_in_batches():
+    found = [('steam', [listing('A')]), ('gog', [listing('A', 1200, 1200)]),
+             ('steam', [listing('B'), listing('C')])]
+    written = []
+
+    with patch("streaming.scrape_stores", fake_scraper(found)), \
+            patch("streaming.load_data_bulk",
+                  side_effect=lambda batch, ids, watch: written.append(batch) or len(batch['game_name'])), \
+            patch("streaming.WRITE_BATCH_SIZE", 2):
+        rows = await stream_pipeline(['A', 'B', 'C'], 1.0)
+
+    assert rows == 4
+    assert [len(batch['game_name']) for batch in written] == [2, 2]
+    assert written[0]['platform_name'].tolist() == ['steam', 'gog']
+    assert written[1]['discount_percent'].tolist() == [50, 50]
+
+
+@pytest.mark.asyncio
+async def test_stream_pipeline_nothing_found():
+    with patch("streaming.scrape_stores", fake_scraper([])), \
+            patch("streaming.load_data_bulk") as mock_load:
+        rows = await stream_pipeline(['A'], 1.0)
+
+    assert rows == 0
+    mock_load.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_stream_pipeline_passes_resolved_store_ids():
+    store_ids = {}
+    saved = []
+
+    with patch("streaming.scrape_stores",
+               fake_scraper([('steam', [listing('A')])], {'steam': {'A': (1, 'A')}})), \
+            patch("streaming.load_data_bulk",
+                  side_effect=lambda batch, ids, watch: saved.append(ids) or 1):
+        await stream_pipeline(['A'], 1.0, store_ids)
+
+    assert saved == [{'steam': {'A': (1, 'A')}}]
+
+
+@pytest.mark.asyncio
+async def test_stream_pipeline_load_error_stops_scraping():
+    found = [('steam', [listing(str(i))]) for i in range(500)]
+
+    with patch("streaming.scrape_stores", fake_scraper(found)), \
+            patch("streaming.load_data_bulk", side_effect=RuntimeError('DB down')), \
+            patch("streaming.WRITE_BATCH_SIZE", 1), \
+            patch("streaming.QUEUE_SIZE", 1):
+        with pytest.raises(RuntimeError, match='DB down'):
+            await stream_pipeline(['A'], 1.0)
+
+
+@pytest.mark.asyncio
+async def test_load_stage_flushes_part_batch_when_idle():
+    queue = asyncio.Queue()
+    written = []
+    await queue.put({'game_name': np.array(['A'], dtype=object)})
+
+    async def finish_later():
+        await asyncio.sleep(0.05)
+        # the part batch was written before the stream ended
+        assert len(written) == 1
+        await queue.put(DONE)
+
+    with patch("streaming.load_data_bulk",
+               side_effect=lambda batch, ids, watch: written.append(batch) or len(batch['game_name'])), \
+            patch("streaming.WRITE_INTERVAL", 0.01):
+        rows, _ = await asyncio.gather(load_stage(queue, {}), finish_later())
+
+    assert rows == 1
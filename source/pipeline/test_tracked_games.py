@@ -0,0 +1,75 @@
+"""Tests for reading the tracked games"""
+
+from unittest.mock import MagicMock, patch
+import psycopg2
+import pytest
+
+from tracked_games import WATCHLIST_DAYS, fetch_tracked_games, get_tracked_games, read_tracked_cache, save_tracked_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_path(tmp_path):
+    with patch("tracked_games.TRACKED_CACHE_PATH", str(tmp_path / "tracked.json")):
+        yield
+
+
+@patch("tracked_games.get_connection")
+def test_fetch_tracked_games_pages_by_id(mock_conn_function):
+    mock_cursor = MagicMock()
+    mock_conn_function.return_value.cursor.return_value = mock_cursor
+    mock_cursor.fetchall.side_effect = [
+        [(1, 'Hades'), (4, 'Celeste')], [(9, 'Balatro')]]
+
+    result = fetch_tracked_games(page_size=2)
+
+    assert result == ['Hades', 'Celeste', 'Balatro']
+    # the second page starts after the last id of the first
+    assert [call[0][1] for call in mock_cursor.execute.call_args_list] == [
+        (0, WATCHLIST_DAYS, 2), (4, WATCHLIST_DAYS, 2)]
+    mock_conn_function.return_value.close.assert_called_once()
+
+
+@patch("tracked_games.get_connection")
+def test_fetch_tracked_games_none(mock_conn_function):
+    mock_conn_function.return_value.cursor.return_value.fetchall.return_value = []
+
+    assert fetch_tracked_games() == []
+
+
+def test_save_and_read_cache():
+    save_tracked_cache(['Hades'])
+
+    assert read_tracked_cache()['games'] == ['Hades']
+
+
+def test_read_cache_missing():
+    assert read_tracked_cache() == {}
+
+
+@patch("tracked_games.fetch_tracked_games", return_value=['Hades'])
+def test_get_tracked_games_fresh_cache_skips_query(mock_fetch):
+    save_tracked_cache(['Celeste'])
+
+    assert get_tracked_games() == ['Celeste']
+    mock_fetch.assert_not_called()
+
+
+@patch("tracked_games.fetch_tracked_games", return_value=['Hades'])
+def test_get_tracked_games_stale_cache_refreshed(mock_fetch):
+    save_tracked_cache(['Celeste'])
+
+    assert get_tracked_games(ttl=0) == ['Hades']
+    assert read_tracked_cache()['games'] == ['Hades']
+
+
+@patch("tracked_games.fetch_tracked_games", side_effect=psycopg2.OperationalError('down'))
+def test_get_tracked_games_db_down_uses_saved_list(mock_fetch):
+    save_tracked_cache(['Celeste'])
+
+    assert get_tracked_games(ttl=0) == ['Celeste']
+
+
+@patch("tracked_games.fetch_tracked_games", side_effect=psycopg2.OperationalError('down'))
+def test_get_tracked_games_db_down_no_saved_list(mock_fetch):
+    with pytest.raises(psycopg2.OperationalError):
+        get_tracked_games()
@@ -3,8 +3,10 @@ from pathlib import Path
 from datetime import date
 from unittest.mock import patch, mock_open
 import pytest
+import numpy as np
 import pandas as pd
 
+from interchange import write_raw_listings
 from transform import (
     read_data,
     calculate_discount,
@@ -12,6 +14,10 @@ from transform import (
     get_relevant_columns,
     reorder_columns,
     transform_source,
+    transform_records,
+    transform_all,
+    transform_batch,
+    batch_rows,
 )
 
 
@@ -168,3 +174,103 @@ def test_transform_source_with_tmpfile(tmp_path):
     assert len(df) == 2
     assert "game_name" in df.columns
     assert df.iloc[0]["platform_name"] == "gog"
+
+
+def test_transform_records_skips_unmatched_games():
+    df = transform_records([
+        {"name": "Game A", "base_price_gbp_pence": 1000,
+            "final_price_gbp_pence": 750},
+        {}
+    ], "steam")
+
+    assert len(df) == 1
+    assert df.iloc[0]["platform_name"] == "steam"
+    assert df.iloc[0]["discount_percent"] == 25
+
+
+def test_transform_records_no_matches():
+    df = transform_records([{}, {}], "gog")
+
+    assert df.empty
+    assert "game_name" in df.columns
+
+
+def test_transform_all_in_memory():
+    rows = transform_all({
+        "steam": [{"name": "Game A", "base_price_gbp_pence": 1000, "final_price_gbp_pence": 500}],
+        "gog": [{"name": "Game A", "base_price_gbp_pence": 1200, "final_price_gbp_pence": 1200}, {}]
+    })
+
+    assert [(row["platform_name"], row["final_price"], row["discount_percent"]) for row in rows] == [
+        ("steam", 500, 50),
+        ("gog", 1200, 0)
+    ]
+    assert type(rows[0]["final_price"]) is int
+
+
+def test_transform_batch_columns():
+    batch = transform_batch({
+        "steam": [{"name": "Game A", "base_price_gbp_pence": 1000, "final_price_gbp_pence": 750}, {}],
+        "gog": [{"name": "Game B", "base_price_gbp_pence": 0, "final_price_gbp_pence": 0}]
+    })
+
+    assert batch["game_name"].tolist() == ["Game A", "Game B"]
+    assert batch["platform_name"].tolist() == ["steam", "gog"]
+    assert batch["discount_percent"].tolist() == [25, 0]
+    assert batch["retail_price"].dtype == np.int64
+    assert batch["listing_date"].dtype == np.dtype("datetime64[D]")
+
+
+def test_transform_batch_rounds_half_to_even():
+    batch = transform_batch({"steam": [
+        {"name": "A", "base_price_gbp_pence": 200, "final_price_gbp_pence": 175},
+        {"name": "B", "base_price_gbp_pence": 200, "final_price_gbp_pence": 173}
+    ]})
+
+    # 12.5 and 13.5 per cent
+    assert batch["discount_percent"].tolist() == [12, 14]
+
+
+def test_transform_batch_drops_missing_prices():
+    batch = transform_batch({"gog": [
+        {"name": "A", "base_price_gbp_pence": None, "final_price_gbp_pence": 300},
+        {"name": "B", "base_price_gbp_pence": 300, "final_price_gbp_pence": None}
+    ]})
+
+    assert len(batch["game_name"]) == 0
+
+
+def test_transform_batch_fractional_price():
+    with pytest.raises(ValueError):
+        transform_batch({"gog": [
+            {"name": "A", "base_price_gbp_pence": 10.5, "final_price_gbp_pence": 10}]})
+
+
+def test_transform_batch_matches_dataframe_path():
+    listings = [{"name": f"Game {i}", "base_price_gbp_pence": 999 + i,
+                 "final_price_gbp_pence": 500 + i} for i in range(20)]
+
+    expected = transform_records(listings, "steam").astype(object).to_dict(orient="records")
+
+    assert batch_rows(transform_batch({"steam": listings})) == expected
+
+
+def test_transform_all_reads_arrow_sources(tmp_path):
+    listings = {
+        "gog": [{"name": "Game A", "base_price_gbp_pence": 1200, "final_price_gbp_pence": 600}, {}],
+        "steam": [{"name": "Game A", "base_price_gbp_pence": 1000, "final_price_gbp_pence": 1000}]
+    }
+    for platform_name, platform_listings in listings.items():
+        write_raw_listings(platform_listings, str(
+            tmp_path / f"{platform_name}_products.arrow"))
+
+    with patch("transform.DIRECTORY", str(tmp_path) + "/"):
+        rows = transform_all()
+
+    assert rows == transform_all(listings)
+    assert [row["discount_percent"] for row in rows] == [50, 0]
+
+
+def test_transform_all_missing_sources(tmp_path):
+    with patch("transform.DIRECTORY", str(tmp_path) + "/"):
+        assert transform_all() == []
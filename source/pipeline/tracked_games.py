@@ -0,0 +1,90 @@
+"""Script which reads the games the ETL should price from RDS, a page at a time, keeping a local copy"""
+import json
+import os
+import time
+
+import psycopg2
+
+from load import get_connection, release_connection
+
+
+TRACKED_CACHE_PATH = os.environ.get('TRACKED_CACHE_PATH', '/tmp/tracked_games.json')
+TRACKED_CACHE_TTL = int(os.environ.get('TRACKED_CACHE_TTL', 15 * 60))  # seconds
+TRACKED_PAGE_SIZE = int(os.environ.get('TRACKED_PAGE_SIZE', 1000))
+# days a searched game stays priced after it was last searched
+WATCHLIST_DAYS = int(os.environ.get('WATCHLIST_DAYS', 30))
+
+# games someone tracks or that were searched in the last WATCHLIST_DAYS, in game_id
+# order so the next page starts after the last id seen instead of scanning past an offset
+TRACKED_QUERY = """
+    SELECT g.game_id, g.game_name
+    FROM wishbone.game g
+    WHERE g.game_id > %s
+        AND (EXISTS (SELECT 1 FROM wishbone.tracking t WHERE t.game_id = g.game_id)
+            OR EXISTS (SELECT 1 FROM wishbone.watchlist w
+                WHERE w.game_id = g.game_id AND w.added > NOW() - make_interval(days => %s)))
+    ORDER BY g.game_id
+    LIMIT %s;
+"""
+
+
+def fetch_tracked_games(page_size: int = TRACKED_PAGE_SIZE) -> list[str]:
+    """Every tracked game name from RDS, read with keyset pagination"""
+    conn = get_connection()
+    cur = conn.cursor()
+    game_names = []
+    last_id = 0
+
+    try:
+        while True:
+            cur.execute(TRACKED_QUERY, (last_id, WATCHLIST_DAYS, page_size))
+            page = cur.fetchall()
+            game_names.extend(game_name for _, game_name in page)
+            if len(page) < page_size:
+                return game_names
+            last_id = page[-1][0]
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def read_tracked_cache() -> dict:
+    """The last saved list of tracked games, or an empty dict"""
+    try:
+        with open(TRACKED_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_tracked_cache(game_names: list[str]) -> None:
+    """Save the tracked games so warm containers and local runs skip the query"""
+    tmp_path = f'{TRACKED_CACHE_PATH}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fetched_at': time.time(), 'games': game_names}, f)
+        os.replace(tmp_path, TRACKED_CACHE_PATH)
+    except OSError as e:
+        print(f'Could not cache tracked games: {e}')
+
+
+def get_tracked_games(ttl: int = TRACKED_CACHE_TTL) -> list[str]:
+    """
+    Tracked game names, from the local copy while it is younger than ttl seconds.
+    If RDS cannot be read the last saved list is used, however old
+    """
+    cached = read_tracked_cache()
+    if cached and time.time() - cached.get('fetched_at', 0) < ttl:
+        return cached['games']
+
+    try:
+        game_names = fetch_tracked_games()
+    except psycopg2.Error as e:
+        if not cached:
+            raise
+        print(f'Could not read tracked games, using saved list: {e}')
+        return cached['games']
+
+    save_tracked_cache(game_names)
+    return game_names
+
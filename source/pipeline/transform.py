@@ -1,13 +1,26 @@
 """Script for transforming data for storage in RDS"""
 
+from __future__ import annotations
+
 import json
+import os
 from datetime import date, timedelta
-import pandas as pd
+from typing import TYPE_CHECKING
+import numpy as np
+
+# pandas and pyarrow are only loaded by the DataFrame path and the standalone
+# stages, the pipelines use transform_batch and never pay for the import
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
 
 
 DIRECTORY = '/var/task/tmp/data/'
-SOURCE_FILES = ['gog_products.json', 'steam_products.json']
-OUTPUT_PATH = f'{DIRECTORY}clean_data.json'
+SOURCE_FILES = ['gog_products.arrow', 'steam_products.arrow']
+RAW_COLUMNS = ['name', 'base_price_gbp_pence', 'final_price_gbp_pence']
+OUTPUT_PATH = f'{DIRECTORY}clean_data.arrow'
+CLEAN_COLUMNS = ['game_name', 'retail_price', 'platform_name',
+                 'listing_date', 'discount_percent', 'final_price']
 TEST_DATA = 'test_products.json'
 TODAY = date.today()
 # for testing historical pipeline deletion
@@ -75,11 +88,16 @@ def transform_source(filename: str) -> pd.DataFrame:
     Reads data from a JSON file into a Pandas dataframe
     and transforms it to the format expected by load script
     """
-    # Read data from file
-    source_data = read_data(filename)
+    # Read data from file, platform name comes from the file name
+    # (e.g. reading from gog_products.json sets platform_name to 'gog')
+    return transform_records(read_data(filename), filename.split('_')[0])
+
 
-    # Create dataframe
-    source_dataframe = pd.DataFrame(source_data)
+def transform_records(source_data: list[dict], platform_name: str) -> pd.DataFrame:
+    """Transforms the listings scraped from one platform to the format expected by load script"""
+    import pandas as pd
+    # Create dataframe, unmatched games are empty dicts and become all NaN rows
+    source_dataframe = pd.DataFrame(source_data, columns=RAW_COLUMNS)
 
     # Drop NaN values
     source_dataframe.dropna(subset=['base_price_gbp_pence'], inplace=True)
@@ -94,12 +112,11 @@ def transform_source(filename: str) -> pd.DataFrame:
     # Redefine dataframe with relevant columns
     source_dataframe = get_relevant_columns(source_dataframe)
 
-    # Set platform name for all rows based on which file is being read
-    # (e.g. reading from gog_products.json sets platform_name to 'gog')
-    source_dataframe.loc[:, 'platform_name'] = filename.split('_')[0]
+    # Set platform name for all rows based on which source is being read
+    source_dataframe['platform_name'] = platform_name
 
     # Timestamp data with today's date
-    source_dataframe.loc[:, 'listing_date'] = TODAY
+    source_dataframe['listing_date'] = TODAY
 
     # Cast prices to integers
     source_dataframe = cast_to_int(source_dataframe)
@@ -114,28 +131,104 @@ def transform_source(filename: str) -> pd.DataFrame:
     return source_dataframe
 
 
-def transform_all():
-    """Iterates through available sources and transforms raw data from them, saving to JSON"""
-    # Get dataframes from each source and append to list
-    all_data_sources = []
-    for source_filename in SOURCE_FILES:
-        all_data_sources.append(transform_source(source_filename))
+def whole_pence(prices: np.ndarray, label: str) -> np.ndarray:
+    """Casts float prices to int64, refusing prices that are not whole pence"""
+    if not np.array_equal(prices, np.trunc(prices)):
+        raise ValueError(f"{label} price not able to be converted")
+    return prices.astype(np.int64)
+
 
-    # Concatenate all source dataframes into one
-    all_data = pd.concat(all_data_sources)
+def transform_arrays(names: np.ndarray, base: np.ndarray, final: np.ndarray,
+                     platforms: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Computes the clean columns from raw columns in one vectorised pass,
+    prices are floats with NaN where the listing has none and those rows are dropped
+    """
+    keep = ~(np.isnan(base) | np.isnan(final))
+    base, final = base[keep], final[keep]
+
+    discount = np.zeros(len(base), dtype=np.int64)
+    valid = base > 0
+    # rint rounds halves to even, like the DataFrame path
+    discount[valid] = np.rint(
+        (1 - final[valid] / base[valid]) * 100).astype(np.int64)
+
+    return {
+        'game_name': names[keep],
+        'retail_price': whole_pence(base, 'Base'),
+        'platform_name': platforms[keep],
+        'listing_date': np.full(len(base), np.datetime64(TODAY, 'D')),
+        'discount_percent': discount,
+        'final_price': whole_pence(final, 'Final')
+    }
 
-    # Export all data to json output
-    all_data.to_json(
-        OUTPUT_PATH, indent=4, lines=False, orient='records', mode='w')
 
+def transform_batch(raw_data: dict[str, list[dict]]) -> dict[str, np.ndarray]:
+    """
+    Transforms the raw listings of every platform in one vectorised pass,
+    returning a columnar batch of CLEAN_COLUMNS arrays for the loader.
+    Unmatched games and listings missing a price are dropped
+    """
+    names, base_prices, final_prices, platform_counts = [], [], [], []
+    for listings in raw_data.values():
+        for listing in listings:
+            names.append(listing.get('name'))
+            base_prices.append(listing.get('base_price_gbp_pence'))
+            final_prices.append(listing.get('final_price_gbp_pence'))
+        platform_counts.append(len(listings))
+
+    # None becomes NaN, so unmatched games fall out with the mask
+    return transform_arrays(
+        np.array(names, dtype=object),
+        np.array(base_prices, dtype=np.float64),
+        np.array(final_prices, dtype=np.float64),
+        np.repeat(np.array(list(raw_data), dtype=object), platform_counts))
+
+
+def transform_tables(raw_tables: dict[str, pa.Table]) -> dict[str, np.ndarray]:
+    """Same as transform_batch, for raw listings read from Arrow files, keyed by platform name"""
+    import pyarrow as pa
+    from interchange import RAW_SCHEMA
+    table = pa.concat_tables(raw_tables.values()) if raw_tables else RAW_SCHEMA.empty_table()
+    prices = [table.column(column).cast(pa.float64()).fill_null(np.nan).to_numpy()
+              for column in ('base_price_gbp_pence', 'final_price_gbp_pence')]
+
+    return transform_arrays(
+        table.column('name').to_numpy(zero_copy_only=False),
+        *prices,
+        np.repeat(np.array(list(raw_tables), dtype=object),
+                  [raw.num_rows for raw in raw_tables.values()]))
+
+
+def batch_rows(batch: dict[str, np.ndarray]) -> list[dict]:
+    """Rows of a columnar batch as plain python values, with the date as a string"""
+    columns = {column: batch[column].tolist() for column in CLEAN_COLUMNS}
+    columns['listing_date'] = [day.isoformat()
+                               for day in columns['listing_date']]
+    return [dict(zip(CLEAN_COLUMNS, row)) for row in zip(*columns.values())]
+
+
+def read_source_tables() -> dict[str, pa.Table]:
+    """Memory maps the raw listings each store's extract wrote, keyed by platform name"""
+    from interchange import read_raw_listings
+    # platform name comes from the file name, as in transform_source
+    return {source_filename.split('_')[0]: read_raw_listings(f'{DIRECTORY}{source_filename}')
+            for source_filename in SOURCE_FILES
+            if os.path.exists(f'{DIRECTORY}{source_filename}')}
+
+
+def transform_all(raw_data: dict[str, list[dict]] | None = None) -> list[dict]:
+    """
+    Transforms the raw listings of every platform into rows for the load script.
+    raw_data maps platform name to listings as returned by extract_games,
+    when it is not given the source files are read from disk instead
+    """
+    if raw_data is None:
+        return batch_rows(transform_tables(read_source_tables()))
 
-if __name__ == "__main__":
-    # transform_all()
+    return batch_rows(transform_batch(raw_data))
 
-    data = {
-        "base_price_gbp_pence": [-1, -1, -1],
-        "final_price_gbp_pence": [50, 40, 45]
-    }
-    df = pd.DataFrame(data)
 
-    calculate_discount(df)
+if __name__ == "__main__":
+    from interchange import write_clean_batch
+    write_clean_batch(transform_tables(read_source_tables()), OUTPUT_PATH)
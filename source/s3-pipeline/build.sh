@@ -3,7 +3,7 @@ docker login \
     --username AWS \
     --password-stdin 129033205317.dkr.ecr.eu-west-2.amazonaws.com && \
 
-docker buildx build --platform "linux/amd64" --provenance=false -t c20-wishbone-price-history-ecr . && \
+docker buildx build --platform "linux/amd64" --provenance=false --build-context pipeline=../pipeline -t c20-wishbone-price-history-ecr . && \
 docker tag c20-wishbone-price-history-ecr:latest 129033205317.dkr.ecr.eu-west-2.amazonaws.com/c20-wishbone-price-history-ecr:latest && \
 docker push 129033205317.dkr.ecr.eu-west-2.amazonaws.com/c20-wishbone-price-history-ecr:latest && \
 aws lambda update-function-code \
@@ -0,0 +1,194 @@
+"""
+Script which compacts the listing dataset in S3, or a local copy of it: every day of a
+month has its small parquet files merged into one file per game bucket sorted by game_id
+and recording_date, so Athena opens fewer files and can skip row groups by game. Days
+written before game buckets are moved into them
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import posixpath
+from typing import TYPE_CHECKING
+import uuid
+
+import metrics
+from historical_pipeline import S3_LISTING_BASE, LISTING_PARTITIONS, GAME_BUCKETS, listing_schema
+
+# pyarrow is slow to import, so it is imported where it is used
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from pyarrow import fs
+
+ROW_GROUP_SIZE = int(os.getenv("COMPACTION_ROW_GROUP_SIZE", "100000"))
+SORT_KEYS = [("game_id", "ascending"), ("recording_date", "ascending")]
+# files being written start with _ so Athena and this script ignore them until they are moved
+WRITING_PREFIX = "_compacting-"
+COMPACTED_PREFIX = "compacted-"
+
+
+def file_schema() -> pa.Schema:
+    """Columns stored in the listing files, the partition columns are in the paths"""
+    import pyarrow as pa
+    return pa.schema([field for field in listing_schema() if field.name not in LISTING_PARTITIONS])
+
+
+def month_of(partition: str) -> str:
+    """'year=2025/month=3/day=4' -> '2025-03'"""
+    values = dict(part.split("=", 1) for part in partition.split("/")[:2])
+    return f"{int(values['year'])}-{int(values['month']):02d}"
+
+
+def list_partitions(filesystem: fs.FileSystem, base: str) -> dict[str, list[str]]:
+    """Parquet files under base by the day directory ('year=2025/month=3/day=4') they are in"""
+    from pyarrow import fs as pafs
+    partitions = {}
+    selector = pafs.FileSelector(base, recursive=True, allow_not_found=True)
+    for info in filesystem.get_file_info(selector):
+        if info.type != pafs.FileType.File or info.base_name.startswith(("_", ".")):
+            continue
+        directories = posixpath.dirname(posixpath.relpath(info.path, base)).split("/")
+        if directories[0].startswith("year=") and len(directories) >= 3:
+            partitions.setdefault("/".join(directories[:3]), []).append(info.path)
+    return {partition: sorted(files) for partition, files in sorted(partitions.items())}
+
+
+def is_compacted(files: list[str]) -> bool:
+    """True when every file is the one compacted file of its game bucket"""
+    buckets = [posixpath.basename(posixpath.dirname(path)) for path in files]
+    return (all(bucket.startswith("game_bucket=") for bucket in buckets)
+            and len(set(buckets)) == len(buckets)
+            and all(posixpath.basename(path).startswith(COMPACTED_PREFIX) for path in files))
+
+
+def read_files(filesystem: fs.FileSystem, files: list[str]) -> pa.Table:
+    """
+    The files as one table, older files with other integer and timestamp widths
+    cast to file_schema
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = file_schema()
+    tables = []
+    for path in files:
+        with filesystem.open_input_file(path) as f:
+            tables.append(pq.read_table(f).select(schema.names).cast(schema))
+    return pa.concat_tables(tables)
+
+
+def sort_listings(table: pa.Table) -> pa.Table:
+    """
+    Sort by game_id and recording_date, dropping repeated listing_ids, which a run that
+    stopped between writing its file and deleting the old ones leaves behind
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    # pyarrow.compute creates its functions at import, where pylint cannot see them
+    # pylint: disable=no-member
+    table = table.sort_by(SORT_KEYS + [("listing_id", "ascending")])
+    if table.num_rows < 2:
+        return table
+    ids = table.column("listing_id")
+    changed = pc.not_equal(ids.slice(1), ids.slice(0, table.num_rows - 1))
+    return table.filter(pa.chunked_array([[True]] + changed.chunks, type=pa.bool_()))
+
+
+def game_buckets(table: pa.Table) -> pa.Array:
+    """game_id % GAME_BUCKETS of every row"""
+    import pyarrow.compute as pc
+    # pylint: disable=no-member
+    game_id = table.column("game_id")
+    return pc.subtract(game_id, pc.multiply(pc.divide(game_id, GAME_BUCKETS), GAME_BUCKETS))
+
+
+def write_compacted(filesystem: fs.FileSystem, directory: str, table: pa.Table) -> None:
+    """
+    Write a sorted file into directory under a hidden name and move it into place,
+    so readers never see a partial file
+    """
+    import pyarrow.parquet as pq
+    from pyarrow import fs as pafs
+    name = f"{uuid.uuid4().hex}.parquet"
+    writing = posixpath.join(directory, WRITING_PREFIX + name)
+    filesystem.create_dir(directory)
+
+    try:
+        with filesystem.open_output_stream(writing) as out:
+            pq.write_table(table, out, row_group_size=ROW_GROUP_SIZE, compression="snappy",
+                           sorting_columns=pq.SortingColumn.from_ordering(table.schema, SORT_KEYS))
+    except Exception:
+        if filesystem.get_file_info(writing).type == pafs.FileType.File:
+            filesystem.delete_file(writing)
+        raise
+    filesystem.move(writing, posixpath.join(directory, COMPACTED_PREFIX + name))
+
+
+def compact_partition(filesystem: fs.FileSystem, directory: str, files: list[str]) -> int:
+    """
+    Replace the files of a day directory with one sorted file per game bucket, returning
+    the rows written. The old files are deleted once every new file is in place, so readers
+    see the old files, or the old and new ones for a moment, never a partial file
+    """
+    import pyarrow.compute as pc
+    # pylint: disable=no-member
+    table = sort_listings(read_files(filesystem, files))
+    buckets = game_buckets(table)
+
+    for bucket in sorted(pc.unique(buckets).to_pylist()):
+        write_compacted(filesystem, posixpath.join(directory, f"game_bucket={bucket}"),
+                        table.filter(pc.equal(buckets, bucket)))
+
+    for path in files:
+        filesystem.delete_file(path)
+    return table.num_rows
+
+
+def compact(base_path: str | None = None, months: list[str] | None = None) -> dict:
+    """
+    Compact every day of the given months ('2025-03'), all months by default.
+    Days already holding one compacted file per game bucket are skipped
+    """
+    from pyarrow import fs as pafs
+    base_path = base_path or S3_LISTING_BASE
+    if "://" not in base_path:
+        base_path = os.path.abspath(base_path)
+    filesystem, base = pafs.FileSystem.from_uri(base_path)
+    base = base.rstrip("/")
+    summary = {"partitions": 0, "files_removed": 0, "rows": 0}
+
+    for partition, files in list_partitions(filesystem, base).items():
+        if (months and month_of(partition) not in months) or is_compacted(files):
+            continue
+        with metrics.timer("CompactionTime"):
+            rows = compact_partition(filesystem, posixpath.join(base, partition), files)
+        print(f"Compacted {partition}: {len(files)} files, {rows} rows")
+
+        summary["partitions"] += 1
+        summary["files_removed"] += len(files)
+        summary["rows"] += rows
+
+    metrics.count("FilesCompacted", summary["files_removed"])
+    return summary
+
+
+def lambda_handler(event, context):
+    """
+    event may give "months" (["2025-03"]) and "base_path",
+    by default every month in S3 is compacted
+    """
+    try:
+        summary = compact(event.get("base_path"), event.get("months"))
+    finally:
+        metrics.flush(Function="compaction")
+    return {"status": "success", "msg": "Listing compaction completed", **summary}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the listing parquet files")
+    parser.add_argument("base_path", nargs="?", default=None,
+                        help="listing dataset, an s3:// path or local directory (default S3)")
+    parser.add_argument("--month", action="append", dest="months",
+                        help="month to compact as YYYY-MM, repeatable (default every month)")
+    args = parser.parse_args()
+    print(compact(args.base_path, args.months))
@@ -1,19 +1,43 @@
+from __future__ import annotations
+
 import os
-from dotenv import load_dotenv
 from datetime import datetime, timezone
-import awswrangler as wr
-import pandas as pd
-from sqlalchemy import create_engine, text
+from typing import TYPE_CHECKING, Iterator
+import uuid
+
+from dotenv import load_dotenv
+
+import metrics
+
+# awswrangler, pandas and SQLAlchemy are slow to import, so they are imported where they are used
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
 
 load_dotenv()
 
 BUCKET = "c20-wishbone-s3"
 BASE_S3_PATH = f"s3://{BUCKET}/input"
 VALID_TABLES = {"game", "platform", "listing"}
+# "incremental" exports only the rows added since the last export, "full" exports whole tables
+EXPORT_MODE = os.getenv("EXPORT_MODE", "incremental").lower()
+# tables are exported in order of these ids, the watermark is the last id exported
+WATERMARK_COLUMNS = {"game": "game_id", "platform": "platform_id", "listing": "listing_id"}
+# listing rows read from RDS and held in memory at once by the streaming export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "50000"))
+# listings of a day are split by game_id % GAME_BUCKETS, so queries for some games read some files.
+# The mailing Lambda and the Glue table's partition projection use the same number
+GAME_BUCKETS = int(os.getenv("GAME_BUCKETS", "8"))
+LISTING_PARTITIONS = ["year", "month", "day", "game_bucket"]
 
 S3_GAME = f"{BASE_S3_PATH}/game/game.parquet"
 S3_PLATFORM = f"{BASE_S3_PATH}/platform/platform.parquet"
+# primary key each dimension is merged on
+DIM_KEYS = {S3_GAME: "game_id", S3_PLATFORM: "platform_id"}
 S3_LISTING_BASE = f"{BASE_S3_PATH}/listing/"
+# listing files of an export wait under here until its watermark is committed. Athena,
+# the crawler and the compaction skip folders starting with _
+STAGING_DIR = "_staging"
 
 DB_HOST = os.getenv("DB_HOST")
 DB_USER = os.getenv("DB_USER")
@@ -23,10 +47,16 @@ DB_PORT = os.getenv("DB_PORT")
 
 CONNECTION_STRING = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+ENGINE = None  # kept for the life of the container, warm invocations reuse its connections
+
 
 def get_engine():
-    """Create DB engine"""
-    return create_engine(CONNECTION_STRING)
+    """Return the DB engine, created on first use"""
+    global ENGINE
+    if ENGINE is None:
+        from sqlalchemy import create_engine
+        ENGINE = create_engine(CONNECTION_STRING, pool_pre_ping=True)
+    return ENGINE
 
 
 def extract_table(table: str) -> pd.DataFrame:
@@ -34,10 +64,14 @@ def extract_table(table: str) -> pd.DataFrame:
     if table not in VALID_TABLES:
         raise ValueError(f"Invalid table name: {table}")
 
+    import pandas as pd
+    from sqlalchemy import text
     query = text(f"SELECT * FROM wishbone.{table};")
 
     engine = get_engine()
     df = pd.read_sql(query, engine)
+    metrics.count("DbRoundTrips")
+    metrics.count("RowsExtracted", len(df), Table=table)
 
     print(f"Extracted data from {table}: {len(df)} rows")
     return df
@@ -45,39 +79,54 @@ def extract_table(table: str) -> pd.DataFrame:
 
 def transform_listing(df: pd.DataFrame) -> pd.DataFrame:
     """Safety check to ensure recording_date is date"""
+    import pandas as pd
     df["recording_date"] = pd.to_datetime(df["recording_date"]).dt.date
     return df
 
 
+def merge_dim_rows(current: pd.DataFrame | None, new: pd.DataFrame, key: str) -> pd.DataFrame:
+    """One row per key, new rows replacing the current ones with the same key"""
+    import pandas as pd
+    merged = pd.concat([current, new], ignore_index=True) if current is not None else new
+    return merged.drop_duplicates(subset=key, keep="last").sort_values(key).reset_index(drop=True)
+
+
 def load_dim_table(df: pd.DataFrame, s3_path: str):
-    """Append to parquet file for game & platform, create file if doesn't exist"""
-    exists = wr.s3.does_object_exist(s3_path)
+    """
+    Merge new and changed rows into the game or platform dimension by primary key
+    and write it back as one deduplicated parquet file. The new file is written
+    before the old ones are deleted, so readers never find the dimension missing
+    """
+    import awswrangler as wr
+    directory = f"{s3_path.rstrip('/')}/"
+    old_files = wr.s3.list_objects(directory)
+    current = wr.s3.read_parquet(path=old_files) if old_files else None
 
-    wr.s3.to_parquet(
-        df=df,
-        path=s3_path,
-        index=False,
-        dataset=True,
-        mode="append" if exists else "overwrite"
-    )
+    # the id is the first column of each table
+    merged = merge_dim_rows(current, df, DIM_KEYS.get(s3_path, df.columns[0]))
+    wr.s3.to_parquet(df=merged, path=f"{directory}{uuid.uuid4().hex}.snappy.parquet", index=False)
+    if old_files:
+        wr.s3.delete_objects(old_files)
 
-    action = "appended to" if exists else "created"
-    print(f"Dimension {action}: {s3_path}")
+    print(f"Dimension merged: {s3_path}, {len(merged)} rows replacing {len(old_files)} files")
 
 
 def load_listing_partitioned(df: pd.DataFrame):
-    """Write parquet files by year/month/day"""
+    """Write parquet files by year/month/day/game_bucket"""
+    import awswrangler as wr
+    import pandas as pd
     df["recording_date"] = pd.to_datetime(df["recording_date"])
     df["year"] = df["recording_date"].dt.year
     df["month"] = df["recording_date"].dt.month
     df["day"] = df["recording_date"].dt.day
+    df["game_bucket"] = df["game_id"] % GAME_BUCKETS
 
     wr.s3.to_parquet(
         df=df,
         path=S3_LISTING_BASE,
         index=False,
         dataset=True,
-        partition_cols=["year", "month", "day"]
+        partition_cols=LISTING_PARTITIONS
     )
 
     print(f"Load and partitioning listing to s3")
@@ -85,6 +134,7 @@ def load_listing_partitioned(df: pd.DataFrame):
 
 def delete_old_listing_data():
     """Delete all listing rows that are not from today's date"""
+    from sqlalchemy import text
     today = datetime.now(timezone.utc).date()
 
     query = text("""
@@ -97,25 +147,297 @@ def delete_old_listing_data():
     with engine.begin() as conn:
         result = conn.execute(query, {"today": today})
         deleted = result.rowcount
+    metrics.count("DbRoundTrips")
+    metrics.count("RowsDeleted", deleted)
 
     print(f"Cleanup, deleted {deleted} outdated listing rows from RDS")
 
 
-def main():
-    """Main Historical Pipeline"""
-    print("Starting Historical Pipeline")
+# <--- Incremental export --->
+
+
+def lock_export_tables(conn) -> None:
+    """
+    Hold off pipeline writes and other exports until this export commits. Taken
+    before the first read, so every row below the new watermarks is in the export
+    """
+    from sqlalchemy import text
+    conn.execute(text("""
+            LOCK TABLE wishbone.export_watermark, wishbone.game, wishbone.platform, wishbone.listing
+            IN SHARE ROW EXCLUSIVE MODE;
+    """))
+
 
-    games_df = extract_table("game")
-    platforms_df = extract_table("platform")
-    listings_df = extract_table("listing")
+def read_watermarks(conn) -> dict[str, int]:
+    """Last id exported from each table, tables never exported are missing"""
+    from sqlalchemy import text
+    rows = conn.execute(text("SELECT table_name, last_id FROM wishbone.export_watermark;"))
+    metrics.count("DbRoundTrips")
+    return {table: last_id for table, last_id in rows}
 
-    listings_df = transform_listing(listings_df)
 
-    load_dim_table(games_df, S3_GAME)
-    load_dim_table(platforms_df, S3_PLATFORM)
-    load_listing_partitioned(listings_df)
+def extract_new_rows(conn, table: str, after: int) -> pd.DataFrame:
+    """Extract the rows of a table added since the watermark into a pandas df"""
+    if table not in WATERMARK_COLUMNS:
+        raise ValueError(f"Invalid table name: {table}")
+
+    import pandas as pd
+    from sqlalchemy import text
+    column = WATERMARK_COLUMNS[table]
+    query = text(f"SELECT * FROM wishbone.{table} WHERE {column} > :after ORDER BY {column};")
+
+    df = pd.read_sql(query, conn, params={"after": after})
+    metrics.count("DbRoundTrips")
+    metrics.count("RowsExtracted", len(df), Table=table)
+
+    print(f"Extracted new data from {table}: {len(df)} rows after {column} {after}")
+    return df
+
+
+def save_watermarks(conn, watermarks: dict[str, int]) -> None:
+    """Record the last id exported from each table"""
+    from sqlalchemy import text
+    conn.execute(text("""
+            INSERT INTO wishbone.export_watermark (table_name, last_id, exported_at)
+            VALUES (:table_name, :last_id, NOW())
+            ON CONFLICT (table_name) DO UPDATE
+            SET last_id = EXCLUDED.last_id, exported_at = EXCLUDED.exported_at;
+    """), [{"table_name": table, "last_id": last_id} for table, last_id in watermarks.items()])
+    metrics.count("DbRoundTrips")
+
+
+def delete_exported_listings(conn, up_to: int) -> int:
+    """Delete the exported listing rows that are not from today's date"""
+    from sqlalchemy import text
+    today = datetime.now(timezone.utc).date()
 
-    delete_old_listing_data()
+    result = conn.execute(text("""
+            DELETE FROM wishbone.listing
+            WHERE listing_id <= :up_to AND recording_date::date <> :today;
+    """), {"up_to": up_to, "today": today})
+    metrics.count("DbRoundTrips")
+    metrics.count("RowsDeleted", result.rowcount)
+
+    print(f"Cleanup, deleted {result.rowcount} exported listing rows from RDS")
+    return result.rowcount
+
+
+def listing_schema() -> pa.Schema:
+    """Columns of the listing parquet files, timestamps in ms as Athena reads them"""
+    import pyarrow as pa
+    return pa.schema([
+        ("listing_id", pa.int64()),
+        ("game_id", pa.int32()),
+        ("platform_id", pa.int32()),
+        ("price", pa.int32()),
+        ("discount_percent", pa.int32()),
+        ("recording_date", pa.timestamp("ms")),
+        ("year", pa.int32()),
+        ("month", pa.int32()),
+        ("day", pa.int32()),
+        ("game_bucket", pa.int32())
+    ])
+
+
+def listing_record_batch(rows: list[tuple]) -> pa.RecordBatch:
+    """
+    Arrow batch of listing rows
+    (listing_id, game_id, platform_id, price, discount_percent, recording_date)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    # pyarrow.compute creates its functions at import, where pylint cannot see them
+    # pylint: disable=no-member
+    schema = listing_schema()
+    *ids, dates = zip(*rows)
+    # recording_date is a DATE in RDS, stored as a timestamp like the files written before
+    recording_date = pa.array(dates, type=pa.date32()).cast(schema.field("recording_date").type)
+    columns = [pa.array(values, type=field.type) for values, field in zip(ids, schema)]
+    game_id = columns[1]
+    return pa.RecordBatch.from_arrays(
+        columns + [recording_date,
+                   pc.year(recording_date).cast(pa.int32()),
+                   pc.month(recording_date).cast(pa.int32()),
+                   pc.day(recording_date).cast(pa.int32()),
+                   pc.subtract(game_id,
+                               pc.multiply(pc.divide(game_id, GAME_BUCKETS), GAME_BUCKETS))],
+        schema=schema)
+
+
+def stream_new_listings(conn, after: int, exported: dict) -> Iterator[pa.RecordBatch]:
+    """
+    Read the listing rows past the watermark through a server side cursor, EXPORT_BATCH_SIZE
+    at a time. exported is updated with the rows read and the last listing_id
+    """
+    from sqlalchemy import text
+    # stream_results on the statement only, the rest of the transaction keeps plain cursors
+    query = text("""
+            SELECT listing_id, game_id, platform_id, price, discount_percent, recording_date
+            FROM wishbone.listing
+            WHERE listing_id > :after
+            ORDER BY listing_id;
+    """).execution_options(stream_results=True, max_row_buffer=EXPORT_BATCH_SIZE)
+    result = conn.execute(query, {"after": after})
+    metrics.count("DbRoundTrips")
+
+    for rows in result.partitions(EXPORT_BATCH_SIZE):
+        metrics.count("DbRoundTrips")
+        exported["rows"] += len(rows)
+        exported["last_id"] = rows[-1][0]
+        yield listing_record_batch(rows)
+
+
+def write_listing_batches(batches: Iterator[pa.RecordBatch], base_path: str | None = None) -> None:
+    """
+    Write listing batches into the year/month/day/game_bucket partitions as they arrive, so memory
+    stays at one batch however many rows there are. Files are added beside the existing ones
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+    filesystem, path = fs.FileSystem.from_uri(base_path or S3_LISTING_BASE)
+    schema = listing_schema()
+
+    ds.write_dataset(
+        batches,
+        path,
+        schema=schema,
+        format="parquet",
+        filesystem=filesystem,
+        partitioning=ds.partitioning(pa.schema([schema.field(name) for name in LISTING_PARTITIONS]),
+                                     flavor="hive"),
+        basename_template=f"{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=EXPORT_BATCH_SIZE,
+        min_rows_per_group=min(EXPORT_BATCH_SIZE, 10_000)
+    )
+
+
+def staging_path(after: int, base_path: str | None = None) -> str:
+    """Folder the export of the listings past this watermark stages its files in"""
+    return f"{(base_path or S3_LISTING_BASE).rstrip('/')}/{STAGING_DIR}/after={after}"
+
+
+def promote_staged_listings(watermark: int, base_path: str | None = None) -> int:
+    """
+    Move the files of committed exports, those staged after an earlier watermark, into the
+    listing partitions, and delete the files of exports that never committed. Returns the
+    files moved. A move that stops part way is finished by the next call
+    """
+    import posixpath
+    from pyarrow import fs
+    filesystem, base = fs.FileSystem.from_uri(base_path or S3_LISTING_BASE)
+    base = base.rstrip("/")
+    moved = 0
+
+    for staged in filesystem.get_file_info(fs.FileSelector(posixpath.join(base, STAGING_DIR),
+                                                           allow_not_found=True)):
+        if staged.type != fs.FileType.Directory or not staged.base_name.startswith("after="):
+            continue
+        if int(staged.base_name.split("=", 1)[1]) < watermark:
+            for info in filesystem.get_file_info(fs.FileSelector(staged.path, recursive=True)):
+                if info.type != fs.FileType.File:
+                    continue
+                target = posixpath.join(base, posixpath.relpath(info.path, staged.path))
+                filesystem.create_dir(posixpath.dirname(target))
+                filesystem.move(info.path, target)
+                moved += 1
+        filesystem.delete_dir(staged.path)
+    return moved
+
+
+def export_new_listings(conn, after: int, base_path: str | None = None) -> dict:
+    """
+    Stream the listings past the watermark from RDS into its staging folder in S3,
+    returning the rows and last id exported
+    """
+    exported = {"rows": 0, "last_id": None}
+    write_listing_batches(stream_new_listings(conn, after, exported),
+                          staging_path(after, base_path))
+    metrics.count("RowsExtracted", exported["rows"], Table="listing")
+
+    print(f"Streamed new data from listing: {exported['rows']} rows after listing_id {after}")
+    return exported
+
+
+def export_incremental():
+    """
+    Export the rows added since the last run and delete old exported listings in one
+    transaction, the watermarks only move and rows are only deleted once the S3 writes succeed.
+    Listing files are staged and only moved into the partitions once the watermark is committed,
+    so a failed run leaves no files behind for its retry to write again
+    """
+    with get_engine().begin() as conn:
+        lock_export_tables(conn)
+        watermarks = read_watermarks(conn)
+        # files left by an earlier run that stopped before committing are deleted,
+        # those of one that committed but stopped before moving them are moved
+        promote_staged_listings(watermarks.get("listing", 0))
+
+        with metrics.timer("StageTime", Stage="extract"):
+            new_rows = {table: extract_new_rows(conn, table, watermarks.get(table, 0))
+                        for table in ("game", "platform")}
+
+        with metrics.timer("StageTime", Stage="load"):
+            if not new_rows["game"].empty:
+                load_dim_table(new_rows["game"], S3_GAME)
+            if not new_rows["platform"].empty:
+                load_dim_table(new_rows["platform"], S3_PLATFORM)
+
+        # listings go straight from the cursor to S3 without a DataFrame of them all
+        with metrics.timer("StageTime", Stage="stream"):
+            listings = export_new_listings(conn, watermarks.get("listing", 0))
+        metrics.count("RowsExported", listings["rows"])
+
+        exported = {table: int(df[WATERMARK_COLUMNS[table]].max())
+                    for table, df in new_rows.items() if not df.empty}
+        if listings["last_id"] is not None:
+            exported["listing"] = listings["last_id"]
+        if exported:
+            save_watermarks(conn, exported)
+        watermarks.update(exported)
+
+        with metrics.timer("StageTime", Stage="cleanup"):
+            delete_exported_listings(conn, watermarks.get("listing", 0))
+
+    with metrics.timer("StageTime", Stage="promote"):
+        promote_staged_listings(watermarks.get("listing", 0))
+
+
+# <--- Full export --->
+
+
+def export_full():
+    """Export every row of each table, then clear listings from before today"""
+    with metrics.timer("StageTime", Stage="extract"):
+        games_df = extract_table("game")
+        platforms_df = extract_table("platform")
+        listings_df = extract_table("listing")
+
+    with metrics.timer("StageTime", Stage="transform"):
+        listings_df = transform_listing(listings_df)
+
+    with metrics.timer("StageTime", Stage="load"):
+        load_dim_table(games_df, S3_GAME)
+        load_dim_table(platforms_df, S3_PLATFORM)
+        load_listing_partitioned(listings_df)
+    metrics.count("RowsExported", len(listings_df))
+
+    with metrics.timer("StageTime", Stage="cleanup"):
+        delete_old_listing_data()
+
+
+def main():
+    """Main Historical Pipeline"""
+    print(f"Starting Historical Pipeline, {EXPORT_MODE} export")
+
+    try:
+        if EXPORT_MODE == "full":
+            export_full()
+        else:
+            export_incremental()
+    finally:
+        metrics.flush(Function="historical_pipeline")
 
     print("Historical pipeline complete")
 
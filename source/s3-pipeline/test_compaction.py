@@ -0,0 +1,117 @@
+"""Tests for the listing compaction script"""
+
+from datetime import date
+from unittest.mock import patch
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs
+
+from compaction import compact, compact_partition, is_compacted, list_partitions, month_of, \
+    sort_listings, lambda_handler
+from historical_pipeline import listing_record_batch, write_listing_batches
+
+
+def listing_rows(first_id, count, game_ids=(3, 1, 2)):
+    return [(listing_id, game_ids[listing_id % len(game_ids)], 1, 999, 0, date(2025, 3, 4))
+            for listing_id in range(first_id, first_id + count)]
+
+
+def nightly_write(base, first_id, count):
+    write_listing_batches(iter([listing_record_batch(listing_rows(first_id, count))]), str(base))
+
+
+def day_files(base):
+    """Files of the test day, relative to its directory"""
+    day = base / "year=2025" / "month=3" / "day=4"
+    return sorted(str(path.relative_to(day)) for path in day.rglob("*.parquet"))
+
+
+def test_month_of():
+    assert month_of("year=2025/month=3/day=4") == "2025-03"
+
+
+def test_sort_listings_drops_repeated_ids():
+    table = pa.Table.from_pydict({"listing_id": [2, 1, 2], "game_id": [5, 1, 5],
+                                  "recording_date": [1, 1, 1]})
+
+    result = sort_listings(table)
+
+    assert result.column("listing_id").to_pylist() == [1, 2]
+
+
+def test_list_partitions_skips_hidden_files(tmp_path):
+    nightly_write(tmp_path, 1, 3)
+    bucket = tmp_path / "year=2025" / "month=3" / "day=4" / "game_bucket=1"
+    (bucket / "_compacting-x.parquet").write_bytes(b"")
+
+    partitions = list_partitions(fs.LocalFileSystem(), str(tmp_path))
+
+    assert list(partitions) == ["year=2025/month=3/day=4"]
+    assert len(partitions["year=2025/month=3/day=4"]) == 3
+
+
+def test_is_compacted():
+    assert is_compacted(["day=4/game_bucket=1/compacted-a.parquet",
+                         "day=4/game_bucket=2/compacted-b.parquet"])
+    assert not is_compacted(["day=4/game_bucket=1/compacted-a.parquet",
+                             "day=4/game_bucket=1/compacted-b.parquet"])
+    assert not is_compacted(["day=4/game_bucket=1/a-0.parquet"])
+    assert not is_compacted(["day=4/compacted-a.parquet"])
+
+
+def test_compact_merges_sorts_and_buckets(tmp_path):
+    nightly_write(tmp_path, 1, 3)
+    nightly_write(tmp_path, 4, 3)
+    # file written by the older pandas export before game buckets,
+    # 64 bit ints and nanosecond timestamps
+    pd.DataFrame({"listing_id": [7], "game_id": [1], "platform_id": [1], "price": [999],
+                  "discount_percent": [0], "recording_date": pd.to_datetime(["2025-03-04"])}) \
+        .to_parquet(tmp_path / "year=2025" / "month=3" / "day=4" / "legacy.snappy.parquet")
+
+    with patch("compaction.GAME_BUCKETS", 2):
+        summary = compact(str(tmp_path))
+
+    files = day_files(tmp_path)
+    assert [path.split("/")[0] for path in files] == ["game_bucket=0", "game_bucket=1"]
+    assert all(path.split("/")[1].startswith("compacted-") for path in files)
+    path = tmp_path / "year=2025" / "month=3" / "day=4" / files[1]
+    table = pq.read_table(path)
+    assert table.column("game_id").to_pylist() == [1, 1, 1, 3, 3]
+    assert table.column("listing_id").to_pylist() == [1, 4, 7, 3, 6]
+    assert table.schema.field("recording_date").type == pa.timestamp("ms")
+    assert pq.ParquetFile(path).metadata.row_group(0).sorting_columns[0].column_index == 1
+    assert summary == {"partitions": 1, "files_removed": 7, "rows": 7}
+
+
+def test_compact_skips_compacted_and_other_months(tmp_path):
+    nightly_write(tmp_path, 1, 3)
+    compact(str(tmp_path))
+
+    assert compact(str(tmp_path))["partitions"] == 0
+    nightly_write(tmp_path, 4, 3)
+    assert compact(str(tmp_path), ["2025-04"])["partitions"] == 0
+    assert compact(str(tmp_path), ["2025-03"])["files_removed"] == 6
+
+
+def test_compact_partition_failed_write_keeps_files(tmp_path):
+    nightly_write(tmp_path, 1, 3)
+    directory = tmp_path / "year=2025" / "month=3" / "day=4"
+    files = [str(path) for path in directory.rglob("*.parquet")]
+
+    with patch("pyarrow.parquet.write_table", side_effect=OSError("S3 down")):
+        with pytest.raises(OSError):
+            compact_partition(fs.LocalFileSystem(), str(directory), files)
+
+    assert day_files(tmp_path) == sorted(path[len(str(directory)) + 1:] for path in files)
+
+
+def test_lambda_handler():
+    with patch("compaction.compact",
+               return_value={"partitions": 2, "files_removed": 5, "rows": 10}) as mock_compact:
+        response = lambda_handler({"months": ["2025-03"]}, {})
+
+    mock_compact.assert_called_once_with(None, ["2025-03"])
+    assert response["status"] == "success"
+    assert response["files_removed"] == 5
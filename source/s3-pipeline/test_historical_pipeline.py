@@ -1,10 +1,19 @@
 """Tests for historical pipeline script"""
 
 from datetime import date
+import json
+import os
+import subprocess
+import sys
 from unittest.mock import patch, MagicMock
 import pytest
 import pandas as pd
-from historical_pipeline import extract_table, transform_listing, load_dim_table, load_listing_partitioned, delete_old_listing_data, main, lambda_handler
+import pyarrow as pa
+import pyarrow.parquet as pq
+from historical_pipeline import extract_table, transform_listing, load_dim_table, \
+    load_listing_partitioned, delete_old_listing_data, main, lambda_handler, extract_new_rows, \
+    export_incremental, merge_dim_rows, listing_record_batch, stream_new_listings, \
+    write_listing_batches, export_new_listings, staging_path, promote_staged_listings
 
 
 def test_extract_table_valid():
@@ -12,7 +21,8 @@ def test_extract_table_valid():
     fake_conn = MagicMock()
     fake_engine.begin.return_value.__enter__.return_value = fake_conn
 
-    with patch("historical_pipeline.get_engine", return_value=fake_engine), patch("pandas.read_sql", return_value=pd.DataFrame({"id": [1, 2]})) as mock_read_sql:
+    with patch("historical_pipeline.get_engine", return_value=fake_engine), \
+            patch("pandas.read_sql", return_value=pd.DataFrame({"id": [1, 2]})) as mock_read_sql:
         df = extract_table("game")
 
         mock_read_sql.assert_called_once()
@@ -34,36 +44,62 @@ def test_transforming_listing():
     assert df_transformed["recording_date"].iloc[0] == date(2025, 1, 1)
 
 
-def test_load_dim_table_append():
-    df = pd.DataFrame({"id": [1]})
+def test_merge_dim_rows_keeps_latest_row_per_key():
+    current = pd.DataFrame({"game_id": [1, 1, 2], "game_name": ["a", "a", "b"],
+                            "retail_price": [5, 5, 7]})
+    new = pd.DataFrame({"game_id": [2, 3], "game_name": ["b", "c"], "retail_price": [9, 4]})
+
+    merged = merge_dim_rows(current, new, "game_id")
+
+    assert merged["game_id"].tolist() == [1, 2, 3]
+    assert merged["retail_price"].tolist() == [5, 9, 4]
+
 
-    with patch("awswrangler.s3.does_object_exist", return_value=True), patch("awswrangler.s3.to_parquet") as mock_parquet:
+def test_load_dim_table_merges_and_replaces_files():
+    df = pd.DataFrame({"game_id": [2], "game_name": ["b"]})
+    old_files = ["s3://bucket/game.parquet/old1.parquet", "s3://bucket/game.parquet/old2.parquet"]
+    current = pd.DataFrame({"game_id": [1, 2, 1], "game_name": ["a", "old b", "a"]})
+
+    with patch("awswrangler.s3.list_objects", return_value=old_files), \
+            patch("awswrangler.s3.read_parquet", return_value=current) as mock_read, \
+            patch("awswrangler.s3.to_parquet") as mock_parquet, \
+            patch("awswrangler.s3.delete_objects") as mock_delete:
         load_dim_table(df, "s3://bucket/game.parquet")
 
+        mock_read.assert_called_once_with(path=old_files)
         _, kwargs = mock_parquet.call_args
-        assert kwargs["mode"] == "append"
-        assert kwargs["dataset"] is True
+        assert kwargs["df"]["game_name"].tolist() == ["a", "b"]
+        assert kwargs["path"].startswith("s3://bucket/game.parquet/")
+        assert kwargs["path"] not in old_files
+        mock_delete.assert_called_once_with(old_files)
 
 
-def test_load_dim_table_overwrite():
+def test_load_dim_table_first_write():
     df = pd.DataFrame({"id": [1]})
 
-    with patch("awswrangler.s3.does_object_exist", return_value=False), patch("awswrangler.s3.to_parquet") as mock_parquet:
+    with patch("awswrangler.s3.list_objects", return_value=[]), \
+            patch("awswrangler.s3.read_parquet") as mock_read, \
+            patch("awswrangler.s3.to_parquet") as mock_parquet, \
+            patch("awswrangler.s3.delete_objects") as mock_delete:
         load_dim_table(df, "s3://bucket/game.parquet")
 
+        mock_read.assert_not_called()
+        mock_delete.assert_not_called()
         _, kwargs = mock_parquet.call_args
-        assert kwargs["mode"] == "overwrite"
+        assert kwargs["df"]["id"].tolist() == [1]
 
 
 def test_load_listing_partitioned():
-    df = pd.DataFrame({"recording_date": ["2025-03-04"]})
+    df = pd.DataFrame({"game_id": [11], "recording_date": ["2025-03-04"]})
 
-    with patch("awswrangler.s3.to_parquet") as mock_parquet:
+    with patch("awswrangler.s3.to_parquet") as mock_parquet, \
+            patch("historical_pipeline.GAME_BUCKETS", 8):
         load_listing_partitioned(df)
 
         mock_parquet.assert_called_once()
         _, kwargs = mock_parquet.call_args
-        assert kwargs["partition_cols"] == ["year", "month", "day"]
+        assert kwargs["partition_cols"] == ["year", "month", "day", "game_bucket"]
+        assert kwargs["df"]["game_bucket"].tolist() == [3]
 
 
 def test_delete_old_listing_data():
@@ -83,7 +119,8 @@ def test_delete_old_listing_data():
 
 
 def test_main():
-    with patch("historical_pipeline.extract_table") as mock_extract, \
+    with patch("historical_pipeline.EXPORT_MODE", "full"), \
+            patch("historical_pipeline.extract_table") as mock_extract, \
             patch("historical_pipeline.transform_listing") as mock_transform, \
             patch("historical_pipeline.load_dim_table") as mock_dim, \
             patch("historical_pipeline.load_listing_partitioned") as mock_listing, \
@@ -98,6 +135,164 @@ def test_main():
         mock_delete.assert_called_once()
 
 
+def test_main_incremental():
+    with patch("historical_pipeline.EXPORT_MODE", "incremental"), \
+            patch("historical_pipeline.export_incremental") as mock_incremental, \
+            patch("historical_pipeline.delete_old_listing_data") as mock_delete:
+
+        main()
+
+        mock_incremental.assert_called_once()
+        mock_delete.assert_not_called()
+
+
+def test_extract_new_rows_invalid():
+    with pytest.raises(ValueError):
+        extract_new_rows(MagicMock(), "tracking", 0)
+
+
+def new_rows(table, after):
+    """extract_new_rows stand-in, two new rows of a dimension"""
+    column = {"game": "game_id", "platform": "platform_id"}[table]
+    return pd.DataFrame({column: [after + 1, after + 2]})
+
+
+def test_export_incremental_moves_watermarks():
+    fake_engine = MagicMock()
+
+    with patch("historical_pipeline.get_engine", return_value=fake_engine), \
+            patch("historical_pipeline.lock_export_tables") as mock_lock, \
+            patch("historical_pipeline.read_watermarks", return_value={"listing": 7}), \
+            patch("historical_pipeline.extract_new_rows",
+                  side_effect=lambda conn, table, after: new_rows(table, after)), \
+            patch("historical_pipeline.load_dim_table") as mock_dim, \
+            patch("historical_pipeline.export_new_listings",
+                  return_value={"rows": 2, "last_id": 9}) as mock_listing, \
+            patch("historical_pipeline.save_watermarks") as mock_save, \
+            patch("historical_pipeline.delete_exported_listings") as mock_delete, \
+            patch("historical_pipeline.promote_staged_listings") as mock_promote:
+
+        export_incremental()
+
+        mock_lock.assert_called_once()
+        assert mock_dim.call_count == 2
+        assert mock_listing.call_args[0][1] == 7
+        assert mock_save.call_args[0][1] == {"game": 2, "platform": 2, "listing": 9}
+        assert mock_delete.call_args[0][1] == 9
+        # leftovers of the last run, then this run's files once committed
+        assert [call[0][0] for call in mock_promote.call_args_list] == [7, 9]
+
+
+def test_export_incremental_failed_write_keeps_rows():
+    with patch("historical_pipeline.get_engine", return_value=MagicMock()), \
+            patch("historical_pipeline.lock_export_tables"), \
+            patch("historical_pipeline.read_watermarks", return_value={}), \
+            patch("historical_pipeline.extract_new_rows",
+                  side_effect=lambda conn, table, after: new_rows(table, after)), \
+            patch("historical_pipeline.load_dim_table"), \
+            patch("historical_pipeline.export_new_listings", side_effect=OSError("S3 down")), \
+            patch("historical_pipeline.save_watermarks") as mock_save, \
+            patch("historical_pipeline.delete_exported_listings") as mock_delete, \
+            patch("historical_pipeline.promote_staged_listings") as mock_promote:
+
+        with pytest.raises(OSError):
+            export_incremental()
+
+        mock_save.assert_not_called()
+        mock_delete.assert_not_called()
+        # only the clean up of earlier runs, nothing of this run is moved in
+        assert [call[0][0] for call in mock_promote.call_args_list] == [0]
+
+
+def listing_rows(first_id, count):
+    return [(listing_id, 1, 2, 999, 10, date(2025, 3, 4 + listing_id % 2))
+            for listing_id in range(first_id, first_id + count)]
+
+
+def test_listing_record_batch_types_and_partitions():
+    batch = listing_record_batch(listing_rows(1, 2))
+
+    assert batch.schema.field("listing_id").type == pa.int64()
+    assert batch.schema.field("recording_date").type == pa.timestamp("ms")
+    assert batch.column("day").to_pylist() == [5, 4]
+    assert batch.column("month").to_pylist() == [3, 3]
+    assert batch.column("game_bucket").to_pylist() == [1, 1]
+
+
+def test_stream_new_listings_reads_in_batches():
+    fake_conn = MagicMock()
+    result = fake_conn.execute.return_value
+    result.partitions.return_value = iter([listing_rows(8, 3), listing_rows(11, 1)])
+    exported = {"rows": 0, "last_id": None}
+
+    with patch("historical_pipeline.EXPORT_BATCH_SIZE", 3):
+        batches = list(stream_new_listings(fake_conn, 7, exported))
+
+    query, parameters = fake_conn.execute.call_args[0]
+    assert query.get_execution_options() == {"stream_results": True, "max_row_buffer": 3}
+    assert parameters == {"after": 7}
+    assert [batch.num_rows for batch in batches] == [3, 1]
+    assert exported == {"rows": 4, "last_id": 11}
+
+
+def test_write_listing_batches_partitions_by_day_and_bucket(tmp_path):
+    batches = iter([listing_record_batch(listing_rows(1, 3)),
+                    listing_record_batch(listing_rows(4, 2))])
+
+    write_listing_batches(batches, str(tmp_path))
+    write_listing_batches(iter([listing_record_batch(listing_rows(6, 1))]), str(tmp_path))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["year=2025"]
+    month = tmp_path / "year=2025" / "month=3"
+    assert sorted(path.name for path in month.iterdir()) == ["day=4", "day=5"]
+    assert [path.name for path in (month / "day=4").iterdir()] == ["game_bucket=1"]
+    table = pq.read_table(month / "day=4" / "game_bucket=1")
+    assert sorted(table.column("listing_id").to_pylist()) == [2, 4, 6]
+    assert "year" not in table.column_names
+
+
+def test_export_new_listings_stages_files(tmp_path):
+    fake_conn = MagicMock()
+    fake_conn.execute.return_value.partitions.return_value = iter([listing_rows(8, 2)])
+
+    result = export_new_listings(fake_conn, 7, str(tmp_path))
+
+    assert result == {"rows": 2, "last_id": 9}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["_staging"]
+    assert [path.name for path in (tmp_path / "_staging").iterdir()] == ["after=7"]
+
+
+def test_promote_staged_listings_moves_committed_exports(tmp_path):
+    write_listing_batches(iter([listing_record_batch(listing_rows(8, 2))]),
+                          staging_path(7, str(tmp_path)))
+
+    assert promote_staged_listings(9, str(tmp_path)) == 2
+
+    assert not (tmp_path / "_staging" / "after=7").exists()
+    table = pq.read_table(tmp_path / "year=2025" / "month=3")
+    assert sorted(table.column("listing_id").to_pylist()) == [8, 9]
+
+
+def test_promote_staged_listings_retry_writes_once(tmp_path):
+    # the first run staged its files and failed before committing watermark 9
+    write_listing_batches(iter([listing_record_batch(listing_rows(8, 2))]),
+                          staging_path(7, str(tmp_path)))
+    assert promote_staged_listings(7, str(tmp_path)) == 0
+    assert not (tmp_path / "_staging" / "after=7").exists()
+
+    # the retry exports the same rows again and commits
+    write_listing_batches(iter([listing_record_batch(listing_rows(8, 2))]),
+                          staging_path(7, str(tmp_path)))
+    promote_staged_listings(9, str(tmp_path))
+
+    table = pq.read_table(tmp_path / "year=2025" / "month=3")
+    assert sorted(table.column("listing_id").to_pylist()) == [8, 9]
+
+
+def test_promote_staged_listings_nothing_staged(tmp_path):
+    assert promote_staged_listings(9, str(tmp_path)) == 0
+
+
 def test_lambda_handler():
     with patch("historical_pipeline.main") as mock_main:
         response = lambda_handler({}, {})
@@ -105,3 +300,15 @@ def test_lambda_handler():
         mock_main.assert_called_once()
         assert response == {"status": "success",
                             "msg": "Historical pipeline completed"}
+
+
+def test_import_skips_slow_modules():
+    """awswrangler, pandas and SQLAlchemy wait until the pipeline runs"""
+    output = subprocess.run(
+        [sys.executable, '-c',
+         'import json, sys, historical_pipeline; print(json.dumps(list(sys.modules)))'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+    loaded = json.loads(output.stdout.splitlines()[-1])
+
+    assert not {'awswrangler', 'pandas', 'sqlalchemy'} & set(loaded)
@@ -48,4 +48,42 @@ resource "aws_lambda_function" "wishbone-etl-lambda" {
   }
   memory_size = 1024
   timeout = 300
-}
\ No newline at end of file
+}
+
+resource "aws_iam_role_policy" "etl-coordinator-invoke-search" {
+  name = "wishbone-etl-coordinator-invoke-search"
+  role = aws_iam_role.wishbone-etl-role.id
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "lambda:InvokeFunction"
+        Effect = "Allow"
+        Resource = "arn:aws:lambda:eu-west-2:129033205317:function:wishbone-search-lambda"
+      },
+    ]
+  })
+}
+
+resource "aws_lambda_function" "wishbone-etl-coordinator-lambda" {
+  function_name = "wishbone-etl-coordinator-lambda"
+  role = aws_iam_role.wishbone-etl-role.arn
+  package_type = "Image"
+  image_uri = "129033205317.dkr.ecr.eu-west-2.amazonaws.com/c20-wishbone-etl-ecr:latest"
+  architectures = ["x86_64"]
+  image_config {
+    command = ["coordinator.lambda_handler"]
+  }
+  environment {
+    variables = {
+      DB_NAME = var.DB_NAME
+      PORT = var.PORT
+      RDS_HOST = var.RDS_HOST
+      RDS_PASSWORD = var.RDS_PASSWORD
+      RDS_USERNAME = var.RDS_USERNAME
+      WORKER_FUNCTION_NAME = "wishbone-search-lambda"
+    }
+  }
+  memory_size = 512
+  timeout = 900
+}
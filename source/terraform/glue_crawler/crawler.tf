@@ -56,6 +56,91 @@ resource "aws_glue_crawler" "wishbone-crawler" {
   database_name = aws_glue_catalog_database.wishbone-glue-db.name
   s3_target {
     path = "s3://c20-wishbone-s3"
+    # the listing table is defined below with partition projection
+    exclusions = ["input/listing/**"]
   }
   schedule = "cron(30 0 * * ? *)"
-}
\ No newline at end of file
+}
+
+variable "game_buckets" {
+  description = "Number of game_bucket partitions of a day, GAME_BUCKETS of the historical pipeline and mailing"
+  type        = number
+  default     = 8
+}
+
+# Athena works out the partitions from these ranges instead of the crawler listing them,
+# queries only open the year/month/day/game_bucket folders their WHERE clause allows
+resource "aws_glue_catalog_table" "wishbone-listing" {
+  name          = "listing"
+  database_name = aws_glue_catalog_database.wishbone-glue-db.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    EXTERNAL                       = "TRUE"
+    "classification"               = "parquet"
+    "parquet.compression"          = "SNAPPY"
+    "projection.enabled"           = "true"
+    "projection.year.type"         = "integer"
+    "projection.year.range"        = "2025,2035"
+    "projection.month.type"        = "integer"
+    "projection.month.range"       = "1,12"
+    "projection.day.type"          = "integer"
+    "projection.day.range"         = "1,31"
+    "projection.game_bucket.type"  = "integer"
+    "projection.game_bucket.range" = "0,${var.game_buckets - 1}"
+    "storage.location.template"    = "s3://c20-wishbone-s3/input/listing/year=$${year}/month=$${month}/day=$${day}/game_bucket=$${game_bucket}"
+  }
+
+  partition_keys {
+    name = "year"
+    type = "int"
+  }
+  partition_keys {
+    name = "month"
+    type = "int"
+  }
+  partition_keys {
+    name = "day"
+    type = "int"
+  }
+  partition_keys {
+    name = "game_bucket"
+    type = "int"
+  }
+
+  storage_descriptor {
+    location      = "s3://c20-wishbone-s3/input/listing/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    # bigint reads both the 32 bit ints of streamed files and the 64 bit ints of older ones
+    columns {
+      name = "listing_id"
+      type = "bigint"
+    }
+    columns {
+      name = "game_id"
+      type = "bigint"
+    }
+    columns {
+      name = "platform_id"
+      type = "bigint"
+    }
+    columns {
+      name = "price"
+      type = "bigint"
+    }
+    columns {
+      name = "discount_percent"
+      type = "bigint"
+    }
+    columns {
+      name = "recording_date"
+      type = "timestamp"
+    }
+  }
+}